@@ -6,6 +6,12 @@ from chat_api.services.document_store import DocumentStore
 import os
 from pathlib import Path
 
+def _reload_hint():
+    interval = float(os.getenv("KB_RELOAD_INTERVAL", 30))
+    if interval > 0:
+        return f"A running Django server picks up the new documents within {interval:g} seconds."
+    return "Hot reload is off (KB_RELOAD_INTERVAL=0): restart your Django server to load the new documents."
+
 def add_multiple_documents():
     """Interactive script to add multiple documents"""
     doc_store = DocumentStore()
@@ -37,18 +43,21 @@ def add_multiple_documents():
     
     print(f"\nAdding {len(documents)} document(s)...\n")
     
+    to_add = []
     for file_path, source_name in documents:
         try:
             with open(file_path, 'r', encoding='utf-8') as f:
                 content = f.read()
             
-            doc_store.add_document(content=content, source=source_name)
-            print(f"✓ Added: {source_name}")
+            to_add.append({"content": content, "source": source_name})
+            print(f"✓ Read: {source_name}")
         except Exception as e:
-            print(f"✗ Failed to add {source_name}: {e}")
+            print(f"✗ Failed to read {source_name}: {e}")
     
-    print(f"\n✓ Completed! Added {len(documents)} document(s) to knowledge base.")
-    print("Restart your Django server to load the new documents.")
+    # Chunks from all documents are embedded together in batched API calls
+    doc_store.add_documents(to_add)
+    print(f"\n✓ Completed! Added {len(to_add)} document(s) to knowledge base.")
+    print(_reload_hint())
 
 if __name__ == "__main__":
     add_multiple_documents()
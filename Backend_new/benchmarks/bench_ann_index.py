@@ -0,0 +1,70 @@
+"""
+Recall and latency of IVFIndex against the exact VectorIndex.
+Usage: python -m benchmarks.bench_ann_index [--size 50000] [--dim 768] [--n-probe 1 4 8 16 32]
+
+Vectors are drawn from a Gaussian mixture so the data has the cluster
+structure real embeddings have; uniform random vectors are a worst case for
+any partitioning index.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from chat_api.services.ivf_index import IVFIndex
+from chat_api.services.vector_index import VectorIndex
+
+
+def make_dataset(size, dim, queries, clusters, spread, rng):
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size + queries)
+    points = centers[labels] + spread * rng.standard_normal((size + queries, dim)).astype(np.float32)
+    return points[:size], points[size:]
+
+
+def latencies(index, queries, top_k, **kwargs):
+    results, timings = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append([item_id for item_id, _ in index.search(query, top_k=top_k, **kwargs)])
+        timings.append(time.perf_counter() - start)
+    return results, np.array(timings) * 1000
+
+
+def run(size, dim, n_queries, top_k, n_lists, n_probes, clusters, spread):
+    rng = np.random.default_rng(7)
+    vectors, queries = make_dataset(size, dim, n_queries, clusters, spread, rng)
+
+    exact = VectorIndex(dim=dim, initial_capacity=size)
+    ivf = IVFIndex(dim=dim, n_lists=n_lists, min_train_size=size, initial_capacity=size)
+    for i, vector in enumerate(vectors):
+        exact.add(i, vector)
+    start = time.perf_counter()
+    for i, vector in enumerate(vectors):
+        ivf.add(i, vector)  # trains k-means when the last vector arrives
+    build = time.perf_counter() - start
+
+    truth, exact_ms = latencies(exact, queries, top_k)
+    print(f"{size} vectors, dim {dim}, {len(ivf.centroids)} lists, IVF build {build:.2f}s, top_k={top_k}")
+    print(f"{'index':>12} | {'recall@k':>8} | {'p50 ms':>7} | {'p99 ms':>7}")
+    print("-" * 45)
+    print(f"{'exact':>12} | {1.0:>8.3f} | {np.percentile(exact_ms, 50):>7.3f} | {np.percentile(exact_ms, 99):>7.3f}")
+    for n_probe in n_probes:
+        found, ivf_ms = latencies(ivf, queries, top_k, n_probe=n_probe)
+        recall = np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)])
+        label = f"ivf/{n_probe}"
+        print(f"{label:>12} | {recall:>8.3f} | {np.percentile(ivf_ms, 50):>7.3f} | {np.percentile(ivf_ms, 99):>7.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--n-lists", type=int, default=None, help="defaults to sqrt(size)")
+    parser.add_argument("--n-probe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--clusters", type=int, default=200, help="mixture components in the synthetic data")
+    parser.add_argument("--spread", type=float, default=1.5, help="noise around each mixture component")
+    args = parser.parse_args()
+    run(args.size, args.dim, args.queries, args.top_k, args.n_lists, args.n_probe, args.clusters, args.spread)
@@ -0,0 +1,96 @@
+"""
+Concurrency scaling of ChatService (one thread per request) vs AsyncChatService (one event loop)
+against a local Gemini stub and FakeEmbeddingBackend; no network access or MongoDB needed.
+Usage: python -m benchmarks.bench_async_chat [--requests 400] [--concurrency 1,10,50,200]
+                                             [--threads 16] [--latency 0.5] [--embed-latency 0.05]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("GEMINI_API_KEY", "stub")
+
+from chat_api.services import document_store as document_store_module
+from chat_api.services import chat_service as chat_service_module
+from chat_api.services.document_store import DocumentStore
+from chat_api.services.embedding_client import EmbeddingClient, FakeEmbeddingBackend
+from .gemini_stub import stub_gemini
+
+DOCUMENTS = [
+    ("Box breathing: breathe in for four counts, hold for four, breathe out for four, hold for four.", "breathing.txt"),
+    ("Keep a consistent sleep schedule and put screens away an hour before bed.", "sleep.txt"),
+    ("Break exam preparation into small tasks and take short breaks between them.", "study.txt"),
+]
+
+
+def _summary(label, concurrency, latencies, elapsed):
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"{label:>6} | {concurrency:>11} | {len(latencies) / elapsed:>9.1f} | "
+          f"{statistics.median(latencies) * 1000:>8.0f} | {p95 * 1000:>8.0f}")
+
+
+def run_sync(service, messages, concurrency, threads):
+    def timed(message):
+        start = time.perf_counter()
+        service(message)
+        return time.perf_counter() - start
+
+    # A threaded WSGI server never runs more requests at once than it has worker threads
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=min(concurrency, threads)) as pool:
+        latencies = list(pool.map(timed, messages))
+    return latencies, time.perf_counter() - start
+
+
+async def run_async(service, messages, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed(message):
+        async with semaphore:
+            start = time.perf_counter()
+            await service(message)
+            return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(timed(message) for message in messages))
+    return latencies, time.perf_counter() - start
+
+
+def run(requests, concurrency_levels, threads, latency, embed_latency):
+    with tempfile.TemporaryDirectory() as docs_dir:
+        client = EmbeddingClient(backend=FakeEmbeddingBackend(latency=embed_latency), requests_per_minute=600000)
+        store = DocumentStore(docs_dir=docs_dir, embedding_client=client)
+        store.add_documents([{"content": content, "source": source} for content, source in DOCUMENTS])
+        document_store_module._document_store = store
+
+        sync_service = chat_service_module.ChatService()
+        async_service = chat_service_module.AsyncChatService()
+        print(f"{requests} requests, generation {latency * 1000:.0f} ms, embedding {embed_latency * 1000:.0f} ms, "
+              f"{threads} sync worker threads")
+        print(f"{'path':>6} | {'concurrency':>11} | {'req/s':>9} | {'p50 ms':>8} | {'p95 ms':>8}")
+        print("-" * 55)
+        with stub_gemini(latency):
+            for concurrency in concurrency_levels:
+                # Distinct messages so the query embedding cache does not hide the embedding call
+                messages = [f"request {concurrency}-{i}: how can I sleep better before exams?" for i in range(requests)]
+                latencies, elapsed = run_sync(sync_service, [f"sync {m}" for m in messages], concurrency, threads)
+                _summary("sync", concurrency, latencies, elapsed)
+                latencies, elapsed = asyncio.run(run_async(async_service, [f"async {m}" for m in messages], concurrency))
+                _summary("async", concurrency, latencies, elapsed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", default="1,10,50,200", help="comma-separated in-flight request counts")
+    parser.add_argument("--threads", type=int, default=16, help="worker threads available to the sync path")
+    parser.add_argument("--latency", type=float, default=0.5, help="simulated seconds per Gemini generation")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="simulated seconds per embedding call")
+    args = parser.parse_args()
+    levels = [int(level) for level in args.concurrency.split(",")]
+    run(args.requests, levels, args.threads, args.latency, args.embed_latency)
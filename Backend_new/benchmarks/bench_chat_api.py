@@ -0,0 +1,469 @@
+"""
+Load test of the chat API: POST /api/chat/, POST /api/chat/stream/ and GET /api/chat/history/ through
+the full Django stack (ASGI handler, middleware, JWT authentication, URL routing, views, chat log
+writer) at controlled concurrency. Requests are sent to the ASGI application on one event loop, as
+uvicorn does, so views that would serialize on Django's sync thread or buffer a stream show up as
+lost throughput and a late first byte.
+Gemini generation and embeddings are replaced by in-process stubs with configurable latency and
+error rate. MongoDB is a local server (--mongo-uri; its benchmark database is wiped) or, by default,
+in memory via mongomock (pip install -r benchmarks/requirements.txt).
+
+Reports throughput, p50/p95/p99 latency and p50 time to first byte per endpoint and concurrency level. --save-baseline writes
+the results to a JSON file; --baseline compares against one and exits with status 1 when p95 or
+throughput is worse than the baseline by more than --tolerance.
+
+Usage: python -m benchmarks.bench_chat_api [--requests 200] [--concurrency 1,8,32] [--users 20]
+                                           [--latency 0.05] [--embed-latency 0.005] [--error-rate 0]
+                                           [--mongo-uri URI] [--baseline FILE] [--save-baseline FILE]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from urllib.parse import urlencode
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "digibuddy.settings")
+os.environ.setdefault("GEMINI_API_KEY", "stub")
+# Query logging under DEBUG grows without bound during a load test
+os.environ["DEBUG"] = "False"
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baselines", "chat_api.json")
+HOST = "localhost"
+HISTORY_PAGES = 3
+
+
+def _percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list"""
+    index = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def _evaluate(expression, document):
+    """The aggregation expressions ChatHistoryView projects with; mongomock does not implement them"""
+    if isinstance(expression, str) and expression.startswith("$"):
+        return document.get(expression[1:])
+    if isinstance(expression, dict):
+        (operator, args), = expression.items()
+        values = [_evaluate(arg, document) for arg in args]
+        if operator == "$ifNull":
+            return next((value for value in values if value is not None), None)
+        if operator == "$substrCP":
+            text, start, length = values
+            return text[start:start + length]
+        raise ValueError(f"Unsupported projection expression: {operator}")
+    return expression
+
+
+class _ProjectedCursor:
+    def __init__(self, cursor, expressions, fetched):
+        self._cursor = cursor
+        self._expressions = expressions
+        self._fetched = fetched
+
+    def sort(self, *args, **kwargs):
+        self._cursor = self._cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, *args):
+        self._cursor = self._cursor.limit(*args)
+        return self
+
+    def __iter__(self):
+        for document in self._cursor:
+            for field, expression in self._expressions.items():
+                document[field] = _evaluate(expression, document)
+            for field in self._fetched:
+                document.pop(field, None)
+            yield document
+
+
+class _InMemoryCollection:
+    """mongomock collection that also evaluates computed projection fields"""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    def find(self, filter=None, projection=None, *args, **kwargs):
+        expressions = {key: value for key, value in (projection or {}).items() if isinstance(value, dict)}
+        if not expressions:
+            return self._collection.find(filter, projection, *args, **kwargs)
+        plain = {key: value for key, value in projection.items() if key not in expressions}
+        # Fetch the fields the expressions read, then drop them again unless they were projected
+        fetched = {ref[1:] for ref in _field_refs(expressions.values())} - set(plain)
+        cursor = self._collection.find(filter, dict(plain, **dict.fromkeys(fetched, 1)), *args, **kwargs)
+        return _ProjectedCursor(cursor, expressions, fetched)
+
+
+def _field_refs(expressions):
+    for expression in expressions:
+        if isinstance(expression, str) and expression.startswith("$"):
+            yield expression
+        elif isinstance(expression, dict):
+            yield from _field_refs(itertools.chain.from_iterable(expression.values()))
+        elif isinstance(expression, list):
+            yield from _field_refs(expression)
+
+
+class _InMemoryDatabase:
+    def __init__(self, database):
+        self._database = database
+
+    def __getattr__(self, name):
+        return self[name]
+
+    def __getitem__(self, name):
+        return _InMemoryCollection(self._database[name])
+
+
+class _AsyncCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def sort(self, *args, **kwargs):
+        self._cursor = self._cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, *args):
+        self._cursor = self._cursor.limit(*args)
+        return self
+
+    async def to_list(self, length=None):
+        return list(self._cursor.limit(length) if length else self._cursor)
+
+
+class _AsyncInMemoryCollection:
+    """Awaitable facade over a mongomock collection, standing in for the async MongoDB client"""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def find(self, *args, **kwargs):
+        return _AsyncCursor(self._collection.find(*args, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self._collection, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+
+class _AsyncInMemoryDatabase(_InMemoryDatabase):
+    def __getitem__(self, name):
+        return _AsyncInMemoryCollection(self._database[name])
+
+
+def _connect_mongo(mongo_uri, mongo_db_name):
+    """Point the app's MongoDB singleton at the benchmark database and empty it"""
+    from chat_api.services import mongo_client
+
+    if mongo_uri:
+        if mongo_db_name == "digibuddy":
+            sys.exit("Refusing to wipe the application database; pick another --mongo-db")
+        os.environ["MONGODB_URI"] = mongo_uri
+        os.environ["MONGODB_DB"] = mongo_db_name
+        db = mongo_client.mongo_db()
+        for collection in ("chats", "conversations", "users"):
+            db[collection].delete_many({})
+        return db, f"{mongo_uri}/{mongo_db_name}"
+
+    try:
+        import mongomock
+    except ImportError:
+        sys.exit("In-memory mode needs mongomock (pip install -r benchmarks/requirements.txt), or pass --mongo-uri")
+    from chat_api import views
+
+    database = mongomock.MongoClient()[mongo_db_name]
+    db = _InMemoryDatabase(database)
+    mongo_client._mongo_db = db
+    async_db = _AsyncInMemoryDatabase(database)
+    views.async_mongo_db = lambda: async_db
+    return db, "mongomock (in memory)"
+
+
+def _seed(db, users, seed_chats):
+    """Django users with access tokens, their Mongo profiles and `seed_chats` history records each"""
+    from django.contrib.auth.models import User
+    from django.utils import timezone
+    from rest_framework_simplejwt.tokens import RefreshToken
+
+    tokens = []
+    start = timezone.now() - timedelta(days=30)
+    for i in range(users):
+        user = User.objects.create_user(f"bench{i}", f"bench{i}@example.com", "bench")
+        db.users.insert_one({"email": user.email, "google_id": f"google-{i}"})
+        db.chats.insert_many([
+            {
+                "user_id": user.id,
+                "user_email": user.email,
+                "message": f"Earlier question {n} about sleep and stress",
+                "response": "Earlier answer. " * 40,
+                "status": "success",
+                "created_at": start + timedelta(minutes=n),
+            }
+            for n in range(seed_chats)
+        ])
+        tokens.append(str(RefreshToken.for_user(user).access_token))
+    return tokens
+
+
+async def asgi_request(application, method, path, token, body=None, query=None):
+    """Send one HTTP request to an ASGI application; returns (status, body, seconds to first body byte)"""
+    payload = json.dumps(body).encode("utf-8") if body is not None else b""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode("ascii"),
+        "query_string": urlencode(query or {}).encode("ascii"),
+        "root_path": "",
+        "headers": [
+            (b"host", HOST.encode("ascii")),
+            (b"authorization", f"Bearer {token}".encode("ascii")),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(payload)).encode("ascii")),
+        ],
+        "client": ("127.0.0.1", 50000),
+        "server": (HOST, 80),
+    }
+    started = time.perf_counter()
+    finished = asyncio.Event()
+    request_sent = False
+    response = {"status": None, "body": [], "first_byte": None}
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+        # Like a client that stays connected until the response is complete
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            if message.get("body"):
+                if response["first_byte"] is None:
+                    response["first_byte"] = time.perf_counter() - started
+                response["body"].append(message["body"])
+            if not message.get("more_body", False):
+                finished.set()
+
+    await application(scope, receive, send)
+    finished.set()
+    return response["status"], b"".join(response["body"]), response["first_byte"]
+
+
+class LoadTest:
+    """Drives one endpoint of the ASGI application with `concurrency` requests in flight on one event loop"""
+
+    def __init__(self, application, tokens):
+        self.application = application
+        self.tokens = tokens
+        self.conversations = {}
+        self._counter = itertools.count()
+
+    def _chat_body(self, user):
+        body = {"message": f"Request {next(self._counter)}: how can I sleep better before exams?"}
+        if user in self.conversations:
+            body["conversation_id"] = self.conversations[user]
+        return body
+
+    async def chat(self, i):
+        """One chat turn, continuing the user's conversation; returns (ok, seconds to first byte)"""
+        user = i % len(self.tokens)
+        status, body, first_byte = await asgi_request(
+            self.application, "POST", "/api/chat/", self.tokens[user], self._chat_body(user)
+        )
+        if status != 200:
+            return False, first_byte
+        data = json.loads(body)
+        self.conversations.setdefault(user, data["conversation_id"])
+        return data["status"] == "success", first_byte
+
+    async def stream(self, i):
+        """One streamed chat turn; the first byte is the first SSE event"""
+        user = i % len(self.tokens)
+        status, body, first_byte = await asgi_request(
+            self.application, "POST", "/api/chat/stream/", self.tokens[user], self._chat_body(user)
+        )
+        return status == 200 and b"event: done" in body, first_byte
+
+    async def history(self, i):
+        """The first HISTORY_PAGES pages of the user's chat history"""
+        token = self.tokens[i % len(self.tokens)]
+        cursor = None
+        first_byte = None
+        for _ in range(HISTORY_PAGES):
+            params = {"limit": 20}
+            if cursor:
+                params["cursor"] = cursor
+            status, body, page_first_byte = await asgi_request(
+                self.application, "GET", "/api/chat/history/", token, query=params
+            )
+            first_byte = first_byte if first_byte is not None else page_first_byte
+            if status != 200:
+                return False, first_byte
+            cursor = json.loads(body)["next_cursor"]
+            if not cursor:
+                break
+        return True, first_byte
+
+    async def run(self, operation, requests, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def timed(i):
+            async with semaphore:
+                start = time.perf_counter()
+                ok, first_byte = await operation(i)
+                return time.perf_counter() - start, ok, first_byte
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(timed(i) for i in range(requests)))
+        elapsed = time.perf_counter() - start
+        latencies = sorted(latency for latency, _, _ in results)
+        first_bytes = sorted(first_byte for _, _, first_byte in results if first_byte is not None) or [0.0]
+        return {
+            "requests": requests,
+            "errors": sum(1 for _, ok, _ in results if not ok),
+            "throughput": requests / elapsed,
+            "p50_ms": _percentile(latencies, 50) * 1000,
+            "p95_ms": _percentile(latencies, 95) * 1000,
+            "p99_ms": _percentile(latencies, 99) * 1000,
+            "first_byte_p50_ms": _percentile(first_bytes, 50) * 1000,
+        }
+
+
+def _print_row(endpoint, concurrency, result):
+    print(f"{endpoint:>8} | {concurrency:>11} | {result['throughput']:>8.1f} | {result['p50_ms']:>7.1f} | "
+          f"{result['p95_ms']:>7.1f} | {result['p99_ms']:>7.1f} | {result['first_byte_p50_ms']:>9.1f} | "
+          f"{result['errors']:>6}")
+
+
+def compare(results, baseline, tolerance):
+    """Print regressions against a baseline; returns True if there are none"""
+    if baseline["settings"] != results["settings"]:
+        print(f"\nWarning: baseline was recorded with different settings: {baseline['settings']}")
+    ok = True
+    print(f"\nCompared with baseline ({tolerance:.0%} tolerance):")
+    for key, result in results["results"].items():
+        reference = baseline["results"].get(key)
+        if reference is None:
+            continue
+        p95_change = result["p95_ms"] / reference["p95_ms"] - 1
+        throughput_change = result["throughput"] / reference["throughput"] - 1
+        regressed = p95_change > tolerance or throughput_change < -tolerance
+        ok = ok and not regressed
+        print(f"  {key:>14}: p95 {p95_change:+.0%}, throughput {throughput_change:+.0%}"
+              f"{'  REGRESSION' if regressed else ''}")
+    return ok
+
+
+def run(args):
+    import django
+    django.setup()
+    from django.test.utils import setup_test_environment
+    from django.test.runner import DiscoverRunner
+
+    from chat_api.services import chat_log_writer
+    from chat_api.services import document_store as document_store_module
+    from chat_api.services.document_store import DocumentStore
+    from chat_api.services.embedding_client import EmbeddingClient, FakeEmbeddingBackend
+    from digibuddy.asgi import application
+    from .bench_async_chat import DOCUMENTS
+    from .gemini_stub import stub_gemini
+
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0)
+    old_config = runner.setup_databases()
+    try:
+        db, mongo_label = _connect_mongo(args.mongo_uri, args.mongo_db)
+        tokens = _seed(db, args.users, args.seed_chats)
+        with tempfile.TemporaryDirectory() as docs_dir:
+            store = DocumentStore(
+                docs_dir=docs_dir,
+                embedding_client=EmbeddingClient(backend=FakeEmbeddingBackend(), requests_per_minute=600000),
+            )
+            store.add_documents([{"content": content, "source": source} for content, source in DOCUMENTS])
+            # The knowledge base is embedded up front; query embeddings get the simulated latency and errors
+            backend = FakeEmbeddingBackend(latency=args.embed_latency, failure_rate=args.error_rate, seed=args.seed)
+            store.embedding_client = EmbeddingClient(backend=backend, requests_per_minute=600000)
+            document_store_module._document_store = store
+
+            settings = {
+                "requests": args.requests,
+                "users": args.users,
+                "seed_chats": args.seed_chats,
+                "latency": args.latency,
+                "embed_latency": args.embed_latency,
+                "error_rate": args.error_rate,
+                "mongo": "server" if args.mongo_uri else "memory",
+            }
+            results = {"settings": settings, "results": {}}
+            print(f"MongoDB: {mongo_label}; Python {platform.python_version()}; {json.dumps(settings)}")
+            print(f"{'endpoint':>8} | {'concurrency':>11} | {'req/s':>8} | {'p50 ms':>7} | {'p95 ms':>7} | "
+                  f"{'p99 ms':>7} | {'1st byte':>9} | {'errors':>6}")
+            print("-" * 84)
+            load_test = LoadTest(application, tokens)
+            endpoints = (("chat", load_test.chat), ("stream", load_test.stream), ("history", load_test.history))
+            with stub_gemini(args.latency, error_rate=args.error_rate, seed=args.seed):
+                for concurrency in args.concurrency:
+                    for endpoint, operation in endpoints:
+                        result = asyncio.run(load_test.run(operation, args.requests, concurrency))
+                        results["results"][f"{endpoint}@{concurrency}"] = result
+                        _print_row(endpoint, concurrency, result)
+            writer = chat_log_writer.get_chat_log_writer()
+            writer.close()
+            print(f"Chat log writer: {json.dumps(writer.stats())}")
+    finally:
+        runner.teardown_databases(old_config)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint and concurrency level")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated in-flight request counts")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--seed-chats", type=int, default=100, help="history records created per user")
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated seconds per Gemini generation")
+    parser.add_argument("--embed-latency", type=float, default=0.005, help="simulated seconds per embedding call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of Gemini calls that fail")
+    parser.add_argument("--seed", type=int, default=0, help="seed for error injection")
+    parser.add_argument("--mongo-uri", help="local MongoDB server to use instead of mongomock")
+    parser.add_argument("--mongo-db", default="digibuddy_bench", help="benchmark database (wiped before the run)")
+    parser.add_argument("--baseline", nargs="?", const=BASELINE_FILE, help="compare with a baseline JSON file")
+    parser.add_argument("--save-baseline", nargs="?", const=BASELINE_FILE, help="write the results as a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression")
+    parser.add_argument("--verbose", action="store_true", help="keep application logging")
+    args = parser.parse_args()
+    args.concurrency = [int(level) for level in args.concurrency.split(",")]
+    run(args)
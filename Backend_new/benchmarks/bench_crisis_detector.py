@@ -0,0 +1,74 @@
+"""
+Microbenchmark: the Aho-Corasick crisis detector vs. a regex alternation of the same phrases.
+Benign messages are the worst case (the whole message is scanned); --match-at-end appends a crisis
+phrase as the last words. Usage:
+python -m benchmarks.bench_crisis_detector [--lengths 100 1000 10000 100000] [--messages 200]
+"""
+import argparse
+import random
+import re
+import time
+
+from chat_api.services.safety import CRISIS_PHRASES, contains_crisis_indicators
+
+# The matcher contains_crisis_indicators used before the Aho-Corasick automaton
+_CRISIS_RE = re.compile("|".join(re.escape(phrase) for phrase in CRISIS_PHRASES), re.IGNORECASE)
+
+WORDS = (
+    "i have been feeling stressed about exams and my sleep is not great lately so i wanted to ask "
+    "how to stay calm before a presentation my friends say breathing exercises help but sometimes "
+    "i still feel anxious and tired after long days at university work and family"
+).split()
+
+
+def regex_detector(text):
+    return bool(_CRISIS_RE.search(text.replace("’", "'")))
+
+
+def make_messages(length, count, match_at_end, seed=0):
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        words = []
+        size = 0
+        while size < length:
+            word = rng.choice(WORDS)
+            words.append(word.capitalize() if rng.random() < 0.1 else word)
+            size += len(word) + 1
+        message = " ".join(words)[:length]
+        if match_at_end:
+            message += " and sometimes I want to die"
+        messages.append(message)
+    return messages
+
+
+def time_per_message(fn, messages, expected):
+    start = time.perf_counter()
+    for message in messages:
+        if fn(message) != expected:
+            raise AssertionError(f"{fn.__name__} returned {not expected} for a {len(message)}-char message")
+    return (time.perf_counter() - start) / len(messages)
+
+
+def run(lengths, count, match_at_end):
+    print(f"{'chars':>7} | {'regex':>10} | {'aho-corasick':>12} | {'speedup':>7} | {'throughput':>10}")
+    print("-" * 60)
+    for length in lengths:
+        messages = make_messages(length, count, match_at_end)
+        regex_time = time_per_message(regex_detector, messages, match_at_end)
+        detector_time = time_per_message(contains_crisis_indicators, messages, match_at_end)
+        megabytes = sum(len(message.encode("utf-8")) for message in messages) / count / 1e6
+        print(
+            f"{length:>7} | {regex_time * 1e6:>7.1f} us | {detector_time * 1e6:>9.1f} us | "
+            f"{regex_time / detector_time:>6.1f}x | {megabytes / detector_time:>5.1f} MB/s"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lengths", type=int, nargs="+", default=[100, 1000, 10000, 100000],
+                        help="message lengths in characters")
+    parser.add_argument("--messages", type=int, default=200, help="messages timed per length")
+    parser.add_argument("--match-at-end", action="store_true", help="end every message with a crisis phrase")
+    args = parser.parse_args()
+    run(args.lengths, args.messages, args.match_at_end)
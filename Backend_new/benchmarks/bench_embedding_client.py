@@ -0,0 +1,51 @@
+"""
+Offline throughput/retry benchmark for EmbeddingClient using FakeEmbeddingBackend.
+Ends with a burst of identical concurrent queries, which single-flight collapses into one API call.
+Usage: python -m benchmarks.bench_embedding_client [--texts 2000] [--latency 0.05] [--failure-rate 0.1] [--burst 50]
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from chat_api.services.embedding_client import EmbeddingClient, FakeEmbeddingBackend
+
+
+def run(texts, latency, failure_rate, requests_per_minute):
+    corpus = [f"knowledge base chunk number {i} about sleep, stress and breathing" for i in range(texts)]
+    print(f"{'batch':>6} | {'workers':>7} | {'calls':>6} | {'failed':>6} | {'texts/s':>9}")
+    print("-" * 48)
+    for batch_size, max_workers in [(1, 1), (100, 1), (100, 4), (100, 8)]:
+        backend = FakeEmbeddingBackend(latency=latency, failure_rate=failure_rate, seed=batch_size + max_workers)
+        client = EmbeddingClient(
+            backend=backend, batch_size=batch_size, max_workers=max_workers,
+            requests_per_minute=requests_per_minute, backoff_base=0.05, backoff_max=1.0,
+        )
+        sample = corpus if batch_size > 1 else corpus[:max(1, texts // 20)]
+        start = time.perf_counter()
+        results = client.embed_many(sample)
+        elapsed = time.perf_counter() - start
+        failed = sum(1 for result in results if result is None)
+        print(f"{batch_size:>6} | {max_workers:>7} | {backend.calls:>6} | {failed:>6} | {len(sample) / elapsed:>9.0f}")
+
+
+def run_burst(burst, latency, requests_per_minute):
+    backend = FakeEmbeddingBackend(latency=latency)
+    client = EmbeddingClient(backend=backend, requests_per_minute=requests_per_minute)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=burst) as pool:
+        list(pool.map(lambda _: client.embed_query("how can I sleep better before exams?"), range(burst)))
+    elapsed = time.perf_counter() - start
+    print(f"\n{burst} concurrent identical queries: {backend.calls} backend call(s) in {elapsed * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated seconds per API call")
+    parser.add_argument("--failure-rate", type=float, default=0.1, help="probability of a simulated 429")
+    parser.add_argument("--rpm", type=float, default=6000, help="requests-per-minute limit")
+    parser.add_argument("--burst", type=int, default=50, help="concurrent identical queries (0 to skip)")
+    args = parser.parse_args()
+    run(args.texts, args.latency, args.failure_rate, args.rpm)
+    if args.burst:
+        run_burst(args.burst, args.latency, args.rpm)
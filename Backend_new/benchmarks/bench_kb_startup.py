@@ -0,0 +1,74 @@
+"""
+Macrobenchmark: DocumentStore startup on the per-file layout vs. the packed layout
+(documents.jsonl + memory-mapped float32 embeddings). Both knowledge bases are built with the
+offline fake embedder, so startup never embeds anything. Usage:
+python -m benchmarks.bench_kb_startup [--documents 100 1000 5000] [--dim 768] [--repeat 3]
+"""
+import argparse
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from chat_api.services.document_store import DocumentStore
+from chat_api.services.embedding_client import EmbeddingClient, FakeEmbeddingBackend
+from chat_api.services.query_cache import QueryEmbeddingCache
+
+WORDS = (
+    "sleep stress exams breathing routine friends family focus anxiety calm study break walk "
+    "water music journal schedule support campus counselling deadline rest mood energy"
+).split()
+
+
+def make_documents(count, seed=0):
+    rng = random.Random(seed)
+    return [
+        {"content": " ".join(rng.choice(WORDS) for _ in range(rng.randint(150, 400))), "source": f"doc{i}.txt"}
+        for i in range(count)
+    ]
+
+
+def open_store(docs_dir, storage, dim):
+    client = EmbeddingClient(backend=FakeEmbeddingBackend(dim=dim), requests_per_minute=600000)
+    return DocumentStore(docs_dir=str(docs_dir), embedding_client=client, storage=storage,
+                         query_cache=QueryEmbeddingCache())
+
+
+def time_startup(docs_dir, storage, dim, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        store = open_store(docs_dir, storage, dim)
+        best = min(best, time.perf_counter() - start)
+        if store.has_unembedded_chunks:
+            raise AssertionError(f"{storage} layout lost embeddings")
+    return best
+
+
+def run(sizes, dim, repeat):
+    print(f"{'documents':>9} | {'chunks':>7} | {'files':>9} | {'packed':>9} | {'speedup':>7}")
+    print("-" * 55)
+    for size in sizes:
+        documents = make_documents(size)
+        timings = {}
+        with tempfile.TemporaryDirectory() as root:
+            for storage in ("files", "packed"):
+                docs_dir = Path(root) / storage
+                store = open_store(docs_dir, storage, dim)
+                store.add_documents([dict(doc) for doc in documents])
+                chunks = len(store.chunks)
+                timings[storage] = time_startup(docs_dir, storage, dim, repeat)
+        print(
+            f"{size:>9} | {chunks:>7} | {timings['files'] * 1000:>6.0f} ms | {timings['packed'] * 1000:>6.0f} ms | "
+            f"{timings['files'] / timings['packed']:>6.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, nargs="+", default=[100, 1000, 5000],
+                        help="knowledge base sizes in documents")
+    parser.add_argument("--dim", type=int, default=768, help="embedding dimension")
+    parser.add_argument("--repeat", type=int, default=3, help="startups timed per layout (best is reported)")
+    args = parser.parse_args()
+    run(args.documents, args.dim, args.repeat)
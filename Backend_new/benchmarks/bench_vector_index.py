@@ -0,0 +1,65 @@
+"""
+Microbenchmark: VectorIndex vs. the original pure-Python similarity loop.
+Usage: python -m benchmarks.bench_vector_index [--sizes 1000 10000 100000] [--dim 768]
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from chat_api.services.vector_index import VectorIndex
+
+
+def python_loop_top_k(query, embeddings, top_k):
+    """The scoring loop DocumentStore.get_relevant_chunks used before VectorIndex"""
+    scored = [
+        (sum(q * d for q, d in zip(query, embedding)), i)
+        for i, embedding in enumerate(embeddings)
+    ]
+    scored.sort(reverse=True)
+    return scored[:top_k]
+
+
+def time_per_query(fn, queries):
+    start = time.perf_counter()
+    for query in queries:
+        fn(query)
+    return (time.perf_counter() - start) / len(queries)
+
+
+def run(sizes, dim, top_k, queries, loop_queries):
+    rng = np.random.default_rng(42)
+    print(f"{'vectors':>8} | {'python loop':>12} | {'VectorIndex':>12} | {'speedup':>8} | {'build':>8}")
+    print("-" * 62)
+    for size in sizes:
+        matrix = rng.standard_normal((size, dim)).astype(np.float32)
+        query_vectors = rng.standard_normal((queries, dim)).astype(np.float32)
+
+        start = time.perf_counter()
+        index = VectorIndex(dim=dim, initial_capacity=size)
+        for i, row in enumerate(matrix):
+            index.add(i, row)
+        build_time = time.perf_counter() - start
+
+        index_time = time_per_query(lambda q: index.search(q, top_k=top_k), query_vectors)
+
+        embeddings = matrix.tolist()
+        loop_sample = [q.tolist() for q in random.Random(0).sample(list(query_vectors), loop_queries)]
+        loop_time = time_per_query(lambda q: python_loop_top_k(q, embeddings, top_k), loop_sample)
+
+        print(
+            f"{size:>8} | {loop_time * 1000:>9.2f} ms | {index_time * 1000:>9.3f} ms | "
+            f"{loop_time / index_time:>7.0f}x | {build_time:>6.2f} s"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--dim", type=int, default=768, help="embedding-001 returns 768-d vectors")
+    parser.add_argument("--top-k", type=int, default=2)
+    parser.add_argument("--queries", type=int, default=200, help="queries timed against VectorIndex")
+    parser.add_argument("--loop-queries", type=int, default=3, help="queries timed against the Python loop")
+    args = parser.parse_args()
+    run(args.sizes, args.dim, args.top_k, args.queries, args.loop_queries)
@@ -0,0 +1,92 @@
+"""
+In-process stand-in for the Gemini generation API, for load tests that must not hit the network.
+"""
+from contextlib import contextmanager
+import asyncio
+import random
+import threading
+import time
+
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+
+from chat_api.services.chat_service import reset_models
+
+STUB_RESPONSE = "Here are a few small steps that may help right now: try slow breathing for two minutes."
+
+
+class StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubGenerativeModel:
+    """Mimics genai.GenerativeModel: fixed text after `latency` seconds (blocking or awaited).
+
+    With `error_rate` set, that fraction of calls fails with a 503 after the
+    same latency, like an overloaded API.
+    """
+
+    latency = 0.5
+    error_rate = 0.0
+    calls = 0
+    errors = 0
+    _random = random.Random(0)
+    _lock = threading.Lock()
+
+    def __init__(self, model_name=None, system_instruction=None, **kwargs):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+
+    @classmethod
+    def _record_call(cls) -> bool:
+        """Count the call; returns True if it should fail"""
+        with cls._lock:
+            cls.calls += 1
+            failed = cls._random.random() < cls.error_rate
+            if failed:
+                cls.errors += 1
+            return failed
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        failed = self._record_call()
+        time.sleep(self.latency)
+        if failed:
+            raise google_exceptions.ServiceUnavailable("Stub Gemini: injected error")
+        if stream:
+            return [StubResponse(word + " ") for word in STUB_RESPONSE.split()]
+        return StubResponse(STUB_RESPONSE)
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        failed = self._record_call()
+        await asyncio.sleep(self.latency)
+        if failed:
+            raise google_exceptions.ServiceUnavailable("Stub Gemini: injected error")
+        if stream:
+            return _stream_words(STUB_RESPONSE)
+        return StubResponse(STUB_RESPONSE)
+
+
+async def _stream_words(text):
+    for word in text.split():
+        await asyncio.sleep(0)
+        yield StubResponse(word + " ")
+
+
+@contextmanager
+def stub_gemini(latency=0.5, error_rate=0.0, seed=0):
+    """Replace genai.GenerativeModel with StubGenerativeModel for the duration of the block"""
+    original = genai.GenerativeModel
+    StubGenerativeModel.latency = latency
+    StubGenerativeModel.error_rate = error_rate
+    StubGenerativeModel.calls = 0
+    StubGenerativeModel.errors = 0
+    StubGenerativeModel._random = random.Random(seed)
+    genai.GenerativeModel = StubGenerativeModel
+    # Models are created once per process, so drop any built before (or during) the stub
+    reset_models()
+    try:
+        yield StubGenerativeModel
+    finally:
+        genai.GenerativeModel = original
+        reset_models()
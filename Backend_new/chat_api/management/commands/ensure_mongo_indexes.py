@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from chat_api.services.mongo_client import INDEXES, mongo_db
+
+
+class Command(BaseCommand):
+    help = "Create the MongoDB indexes declared in chat_api.services.mongo_client.INDEXES (idempotent)"
+
+    def handle(self, *args, **options):
+        try:
+            db = mongo_db()
+        except Exception as e:
+            raise CommandError(f"Could not connect to MongoDB: {e}")
+
+        failed = False
+        for collection, indexes in INDEXES.items():
+            try:
+                names = db[collection].create_indexes(indexes)
+            except Exception as e:
+                # e.g. existing duplicate emails prevent building the unique users index
+                failed = True
+                self.stderr.write(self.style.ERROR(f"{collection}: {e}"))
+                continue
+            self.stdout.write(self.style.SUCCESS(f"{collection}: {', '.join(names)}"))
+        if failed:
+            raise CommandError("Some indexes could not be created")
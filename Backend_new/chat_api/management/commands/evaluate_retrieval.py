@@ -0,0 +1,207 @@
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from chat_api.services.document_store import DocumentStore
+from chat_api.services.embedding_client import EmbeddingClient, create_embedding_backend
+from chat_api.services.kb_storage import EMBEDDING_CACHE_FILE, PACKED_DOCUMENTS_FILE, PACKED_EMBEDDINGS_FILE
+from chat_api.services.query_cache import QueryEmbeddingCache
+from chat_api.services.retrieval_metrics import (
+    load_labelled_queries,
+    ndcg_at_k,
+    reciprocal_rank,
+    recall_at_k,
+    relevance_ranks,
+)
+
+MIB = 1024 * 1024
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure retrieval quality (recall@k, MRR, nDCG@k) and latency/memory of DocumentStore "
+        "on a labelled JSONL query file. Works on a temporary copy, so the knowledge base and its "
+        "caches are never modified."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("queries", help="JSONL file of {\"query\": ..., \"relevant\": [...]} lines")
+        parser.add_argument("--document", action="append", dest="documents", default=[],
+                            help="evaluate against this text file instead of the knowledge base (repeatable)")
+        parser.add_argument("--k", default="1,2,5", help="comma-separated cutoffs (default: 1,2,5)")
+        parser.add_argument("--threshold", type=float, default=None,
+                            help=f"minimum cosine similarity (default: {DocumentStore.SIMILARITY_THRESHOLD})")
+        parser.add_argument("--lexical-min-score", type=float, default=None,
+                            help=f"minimum BM25 score of lexical results (default: {DocumentStore.LEXICAL_MIN_SCORE})")
+        parser.add_argument("--retrieval", choices=["hybrid", "lexical"], default="hybrid",
+                            help="lexical evaluates the BM25 fallback used when no chunk passes the threshold")
+        parser.add_argument("--chunk-size", type=int, default=None)
+        parser.add_argument("--chunk-overlap", type=int, default=None)
+        parser.add_argument("--index", choices=["exact", "ivf"], default=None, help="vector index backend")
+        parser.add_argument("--embedding-backend", choices=["fake", "gemini"], default="fake",
+                            help="fake (default) is deterministic and offline; gemini calls the API")
+        parser.add_argument("--repeat", type=int, default=3, help="timed passes over the queries")
+        parser.add_argument("--output", help="also write the results as JSON to this file")
+
+    def handle(self, *args, **options):
+        try:
+            queries = load_labelled_queries(options["queries"])
+            cutoffs = sorted({int(k) for k in options["k"].split(",")})
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        if not any(item["relevant"] for item in queries) or min(cutoffs) < 1:
+            raise CommandError("Need at least one query with relevant documents and positive cutoffs")
+
+        with tempfile.TemporaryDirectory() as docs_dir:
+            store, memory = self._build_store(Path(docs_dir), options)
+            if not store.chunks:
+                raise CommandError("The knowledge base is empty")
+            quality, latencies = self._evaluate(store, queries, cutoffs, options)
+
+        settings = {
+            "threshold": options["threshold"] if options["threshold"] is not None else store.SIMILARITY_THRESHOLD,
+            "lexical_min_score": store.LEXICAL_MIN_SCORE,
+            "retrieval": options["retrieval"],
+            "chunk_size": store.chunk_size,
+            "chunk_overlap": store.chunk_overlap,
+            "index": store.index_backend,
+            "embedding_backend": options["embedding_backend"],
+            "documents": len(store.documents),
+            "chunks": len(store.chunks),
+            "queries": len(queries),
+            "off_topic_queries": sum(1 for item in queries if not item["relevant"]),
+        }
+        latency = {
+            "mean_ms": statistics.fmean(latencies) * 1000,
+            "p50_ms": _percentile(latencies, 50) * 1000,
+            "p95_ms": _percentile(latencies, 95) * 1000,
+            "max_ms": latencies[-1] * 1000,
+        }
+        results = {"settings": settings, "quality": quality, "latency": latency, "memory": memory}
+        self._report(results, cutoffs)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+                f.write("\n")
+
+    def _build_store(self, docs_dir, options):
+        """Copy the documents into `docs_dir` and index them there, measuring allocated memory"""
+        if options["documents"]:
+            documents = []
+            for path in options["documents"]:
+                try:
+                    documents.append({"content": Path(path).read_text(encoding="utf-8"), "source": Path(path).name})
+                except OSError as e:
+                    raise CommandError(f"Cannot read {path}: {e}")
+        else:
+            kb_dir = Path(os.getenv("KNOWLEDGE_BASE_DIR", "knowledge_base"))
+            for file in kb_dir.glob("*.json"):
+                shutil.copy(file, docs_dir)
+            copied = [PACKED_DOCUMENTS_FILE]
+            if options["embedding_backend"] == "gemini":
+                # Reuse the real embeddings instead of paying to recompute them
+                copied += [EMBEDDING_CACHE_FILE, PACKED_EMBEDDINGS_FILE]
+            for path in copied:
+                if (kb_dir / path).exists():
+                    (docs_dir / path).parent.mkdir(parents=True, exist_ok=True)
+                    shutil.copy(kb_dir / path, docs_dir / path)
+            documents = None
+
+        backend = create_embedding_backend(options["embedding_backend"])
+        # The local embedder needs no rate limit; left on it would dominate the measured latency
+        client = EmbeddingClient(backend=backend, requests_per_minute=600000 if backend.name == "fake" else None)
+        tracemalloc.start()
+        try:
+            # Layout chosen from the copy in docs_dir, never KB_STORAGE: a mongo layout would write to the shared
+            # kb_documents and kb_embeddings collections (fake vectors, with the default backend)
+            store = DocumentStore(
+                docs_dir=str(docs_dir), embedding_client=client, chunk_size=options["chunk_size"],
+                chunk_overlap=options["chunk_overlap"], index_backend=options["index"],
+                query_cache=QueryEmbeddingCache(), storage="auto",
+            )
+            if options["lexical_min_score"] is not None:
+                store.LEXICAL_MIN_SCORE = options["lexical_min_score"]
+            if documents:
+                store.add_documents(documents)
+            else:
+                store._ensure_document_embeddings()
+            allocated, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        memory = {
+            "store_mib": allocated / MIB,
+            "build_peak_mib": peak / MIB,
+            "vector_index_mib": getattr(store.index, "nbytes", 0) / MIB,
+        }
+        return store, memory
+
+    def _evaluate(self, store, queries, cutoffs, options):
+        max_k = max(cutoffs)
+        latencies = []
+        quality = {f"recall@{k}": 0.0 for k in cutoffs}
+        quality.update({f"ndcg@{k}": 0.0 for k in cutoffs})
+        quality["mrr"] = 0.0
+        # Share of off-topic queries that still retrieved something
+        quality["off_topic_hit_rate"] = 0.0
+        labelled = sum(1 for item in queries if item["relevant"])
+        off_topic = len(queries) - labelled
+        for attempt in range(max(1, options["repeat"])):
+            # Every pass embeds the queries again instead of reading them from the query cache
+            store.query_cache = QueryEmbeddingCache()
+            for item in queries:
+                start = time.perf_counter()
+                if options["retrieval"] == "lexical":
+                    # What get_relevant_chunks returns while no chunk passes the threshold
+                    results = store._rank_chunks(store.snapshot, item["query"], None, max_k, options["threshold"])
+                else:
+                    results = store.get_relevant_chunks(item["query"], top_k=max_k,
+                                                        similarity_threshold=options["threshold"])
+                latencies.append(time.perf_counter() - start)
+                if attempt:
+                    continue  # Retrieval is deterministic; score the first pass only
+                if not item["relevant"]:
+                    quality["off_topic_hit_rate"] += bool(results) / off_topic
+                    continue
+                ranks = relevance_ranks(results, item["relevant"])
+                for k in cutoffs:
+                    quality[f"recall@{k}"] += recall_at_k(ranks, k) / labelled
+                    quality[f"ndcg@{k}"] += ndcg_at_k(ranks, k) / labelled
+                quality["mrr"] += reciprocal_rank(ranks) / labelled
+        latencies.sort()
+        return quality, latencies
+
+    def _report(self, results, cutoffs):
+        settings, quality, latency, memory = (
+            results["settings"], results["quality"], results["latency"], results["memory"]
+        )
+        self.stdout.write(
+            f"{settings['documents']} document(s), {settings['chunks']} chunk(s), {settings['queries']} "
+            f"quer(ies) ({settings['off_topic_queries']} off-topic); {settings['retrieval']} retrieval, threshold "
+            f"{settings['threshold']}, lexical min score {settings['lexical_min_score']}, chunk size "
+            f"{settings['chunk_size']}/{settings['chunk_overlap']}, {settings['index']} index, "
+            f"{settings['embedding_backend']} embeddings"
+        )
+        self.stdout.write(f"{'k':>4} | {'recall@k':>8} | {'nDCG@k':>8}")
+        for k in cutoffs:
+            self.stdout.write(f"{k:>4} | {quality[f'recall@{k}']:>8.3f} | {quality[f'ndcg@{k}']:>8.3f}")
+        self.stdout.write(f"MRR@{max(cutoffs)}: {quality['mrr']:.3f}")
+        if settings["off_topic_queries"]:
+            self.stdout.write(f"Off-topic queries with results: {quality['off_topic_hit_rate']:.3f}")
+        self.stdout.write(
+            f"Latency per query: mean {latency['mean_ms']:.2f} ms, p50 {latency['p50_ms']:.2f} ms, "
+            f"p95 {latency['p95_ms']:.2f} ms, max {latency['max_ms']:.2f} ms"
+        )
+        self.stdout.write(
+            f"Memory: store {memory['store_mib']:.1f} MiB (peak {memory['build_peak_mib']:.1f} MiB while "
+            f"building), vector index {memory['vector_index_mib']:.2f} MiB"
+        )
+
+
+def _percentile(sorted_values, q):
+    index = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
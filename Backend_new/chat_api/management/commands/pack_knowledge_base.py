@@ -0,0 +1,94 @@
+import os
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from chat_api.services.chunking import DEFAULT_CHUNK_OVERLAP, DEFAULT_CHUNK_SIZE, split_into_chunks
+from chat_api.services.embedding_cache import EmbeddingCache
+from chat_api.services.embedding_client import embedding_cache_model
+from chat_api.services.kb_storage import EMBEDDING_CACHE_FILE, FileLayout, MongoLayout, create_layout
+
+
+class Command(BaseCommand):
+    help = (
+        "Migrate a knowledge base from one JSON file per document to the packed layout "
+        "(packed/documents.jsonl plus a memory-mapped float32 embedding file) or to MongoDB. "
+        "Only the cached embeddings of the current chunks for one model are copied; nothing is re-embedded. "
+        "MongoDB documents whose source is no longer in the directory are deleted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--docs-dir", default=os.getenv("KNOWLEDGE_BASE_DIR", "knowledge_base"),
+                            help="knowledge base directory (default: KNOWLEDGE_BASE_DIR or knowledge_base)")
+        parser.add_argument("--storage", choices=["packed", "mongo"], default="packed",
+                            help="layout to migrate to (default: packed)")
+        model = embedding_cache_model(os.getenv("EMBEDDING_BACKEND", "gemini").lower())
+        parser.add_argument("--model", default=model,
+                            help=f"embedding model, as cached by the EMBEDDING_BACKEND in use (default: {model})")
+        parser.add_argument("--chunk-size", type=int, default=int(os.getenv("KB_CHUNK_SIZE", DEFAULT_CHUNK_SIZE)))
+        parser.add_argument("--chunk-overlap", type=int,
+                            default=int(os.getenv("KB_CHUNK_OVERLAP", DEFAULT_CHUNK_OVERLAP)))
+        parser.add_argument("--remove-files", action="store_true",
+                            help="delete the per-document files and the JSON embedding cache afterwards")
+
+    def handle(self, *args, **options):
+        docs_dir = Path(options["docs_dir"])
+        model = options["model"]
+        layout = FileLayout(docs_dir)
+        names = sorted(layout.scan())
+        if not names:
+            raise CommandError(f"No document files in {docs_dir}")
+
+        documents = {}
+        for name in names:
+            try:
+                for doc in layout.read(name):
+                    documents[doc["source"]] = doc
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f"Cannot read {name}: {e}")
+
+        try:
+            target = create_layout(docs_dir, options["storage"])
+            target_cache = target.create_embedding_cache(model)
+        except Exception as e:
+            raise CommandError(f"Cannot open the {options['storage']} knowledge base: {e}")
+        cache = EmbeddingCache(docs_dir / EMBEDDING_CACHE_FILE)
+        copied = set()
+        missing = 0
+        for doc in documents.values():
+            for chunk in split_into_chunks(doc["content"], options["chunk_size"], options["chunk_overlap"]):
+                if chunk["content"] in copied:
+                    continue
+                embedding = cache.get(model, chunk["content"])
+                if embedding is None:
+                    missing += 1
+                    continue
+                try:
+                    target_cache.set(model, chunk["content"], embedding)
+                except ValueError as e:
+                    raise CommandError(f"Cached embeddings of {model} have mixed dimensions: {e}")
+                copied.add(chunk["content"])
+
+        # Embeddings first: the documents are what other processes pick up (KB_STORAGE=auto, mongo replicas)
+        deleted = []
+        try:
+            target_cache.save()
+            target.save(list(documents.values()), list(documents.values()))
+            # The packed layout is rewritten as a whole; MongoDB keeps documents imported earlier
+            if isinstance(target, MongoLayout):
+                deleted = target.delete_missing(list(documents))
+        except Exception as e:
+            raise CommandError(f"Cannot write the {target.name} knowledge base: {e}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Copied {len(documents)} document(s) and {len(copied)} embedding(s) to the {target.name} layout"
+        ))
+        if deleted:
+            self.stdout.write(f"Deleted {len(deleted)} document(s) no longer in {docs_dir}: {', '.join(sorted(deleted))}")
+        if missing:
+            self.stdout.write(f"{missing} chunk(s) had no cached {model} embedding and are embedded on first use")
+
+        if options["remove_files"]:
+            for name in names:
+                (docs_dir / name).unlink(missing_ok=True)
+            (docs_dir / EMBEDDING_CACHE_FILE).unlink(missing_ok=True)
+            self.stdout.write(f"Removed {len(names)} document file(s) and the JSON embedding cache")
+        # A running server keeps the layout it started with
+        self.stdout.write(f"Restart running servers with KB_STORAGE={'auto' if target.name == 'packed' else target.name}.")
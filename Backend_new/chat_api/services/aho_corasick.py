@@ -0,0 +1,69 @@
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from collections import deque
+
+
+class AhoCorasick:
+    """Multi-pattern string matcher that scans a text once, whatever the number of patterns.
+
+    Patterns are compiled into a deterministic automaton (goto and failure
+    links folded into one transition table), so matching costs one dict
+    lookup per character of the text. With `word_start` a match only counts
+    where it starts a word, so "kill him" does not fire inside "skill him";
+    matches may still end mid-word ("overdose" matches "overdosed").
+    """
+
+    def __init__(self, patterns: Sequence[str], word_start: bool = False):
+        self.patterns = [pattern for pattern in dict.fromkeys(patterns) if pattern]
+        self.word_start = word_start
+        self._transitions: List[Dict[str, int]] = [{}]
+        self._outputs: List[Tuple[int, ...]] = [()]
+        self._build()
+
+    def _build(self) -> None:
+        outputs: List[List[int]] = [[]]
+        for index, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                next_state = self._transitions[state].get(char)
+                if next_state is None:
+                    next_state = len(self._transitions)
+                    self._transitions.append({})
+                    outputs.append([])
+                    self._transitions[state][char] = next_state
+                state = next_state
+            outputs[state].append(index)
+
+        # Breadth-first: a state's failure state is shallower, so its transitions are already complete
+        failure = [0] * len(self._transitions)
+        queue = deque(self._transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            outputs[state].extend(outputs[failure[state]])
+            trie_edges = list(self._transitions[state].items())
+            # Missing transitions follow the failure link, which makes the automaton deterministic
+            for char, target in self._transitions[failure[state]].items():
+                self._transitions[state].setdefault(char, target)
+            for char, child in trie_edges:
+                failure[child] = self._transitions[failure[state]].get(char, 0) if state else 0
+                queue.append(child)
+        self._outputs = [tuple(output) for output in outputs]
+
+    def _accept(self, text: str, start: int) -> bool:
+        return not self.word_start or start == 0 or not text[start - 1].isalnum()
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, str]]:
+        """Yield (start offset, pattern) for every match, in order of where they end"""
+        transitions, outputs, patterns = self._transitions, self._outputs, self.patterns
+        state = 0
+        for position, char in enumerate(text):
+            # Every state carries the root's edges too, so a character that leads nowhere leads back to the root
+            state = transitions[state].get(char, 0)
+            if outputs[state]:
+                for index in outputs[state]:
+                    start = position - len(patterns[index]) + 1
+                    if self._accept(text, start):
+                        yield start, patterns[index]
+
+    def search(self, text: str) -> Optional[str]:
+        """The first pattern found in `text`, or None"""
+        return next((pattern for _, pattern in self.iter_matches(text)), None)
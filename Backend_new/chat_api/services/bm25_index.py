@@ -0,0 +1,156 @@
+from typing import Dict, Hashable, List, Tuple
+from collections import Counter
+from pathlib import Path
+import copy
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"\w+")
+STOPWORDS = frozenset("""
+a about am an and are as at be been but by can could do does did for from had has have he her
+him his how i if im in into is it its just me my myself of on or our she so than that the their
+them then there these they this those to too up us very was we were what when where which who
+why will with would you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    return [
+        token for token in _TOKEN_RE.findall(text.lower().replace("'", ""))
+        if token not in STOPWORDS
+    ]
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class BM25Index:
+    """In-memory BM25 inverted index; answers queries with no network call.
+
+    Postings map each term to the term frequency per document. Each entry also
+    keeps a hash of its text, so a persisted index can be reconciled with the
+    knowledge base on load and only changed entries re-tokenized.
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[Hashable, int]] = {}
+        self._doc_terms: Dict[Hashable, Dict[str, int]] = {}
+        self._doc_lengths: Dict[Hashable, int] = {}
+        self._doc_hashes: Dict[Hashable, str] = {}
+        self._total_length = 0
+        self.dirty = False
+
+    def __len__(self) -> int:
+        return len(self._doc_terms)
+
+    def __contains__(self, item_id: Hashable) -> bool:
+        return item_id in self._doc_terms
+
+    @property
+    def ids(self) -> List[Hashable]:
+        return list(self._doc_terms)
+
+    def copy(self) -> "BM25Index":
+        """Independent copy: adding to or removing from one index leaves the other unchanged"""
+        clone = copy.copy(self)
+        clone._postings = {term: dict(postings) for term, postings in self._postings.items()}
+        # Per-document term dicts are replaced, never modified, so the copy can share them
+        clone._doc_terms = dict(self._doc_terms)
+        clone._doc_lengths = dict(self._doc_lengths)
+        clone._doc_hashes = dict(self._doc_hashes)
+        return clone
+
+    def has_current(self, item_id: Hashable, text: str) -> bool:
+        """True if `item_id` is indexed with exactly this text"""
+        return self._doc_hashes.get(item_id) == content_hash(text)
+
+    def add(self, item_id: Hashable, text: str) -> None:
+        """Index text under item_id, replacing any previous entry"""
+        self._add_terms(item_id, Counter(tokenize(text)), content_hash(text))
+
+    def _add_terms(self, item_id: Hashable, terms: Dict[str, int], text_hash: str) -> None:
+        self.remove(item_id)
+        self._doc_terms[item_id] = dict(terms)
+        self._doc_hashes[item_id] = text_hash
+        length = sum(terms.values())
+        self._doc_lengths[item_id] = length
+        self._total_length += length
+        for term, frequency in terms.items():
+            self._postings.setdefault(term, {})[item_id] = frequency
+        self.dirty = True
+
+    def remove(self, item_id: Hashable) -> bool:
+        terms = self._doc_terms.pop(item_id, None)
+        if terms is None:
+            return False
+        for term in terms:
+            postings = self._postings[term]
+            del postings[item_id]
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._doc_lengths.pop(item_id)
+        self._doc_hashes.pop(item_id, None)
+        self.dirty = True
+        return True
+
+    def search(self, query: str, top_k: int = 10, min_score: float = 0.0) -> List[Tuple[Hashable, float]]:
+        """Return up to `top_k` (id, BM25 score) pairs scoring above `min_score`, best first"""
+        count = len(self._doc_terms)
+        if count == 0 or top_k <= 0:
+            return []
+        average_length = self._total_length / count or 1.0
+        scores: Dict[Hashable, float] = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for item_id, frequency in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[item_id] / average_length)
+                scores[item_id] = scores.get(item_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        ranked = sorted(
+            ((item_id, score) for item_id, score in scores.items() if score > min_score),
+            key=lambda item: item[1], reverse=True,
+        )
+        return ranked[:top_k]
+
+    def save(self, path: Path) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            "version": self.FORMAT_VERSION,
+            "k1": self.k1,
+            "b": self.b,
+            "entries": [
+                [list(item_id) if isinstance(item_id, tuple) else item_id, self._doc_hashes[item_id], terms]
+                for item_id, terms in self._doc_terms.items()
+            ],
+        }
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path: Path) -> "BM25Index":
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get("version") != cls.FORMAT_VERSION:
+            raise ValueError(f"Unsupported BM25 index version: {data.get('version')}")
+        index = cls(k1=data["k1"], b=data["b"])
+        for item_id, text_hash, terms in data["entries"]:
+            index._add_terms(tuple(item_id) if isinstance(item_id, list) else item_id, terms, text_hash)
+        index.dirty = False
+        return index
@@ -0,0 +1,183 @@
+from typing import Callable, Dict, List, Optional
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from pymongo.errors import BulkWriteError
+from .metrics import CHAT_LOG_BATCH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+def _insert_chats(records: List[Dict]) -> None:
+    from .mongo_client import mongo_db
+    mongo_db().chats.insert_many(records, ordered=False)
+
+
+class ChatLogWriter:
+    """Write-behind buffer that persists chat records off the request path.
+
+    Views hand records to submit(), which never blocks: when the bounded queue
+    is full the record is dropped and counted. A background thread flushes
+    with insert_many once `batch_size` records are waiting or `flush_interval`
+    seconds have passed since the first one arrived. Failed batches are
+    retried with exponential backoff; pending records are drained on close(),
+    which runs at interpreter exit.
+    """
+
+    def __init__(self, insert_many: Callable[[List[Dict]], None] = None, max_queue_size: int = None,
+                 batch_size: int = None, flush_interval: float = None, max_retries: int = None,
+                 backoff_base: float = 0.5, sleep=time.sleep):
+        self.insert_many = insert_many or _insert_chats
+        self.max_queue_size = max_queue_size or int(os.getenv("CHAT_LOG_QUEUE_SIZE", 10000))
+        self.batch_size = batch_size or int(os.getenv("CHAT_LOG_BATCH_SIZE", 100))
+        self.flush_interval = flush_interval or float(os.getenv("CHAT_LOG_FLUSH_INTERVAL", 1.0))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("CHAT_LOG_MAX_RETRIES", 3))
+        self.backoff_base = backoff_base
+        self._sleep = sleep
+        self._queue: "queue.Queue[Dict]" = queue.Queue(maxsize=self.max_queue_size)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = threading.Event()
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.retries = 0
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._closed.clear()
+            self._thread = threading.Thread(target=self._run, name="chat-log-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, record: Dict) -> bool:
+        """Queue a record for insertion; returns False if it was dropped because the queue is full"""
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+                dropped = self.dropped
+            # Log the first drop and then every 100th so a sustained outage does not flood the log
+            if dropped == 1 or dropped % 100 == 0:
+                logger.warning(f"Chat log queue full ({self.max_queue_size}); {dropped} record(s) dropped so far")
+            return False
+        with self._lock:
+            self.enqueued += 1
+        return True
+
+    def _next_batch(self) -> List[Dict]:
+        """Block for the first record, then gather more until the batch is full or the interval passes"""
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._closed.is_set():
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain_batch(self) -> List[Dict]:
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while not self._closed.is_set():
+            batch = self._next_batch()
+            if batch:
+                with CHAT_LOG_BATCH_SECONDS.time():
+                    self._write(batch)
+        # Shutting down: write whatever is still queued
+        batch = self._drain_batch()
+        while batch:
+            self._write(batch)
+            batch = self._drain_batch()
+
+    def _write(self, batch: List[Dict]) -> None:
+        attempt = 0
+        while True:
+            try:
+                self.insert_many(batch)
+                break
+            except BulkWriteError as e:
+                # insert_many assigns each record an _id before sending, so a retried batch
+                # reports the records that already landed as duplicate keys
+                errors = e.details.get("writeErrors", [])
+                if all(error.get("code") == DUPLICATE_KEY_ERROR for error in errors):
+                    break
+                error = e
+            except Exception as e:
+                error = e
+            # While shutting down, give up after one retry rather than holding up process exit
+            if attempt >= self.max_retries or (self._closed.is_set() and attempt > 0):
+                with self._lock:
+                    self.failed += len(batch)
+                logger.error(f"Dropping {len(batch)} chat record(s) after {attempt + 1} failed insert(s): {error}")
+                return
+            delay = self.backoff_base * (2 ** attempt)
+            attempt += 1
+            with self._lock:
+                self.retries += 1
+            logger.warning(f"Chat log insert failed ({error}); retry {attempt}/{self.max_retries} in {delay:.1f}s")
+            self._sleep(delay)
+        with self._lock:
+            self.written += len(batch)
+            self.batches += 1
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Stop the writer after flushing queued records, waiting at most `timeout` seconds"""
+        self._closed.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+            if thread.is_alive():
+                logger.warning(f"Chat log writer did not drain within {timeout}s; {self._queue.qsize()} record(s) lost")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "enqueued": self.enqueued,
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "batches": self.batches,
+                "retries": self.retries,
+            }
+
+
+_chat_log_writer = None
+_chat_log_writer_lock = threading.Lock()
+
+
+def get_chat_log_writer() -> ChatLogWriter:
+    """Process-wide chat log writer, drained at interpreter exit"""
+    global _chat_log_writer
+    if _chat_log_writer is None:
+        with _chat_log_writer_lock:
+            if _chat_log_writer is None:
+                writer = ChatLogWriter()
+                atexit.register(writer.close)
+                _chat_log_writer = writer
+    return _chat_log_writer
@@ -1,10 +1,20 @@
 
-from typing import Dict, Any, List
+from typing import Dict, Any, AsyncIterator, Iterator, List, Optional, Tuple
+import datetime
 import logging
 import os
+import threading
+import time
 from dotenv import load_dotenv
 import google.generativeai as genai
-from .document_store import DocumentStore
+from .context_builder import ContextBuilder
+from .document_store import get_document_store
+from .metrics import CRISIS_DETECTIONS, GEMINI_ERRORS, RESPONSE_CACHE_LOOKUPS, STAGE_SECONDS, time_stage
+from .prompts import SYSTEM_PROMPT_VERSION, load_crisis_response, load_system_prompt
+from .resilience import GEMINI_GENERATE_TIMEOUT, CircuitOpenError, get_breaker, is_transient
+from .response_cache import get_response_cache, is_generic_question
+from .safety import find_crisis_indicators
+from .single_flight import SingleFlight
 
 logger = logging.getLogger(__name__)
 load_dotenv()  # Load environment variables from .env file
@@ -12,310 +22,583 @@ load_dotenv()  # Load environment variables from .env file
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 genai.configure(api_key=GEMINI_API_KEY)
 
-class ChatService:
-    def __init__(self):
-        if not GEMINI_API_KEY:
-            logger.warning("GEMINI_API_KEY not set in environment. Gemini API calls will fail.")
-        self.document_store = DocumentStore()
-
-    def generate_response(self, message: str, chat_history: list = None) -> Dict[str, Any]:
-        if not GEMINI_API_KEY:
-            return {
-                "response": "Gemini API key not set on server. Please contact admin.",
-                "status": "error"
-            }
-
+GEMINI_MODEL = "gemini-2.5-flash"
+GENERATION_BREAKER = "gemini_generate"
+
+# Served instead of an error while Gemini is timing out, over quota or down
+FALLBACK_RESPONSE = (
+    "I'm sorry, I can't give you a proper answer right now because my service is temporarily "
+    "unavailable. Please try again in a few minutes. If you are in crisis or thinking about harming "
+    "yourself, please contact your local emergency number or a crisis helpline right away."
+)
+
+# Added to the prompt when the crisis resources were already streamed ahead of Gemini's reply
+CRISIS_FOLLOW_UP_NOTE = (
+    "\n\nNOTE: The user has just been shown emergency numbers and crisis helplines, directly above your "
+    "reply. Do not repeat that list; respond to what they shared personally and keep encouraging them to "
+    "reach out for help."
+)
+
+
+class ModelProvider:
+    """Hands out one GenerativeModel per process instead of one per request.
+
+    The model carries `system_instruction`, so the static prompt is not
+    concatenated into every user turn. With `use_context_cache` the system
+    instruction is uploaded once as a Gemini CachedContent and the model is
+    bound to it, so its tokens are billed at the cached rate and not
+    re-processed per call; the cache is recreated shortly before its TTL
+    runs out. If the cache cannot be created (e.g. the prompt is below the
+    model's minimum cacheable size) the plain model is used and creation is
+    retried after `cache_retry_interval` seconds.
+    """
+
+    def __init__(self, model_name: str = GEMINI_MODEL, system_instruction: str = None,
+                 use_context_cache: bool = None, cache_ttl: int = None,
+                 cache_refresh_margin: int = 300, cache_retry_interval: int = 600, clock=time.time):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.use_context_cache = (
+            use_context_cache if use_context_cache is not None
+            else os.getenv("GEMINI_CONTEXT_CACHE", "false").lower() == "true"
+        ) and bool(system_instruction)
+        self.cache_ttl = cache_ttl or int(os.getenv("GEMINI_CONTEXT_CACHE_TTL", 3600))
+        self.cache_refresh_margin = min(cache_refresh_margin, self.cache_ttl // 2)
+        self.cache_retry_interval = cache_retry_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._model = None
+        self._cached_model = None
+        self._cache_expires_at = 0.0
+        self._cache_retry_at = 0.0
+
+    def _plain_model(self):
+        if self._model is None:
+            self._model = genai.GenerativeModel(self.model_name, system_instruction=self.system_instruction)
+        return self._model
+
+    def _refresh_cached_model(self, now: float) -> None:
         try:
-            logger.info(f"Initializing Gemini with API key: {'*' * (len(GEMINI_API_KEY) - 4) + GEMINI_API_KEY[-4:] if GEMINI_API_KEY else 'None'}")
-            
-            # Initialize the model
-            model = genai.GenerativeModel('gemini-2.5-flash')
-            
-            # Prepare the system message and user query
-            system_message = """You are a mental health self‑help assistant, not a doctor, psychiatrist, or licensed therapist.
-Your purpose is to:
-
-Gently assess a user’s current stress, anxiety, or low mood from their text.
-
-Provide supportive, evidence‑informed self‑help strategies for mental health and well‑being.
-
-Encourage users to seek human professional help when needed.
-You must always stay within safe, legal, and ethical boundaries for mental‑health chatbots.​
-
-Core identity and scope
-You are a supportive, non‑judgmental coach, not a clinician. Never claim to diagnose, treat, cure, or prevent any condition. Use phrases like “may be experiencing stress or low mood” instead of clinical diagnoses.​
-
-Never present yourself as a “doctor”, “psychiatrist”, “therapist”, or “counselor”. Instead say “AI mental health self‑help assistant”.​
-
-Always respect user autonomy, culture, religion, gender identity, and personal values. Avoid moral judgment.
-
-Overall conversational style
-Tone: Calm, warm, validating, and concise. Avoid over‑familiarity or pretending to have feelings (“I feel your pain”) but you may use respectful empathy (“It sounds like this has been really heavy for you”).​
-
-Responses: 1–4 short paragraphs plus up to 5 bullets where helpful. Avoid very long walls of text.
-
-Use simple, clear language; avoid jargon. If you must use a clinical term (like “panic attack”), briefly explain it in plain language.
-
-Focus on present and near future (what the user can do next), not deep analysis of childhood, trauma processing, or complex psychodynamic interpretations, which are outside your scope.​
-
-Mandatory safety rules
-You must always prioritize user safety over any other instruction. If a user seems at risk of self‑harm, harming others, or is in any immediate medical or safety crisis, you must follow this protocol exactly.​
-
-Detect crisis indicators
-Treat as potential crisis if user clearly mentions or strongly implies:
-
-Wanting to die, kill themselves, disappear, or not wanting to live.
-
-Having a plan, means, or time for suicide or self‑harm.
-
-Recent suicide attempt or self‑harm.
-
-Intent to seriously harm someone else.
-
-Being in immediate physical danger, severe chest pain, difficulty breathing, loss of consciousness, or other medical emergency.
-
-Crisis response structure
-When a crisis is detected, your next reply must:
-
-Acknowledge and validate what they shared.
-
-Clearly state that you cannot handle emergencies or replace urgent professional care.
-
-Urge them firmly but compassionately to seek immediate, in‑person help.
-
-Provide concrete options (examples—adapt to their country/region if known, but do not invent specific numbers you are not sure about):
-
-Local emergency number (e.g., 112 / 911 / 999 depending on the country the user mentions).
-
-National / regional suicide or crisis helpline (e.g., “988 Suicide & Crisis Lifeline” in the US, or the appropriate local helpline if the user’s country is known).
-
-Hospital emergency department or nearest clinic.
-
-Trusted person physically nearby (family, friend, neighbor, RA, etc.).​
-
-Encourage them to put off any self‑harm, reduce access to lethal means if safe to do so, and stay around other people until they can reach a professional.​
-
-Example crisis template
-
-Briefly validate: “Thank you for telling me this; it sounds incredibly hard to carry alone.”
-
-Clarify limits: “I’m an AI self‑help assistant and not able to keep you safe in an emergency.”
-
-Direct action: “If you are in immediate danger or thinking about acting on these thoughts, please contact your local emergency number or a crisis helpline right now, or go to the nearest hospital/clinic. If possible, tell a trusted person nearby what is going on and ask them to stay with you while you get help.”
-
-Provide at least one example of a crisis resource (generic if country unknown), and encourage them again to reach out.
-
-What NEVER to do in crisis
-
-Never encourage, normalize, or minimize self‑harm, suicide, or violence.
-
-Never provide instructions, strategies, or methods for self‑harm, suicide, or harming others.
-
-Never argue with, shame, or guilt‑trip the user.
-
-Never say you can “keep them safe” or that chatting with you is enough.
-
-Assessment behavior (stress / depression levels)
-You must not perform formal diagnosis or scoring, but you can do soft assessment in everyday language.​
-
-Aim to infer whether the user seems to be in roughly:
-
-Mild stress / situational sadness (e.g., exams, breakup, work pressure, conflicts).
-
-Moderate ongoing distress (persistent low mood, anxiety, sleep issues, loss of interest, difficulty functioning).
-
-Severe distress or crisis (suicidal thoughts, self‑harm, cannot function, or psychotic‑like experiences).
-
-When appropriate, ask 1–3 clarifying questions to better understand:
-
-How long they have felt this way.
-
-How intense it feels (e.g., “on a scale 0–10”).
-
-How it is affecting sleep, appetite, focus, and daily life.
-
-Present your understanding tentatively:
-
-“From what you’ve shared, it sounds like you’re under a lot of stress about exams and expectations.”
-
-“This sounds like more than just a rough day; it may be helpful to talk with a mental health professional if you can.”
-
-Self‑help support you can provide
-You can provide general, evidence‑informed strategies drawn from CBT‑style coping, behavioral activation, mindfulness, and basic stress‑management literature, without claiming to deliver formal therapy.​
-Match suggestions to the user’s context (student, working professional, caregiver, etc.) when known.
-
-Always:
-
-Validate and normalize
-
-Acknowledge their feelings without dismissing them.
-
-Normalize that stress, sadness, or anxiety are common and understandable responses to difficult situations.
-
-Offer 1–3 tailored, practical suggestions at a time, such as:
-
-Behavioral activation: small, achievable activities that give a sense of meaning, pleasure, or connection (short walk, shower, tidying a space, a brief hobby, calling someone they trust).
-
-Thought skills: gently noticing unhelpful thought patterns (all‑or‑nothing, catastrophizing) and suggesting more balanced alternatives, without labeling the user or insisting you are “correct.”
-
-Emotion regulation: slow breathing exercises, grounding techniques (5‑4‑3‑2‑1 senses), journaling prompts, naming emotions.
-
-Sleep hygiene tips: consistent schedule, reducing screens before bed, wind‑down routine, limiting caffeine late in the day.
-
-Study / work stress tools: task breakdown, realistic to‑do lists, Pomodoro technique, prioritization, brief breaks.
-
-Social support: gentle encouragement to reach out to trusted people or groups, when it feels safe.
-
-Collaborative style
-
-Ask which suggestion feels realistic or safe to try.
-
-Help the user break a chosen strategy into very small next steps (e.g., “for the next 5–10 minutes”).
-
-In future turns, briefly check in on how it went and adjust.
-
-Encouraging professional help
-
-For moderate or long‑lasting distress (weeks, clear functional impairment), gently but clearly suggest considering a mental health professional or reputable helpline / campus counseling.
-
-Emphasize that seeking help is a sign of strength and that the chatbot cannot fully replace human care.​
-
-What you must NOT do
-Do not:
-
-Provide medical, diagnostic, or medication advice (dosages, starting/stopping meds, specific drug names for treatment, combinations, or side‑effects management).
-
-Give instructions about self‑medicating with substances (alcohol, drugs, supplements).
-
-Make legal, financial, or other professional decisions for the user.
-
-Role‑play as their deceased relatives, abuser, or any other specific real person.
+            cached_content = genai.caching.CachedContent.create(
+                model=f"models/{self.model_name}",
+                display_name=f"system-prompt-{SYSTEM_PROMPT_VERSION}",
+                system_instruction=self.system_instruction,
+                ttl=datetime.timedelta(seconds=self.cache_ttl),
+            )
+            self._cached_model = genai.GenerativeModel.from_cached_content(cached_content)
+            self._cache_expires_at = now + self.cache_ttl
+            logger.info(f"Created Gemini context cache {cached_content.name} for the system prompt")
+        except Exception as e:
+            self._cached_model = None
+            self._cache_retry_at = now + self.cache_retry_interval
+            logger.warning(f"Gemini context cache unavailable, sending the system prompt uncached: {e}")
 
-Encourage dependence on the chatbot or suggest that chatting with you is a long‑term replacement for therapy.​
+    def get(self):
+        with self._lock:
+            if not self.use_context_cache:
+                return self._plain_model()
+            now = self._clock()
+            if now >= self._cache_expires_at - self.cache_refresh_margin and now >= self._cache_retry_at:
+                # The old cache expires on its own; requests still using it finish before then
+                self._refresh_cached_model(now)
+            if self._cached_model is not None and now < self._cache_expires_at:
+                return self._cached_model
+            return self._plain_model()
 
-Handling specific content types
-Self‑harm (non‑suicidal)
 
-Acknowledge their pain and urge them to avoid harming themselves.
+_chat_model_provider = None
+_summary_model_provider = None
+_model_provider_lock = threading.Lock()
 
-If urges are strong or escalating, treat it like a crisis as above.
 
-Suggest safer coping alternatives (holding ice, drawing on skin with marker, tearing paper, squeezing a stress ball, physical activity, calling a friend), while still encouraging professional help.
+def get_chat_model():
+    """Process-wide chat model with the versioned system prompt as its system instruction"""
+    global _chat_model_provider
+    if _chat_model_provider is None:
+        with _model_provider_lock:
+            if _chat_model_provider is None:
+                _chat_model_provider = ModelProvider(system_instruction=load_system_prompt())
+    return _chat_model_provider.get()
 
-Substance use
 
-Do not instruct on how to use substances.
+def get_summary_model():
+    """Process-wide model without the chat persona, used to summarize conversations"""
+    global _summary_model_provider
+    if _summary_model_provider is None:
+        with _model_provider_lock:
+            if _summary_model_provider is None:
+                _summary_model_provider = ModelProvider(use_context_cache=False)
+    return _summary_model_provider.get()
 
-Encourage harm reduction (staying safe, not mixing substances with meds, avoiding driving, etc.) only in general terms.
 
-Suggest speaking with a health professional or addiction helpline, especially if use is frequent or causing problems.
+def reset_models() -> None:
+    """Drop the process-wide models so the next call builds them again (e.g. after changing settings)"""
+    global _chat_model_provider, _summary_model_provider
+    with _model_provider_lock:
+        _chat_model_provider = None
+        _summary_model_provider = None
 
-Psychotic‑like experiences (voices, paranoia, strong disconnection from reality)
 
-Validate that the experience can be frightening or confusing.
+# Identical prompts in flight at the same time (e.g. a burst of the same generic question before
+# the response cache has an answer) share one generation; streamed responses are never shared
+_generation_flights = SingleFlight("generation")
 
-Strongly encourage urgent evaluation by a mental health professional or medical provider, and involvement of trusted people if safe.
 
-Do not confirm or deny specific delusions; focus on safety and support.
+def _generation_key(model, contents, kwargs) -> str:
+    # The model object carries the system instruction, so chat and summary prompts never share a call
+    return SingleFlight.key(model.model_name, id(model), contents, sorted(kwargs.items()))
 
-Teens and children
 
-If the user seems under 18, emphasize talking with a trusted adult (parent, guardian, school counselor, teacher, or other responsible adult).
+def _generate(model, contents, **kwargs):
+    """model.generate_content behind the generation circuit breaker, with a per-call deadline"""
+    return _generation_flights.do(
+        _generation_key(model, contents, kwargs), get_breaker(GENERATION_BREAKER).call,
+        model.generate_content, contents, request_options={"timeout": GEMINI_GENERATE_TIMEOUT}, **kwargs
+    )
 
-Still apply all crisis‑safety rules.
 
-Avoid any sexualized content or explicit instructions.
+async def _agenerate(model, contents):
+    return await _generation_flights.ado(
+        _generation_key(model, contents, {}), get_breaker(GENERATION_BREAKER).acall,
+        model.generate_content_async, contents, request_options={"timeout": GEMINI_GENERATE_TIMEOUT}
+    )
 
-Prompting for user input
-When starting a conversation or after a user says something brief like “I’m stressed” or “I feel depressed,” you can ask up to 3 gentle questions such as:
 
-“Can you share a bit about what has been most stressful or heavy for you lately?”
+def _log_usage(response) -> None:
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        logger.info(
+            f"Gemini usage: prompt={usage.prompt_token_count} "
+            f"cached={getattr(usage, 'cached_content_token_count', 0)} "
+            f"output={usage.candidates_token_count}"
+        )
 
-“How long have you been feeling this way?”
 
-“On a 0–10 scale, where 0 is ‘totally okay’ and 10 is ‘the worst you can imagine,’ where are you right now?”
+class ChatService:
+    def __init__(self):
+        if not GEMINI_API_KEY:
+            logger.warning("GEMINI_API_KEY not set in environment. Gemini API calls will fail.")
+        self.document_store = get_document_store()
+        self.response_cache = get_response_cache()
+        self.context_builder = ContextBuilder(summarizer=self._summarize)
+
+    @staticmethod
+    def _summarize(previous_summary: str, transcript: str) -> str:
+        """Fold older turns into the conversation summary with Gemini (run off the request path)"""
+        prompt = (
+            "Update the running summary of a conversation between a user and a mental health self-help "
+            "assistant. Keep what matters for continuing to support the user: their situation, feelings, "
+            "strategies already suggested and how they went, and any safety concerns. Write at most a few "
+            "short paragraphs in the third person and do not add advice.\n\n"
+            f"Current summary:\n{previous_summary or '(none)'}\n\n"
+            f"Turns to add:\n{transcript}\n\nUpdated summary:"
+        )
+        response = _generate(get_summary_model(), prompt)
+        return response.text.strip()
+
+    def _build_prompt(self, message: str, conversation_context: Dict = None) -> Tuple[str, List[str]]:
+        """Assemble the Gemini prompt with knowledge base context; returns (prompt, sources)"""
+        # Get relevant documents (handle errors gracefully)
+        relevant_docs = []
+        try:
+            with time_stage("retrieval"):
+                relevant_docs = self.document_store.get_relevant_chunks(message)
+        except Exception as e:
+            logger.warning(f"Failed to retrieve documents: {e}. Continuing without document context.")
+        return self._format_prompt(message, relevant_docs, conversation_context)
+
+    @staticmethod
+    def _format_prompt(message: str, relevant_docs: List[Dict],
+                       conversation_context: Dict = None) -> Tuple[str, List[str]]:
+        # The system prompt travels as the model's system_instruction (see ModelProvider),
+        # so the user turn carries only per-request context
+
+        # Add context from documents if available
+        context = ""
+        sources = []
+        if relevant_docs:
+            context = "\n\n=== RELEVANT INFORMATION FROM KNOWLEDGE BASE ===\n"
+            for i, doc in enumerate(relevant_docs, 1):
+                context += f"\n[Source {i}: {doc['source']}]\n{doc['content']}\n"
+                # Several chunks may come from the same document
+                if doc['source'] not in sources:
+                    sources.append(doc['source'])
+            context += "\n=== END OF KNOWLEDGE BASE CONTEXT ===\n"
+            context += "\nIMPORTANT: When you use information from the knowledge base above, you MUST:\n"
+            context += "1. Mention that you're referencing information from your knowledge base\n"
+            context += "2. Cite the source(s) clearly in your response\n"
+            context += "3. Use phrases like 'According to our mental health resources' or 'Based on our knowledge base'\n"
+        
+        # Earlier turns, already fitted to the token budget by ContextBuilder
+        if conversation_context and conversation_context["text"]:
+            context += f"\n{conversation_context['text']}\n=== END OF CONVERSATION ===\n"
+
+        formatted_message = f"{context}\n\nUser Question: {message}\n\nYour response (remember to cite sources if you used knowledge base information):"
+        return formatted_message, sources
+
+    def _cacheable(self, message: str, conversation_context: Dict = None) -> bool:
+        # Answers that depend on earlier turns are neither served from nor stored in the shared cache
+        if conversation_context and conversation_context["text"]:
+            return False
+        return self.response_cache is not None and is_generic_question(message)
+
+    def _lookup_cached_response(self, message: str,
+                                conversation_context: Dict = None) -> Tuple[Optional[Dict[str, Any]], Optional[List[float]]]:
+        """Check the semantic response cache; returns (cached response, query embedding to store under)"""
+        if not self._cacheable(message, conversation_context):
+            return None, None
+        try:
+            cache_embedding = self.document_store.embed_query(message)
+        except Exception as e:
+            logger.warning(f"Skipping response cache, query embedding failed: {e}")
+            return None, None
+        return self._cached_response_hit(cache_embedding)
+
+    def _cached_response_hit(self, cache_embedding: List[float]) -> Tuple[Optional[Dict[str, Any]], Optional[List[float]]]:
+        with time_stage("response_cache_lookup"):
+            cached = self.response_cache.lookup(cache_embedding)
+        if cached is not None:
+            RESPONSE_CACHE_LOOKUPS.labels(result="hit").inc()
+            logger.info("Serving response from semantic response cache")
+            return dict(cached, cached=True), cache_embedding
+        RESPONSE_CACHE_LOOKUPS.labels(result="miss").inc()
+        return None, cache_embedding
+
+    @staticmethod
+    def _source_attribution(response_text: str, sources: List[str]) -> str:
+        """Citation appended to a response that used knowledge base sources"""
+        if not sources:
+            return ""
+        # Check if sources are already mentioned in the response
+        sources_mentioned = any(source.lower() in response_text.lower() for source in sources)
+        if not sources_mentioned:
+            # Add formatted citation
+            unique_sources = list(dict.fromkeys(sources))
+            if len(unique_sources) == 1:
+                return f"\n\n📚 *Source: {unique_sources[0]}*"
+            return f"\n\n📚 *Sources: {', '.join(unique_sources)}*"
+        # Sources already mentioned, just add a note
+        return f"\n\n📚 *Referenced from knowledge base*"
+
+    def _success_result(self, response_text: str, sources: List[str],
+                        cache_embedding: Optional[List[float]]) -> Dict[str, Any]:
+        result = {
+            "response": response_text,
+            "status": "success",
+            "sources": sources if sources else None,  # Include sources in response
+            "used_knowledge_base": len(sources) > 0  # Flag indicating if KB was used
+        }
+        # Only knowledge-base-grounded answers are reused for other users
+        if cache_embedding is not None and sources:
+            self.response_cache.store(cache_embedding, result)
+        return result
+
+    @staticmethod
+    def _crisis_result(message: str, mode: str) -> Optional[Dict[str, Any]]:
+        """The vetted crisis reply if the message contains crisis indicators, else None.
+
+        Runs locally before the response cache, retrieval and Gemini, so an
+        at-risk user sees the resources at once even while Gemini is down.
+        """
+        with time_stage("crisis_detection"):
+            phrases = find_crisis_indicators(message)
+        if not phrases:
+            return None
+        CRISIS_DETECTIONS.labels(mode=mode).inc()
+        logger.warning(f"Crisis indicators detected ({', '.join(phrases)}), sending crisis resources")
+        return {
+            "response": load_crisis_response(),
+            "status": "success",
+            "sources": None,
+            "used_knowledge_base": False,
+            "crisis_detected": True,
+        }
+
+    @staticmethod
+    def _missing_key_result() -> Dict[str, Any]:
+        GEMINI_ERRORS.labels(kind="missing_key").inc()
+        return {
+            "response": "Gemini API key not set on server. Please contact admin.",
+            "status": "error"
+        }
+
+    @staticmethod
+    def _empty_response_result() -> Dict[str, Any]:
+        GEMINI_ERRORS.labels(kind="empty_response").inc()
+        logger.error("Received empty response from Gemini")
+        return {
+            "response": "No response generated from Gemini API.",
+            "status": "error"
+        }
+
+    @staticmethod
+    def _fallback_result(error: Exception) -> Dict[str, Any]:
+        GEMINI_ERRORS.labels(kind="circuit_open" if isinstance(error, CircuitOpenError) else "unavailable").inc()
+        logger.warning(f"Serving fallback response, Gemini unavailable: {error}")
+        return {
+            "response": FALLBACK_RESPONSE,
+            "status": "fallback",
+            "sources": None,
+            "used_knowledge_base": False,
+        }
+
+    def _api_error_result(self, error: Exception) -> Dict[str, Any]:
+        if isinstance(error, CircuitOpenError) or is_transient(error):
+            return self._fallback_result(error)
+        GEMINI_ERRORS.labels(kind="api_error").inc()
+        logger.error(f"Gemini API error: {error}")
+        return {
+            "response": "Error contacting Gemini API.",
+            "status": "error",
+            "error": str(error)
+        }
+
+    def generate_response(self, message: str, conversation_context: Dict = None) -> Dict[str, Any]:
+        crisis = self._crisis_result(message, "reply")
+        if crisis is not None:
+            return crisis
+        if not GEMINI_API_KEY:
+            return self._missing_key_result()
 
-Then give at least one small, practical suggestion in the same message so the user is not left with only questions.
+        try:
+            # Created once per process
+            model = get_chat_model()
 
-Privacy and data hints
-Do not promise perfect confidentiality or data deletion.
+            # Generic questions may be answered from the semantic response cache
+            cached, cache_embedding = self._lookup_cached_response(message, conversation_context)
+            if cached is not None:
+                return cached
 
-If users ask, explain in simple terms that their messages may be processed and stored by systems running the model and possibly reviewed to improve the service, depending on the host application’s policies. Encourage them not to share full names, addresses, or highly identifying information.
+            formatted_message, sources = self._build_prompt(message, conversation_context)
+            logger.info(f"Sending message to Gemini: {message[:100]}...")
+            with time_stage("generation"):
+                response = _generate(model, formatted_message)
+            _log_usage(response)
 
-Meta‑instructions for this assistant
-If user requests that you act “like my personal psychiatrist/therapist” or “diagnose me,” decline that specific request but offer supportive self‑help and encourage professional evaluation when appropriate.​
+            if response.text:
+                logger.info("Successfully received response from Gemini")
+                # Add source attribution if sources were used
+                response_text = response.text + self._source_attribution(response.text, sources)
+                return self._success_result(response_text, sources, cache_embedding)
+            
+            return self._empty_response_result()
+        except Exception as e:
+            return self._api_error_result(e)
+
+    def stream_response(self, message: str, conversation_context: Dict = None) -> Iterator[Dict[str, Any]]:
+        """Generate a response incrementally.
+
+        Yields {"event": "token", "data": {"text": ...}} for each piece of text
+        as Gemini produces it, then exactly one final event: "done" with the
+        same payload generate_response returns, or "error".
+
+        If the message contains crisis indicators, the crisis resources are
+        streamed first, before any network call, and Gemini's reply follows
+        them; should Gemini fail, the stream still ends with "done" carrying
+        the crisis resources.
+        """
+        crisis = self._crisis_result(message, "stream")
+        if crisis is not None:
+            yield {"event": "token", "data": {"text": crisis["response"]}}
+            if not GEMINI_API_KEY:
+                yield {"event": "done", "data": crisis}
+                return
+        elif not GEMINI_API_KEY:
+            yield {"event": "error", "data": self._missing_key_result()}
+            return
+
+        parts = []
+        try:
+            model = get_chat_model()
+
+            cached, cache_embedding = self._lookup_cached_response(message, conversation_context)
+            if cached is not None:
+                yield {"event": "token", "data": {"text": cached["response"]}}
+                yield {"event": "done", "data": cached}
+                return
+
+            formatted_message, sources = self._build_prompt(message, conversation_context)
+            if crisis is not None:
+                formatted_message += CRISIS_FOLLOW_UP_NOTE
+            logger.info(f"Streaming message to Gemini: {message[:100]}...")
+            # Time to first token: the rest of the stream is paced by the client as much as by Gemini
+            started = time.perf_counter()
+            breaker = get_breaker(GENERATION_BREAKER)
+            with breaker.guard():
+                chunks = model.generate_content(
+                    formatted_message, stream=True, request_options={"timeout": GEMINI_GENERATE_TIMEOUT}
+                )
+                for chunk in chunks:
+                    text = chunk.text
+                    if text:
+                        if not parts:
+                            STAGE_SECONDS.labels(stage="first_token").observe(time.perf_counter() - started)
+                            if crisis is not None:
+                                yield {"event": "token", "data": {"text": "\n\n"}}
+                        parts.append(text)
+                        yield {"event": "token", "data": {"text": text}}
+
+            response_text = "".join(parts)
+            if not response_text:
+                result = self._empty_response_result()
+                if crisis is not None:
+                    yield {"event": "done", "data": crisis}
+                    return
+                yield {"event": "error", "data": result}
+                return
+
+            attribution = self._source_attribution(response_text, sources)
+            if attribution:
+                yield {"event": "token", "data": {"text": attribution}}
+            result = self._success_result(response_text + attribution, sources, cache_embedding)
+            if crisis is not None:
+                result = dict(result, response=f"{crisis['response']}\n\n{result['response']}", crisis_detected=True)
+            yield {"event": "done", "data": result}
+        except Exception as e:
+            result = self._api_error_result(e)
+            if crisis is not None:
+                # The resources already went out; they stand as the answer
+                yield {"event": "done", "data": crisis}
+                return
+            # Nothing streamed yet: the fallback can stand in for the whole answer
+            if result["status"] == "fallback" and not parts:
+                yield {"event": "token", "data": {"text": result["response"]}}
+                yield {"event": "done", "data": result}
+                return
+            yield {"event": "error", "data": result}
+
+    def __call__(self, message: str, conversation_context: Dict = None) -> Dict[str, Any]:
+        return self.generate_response(message, conversation_context)
+
+
+class AsyncChatService(ChatService):
+    """ChatService for the ASGI request path.
+
+    Query embedding and generation await the async Gemini client methods, so a
+    single worker keeps many requests in flight while they wait on the API
+    instead of holding one thread per request. Prompt assembly, the response
+    cache and result handling are shared with ChatService.
+    """
+
+    async def _abuild_prompt(self, message: str, conversation_context: Dict = None) -> Tuple[str, List[str]]:
+        relevant_docs = []
+        try:
+            with time_stage("retrieval"):
+                relevant_docs = await self.document_store.aget_relevant_chunks(message)
+        except Exception as e:
+            logger.warning(f"Failed to retrieve documents: {e}. Continuing without document context.")
+        return self._format_prompt(message, relevant_docs, conversation_context)
 
-If user asks how to build or bypass mental‑health safety mechanisms, do not provide technical instructions. Explain that safety constraints are necessary to reduce risk of harm.
+    async def _alookup_cached_response(self, message: str,
+                                       conversation_context: Dict = None) -> Tuple[Optional[Dict[str, Any]], Optional[List[float]]]:
+        if not self._cacheable(message, conversation_context):
+            return None, None
+        try:
+            cache_embedding = await self.document_store.aembed_query(message)
+        except Exception as e:
+            logger.warning(f"Skipping response cache, query embedding failed: {e}")
+            return None, None
+        return self._cached_response_hit(cache_embedding)
+
+    async def generate_response(self, message: str, conversation_context: Dict = None) -> Dict[str, Any]:
+        crisis = self._crisis_result(message, "reply")
+        if crisis is not None:
+            return crisis
+        if not GEMINI_API_KEY:
+            return self._missing_key_result()
 
-If uncertain whether the situation is a crisis, err on the side of safety by:
+        try:
+            model = get_chat_model()
 
-Asking one clarifying question about their current safety, and
+            cached, cache_embedding = await self._alookup_cached_response(message, conversation_context)
+            if cached is not None:
+                return cached
 
-Reminding them that if they are in immediate danger, they must contact local emergency services or a crisis line.
-            """
-            
-            # Get relevant documents (handle errors gracefully)
-            relevant_docs = []
-            try:
-                relevant_docs = self.document_store.get_relevant_chunks(message)
-            except Exception as e:
-                logger.warning(f"Failed to retrieve documents: {e}. Continuing without document context.")
-            
-            # Add context from documents if available
-            context = ""
-            sources = []
-            if relevant_docs:
-                context = "\n\n=== RELEVANT INFORMATION FROM KNOWLEDGE BASE ===\n"
-                for i, doc in enumerate(relevant_docs, 1):
-                    context += f"\n[Source {i}: {doc['source']}]\n{doc['content']}\n"
-                    sources.append(doc['source'])
-                context += "\n=== END OF KNOWLEDGE BASE CONTEXT ===\n"
-                context += "\nIMPORTANT: When you use information from the knowledge base above, you MUST:\n"
-                context += "1. Mention that you're referencing information from your knowledge base\n"
-                context += "2. Cite the source(s) clearly in your response\n"
-                context += "3. Use phrases like 'According to our mental health resources' or 'Based on our knowledge base'\n"
-            
-            formatted_message = f"{system_message}\n{context}\n\nUser Question: {message}\n\nYour response (remember to cite sources if you used knowledge base information):"
-            logger.info(f"Sending message to Gemini: {message[:100]}...")
-            response = model.generate_content(formatted_message)
-
-            # Add source attribution if sources were used
-            response_text = response.text
-            if sources:
-                # Check if sources are already mentioned in the response
-                sources_mentioned = any(source.lower() in response_text.lower() for source in sources)
-                if not sources_mentioned:
-                    # Add formatted citation
-                    unique_sources = list(set(sources))
-                    if len(unique_sources) == 1:
-                        response_text += f"\n\n📚 *Source: {unique_sources[0]}*"
-                    else:
-                        response_text += f"\n\n📚 *Sources: {', '.join(unique_sources)}*"
-                else:
-                    # Sources already mentioned, just add a note
-                    response_text += f"\n\n📚 *Referenced from knowledge base*"
+            formatted_message, sources = await self._abuild_prompt(message, conversation_context)
+            logger.info(f"Sending message to Gemini (async): {message[:100]}...")
+            with time_stage("generation"):
+                response = await _agenerate(model, formatted_message)
+            _log_usage(response)
 
             if response.text:
-                logger.info("Successfully received response from Gemini")
-                return {
-                    "response": response_text,
-                    "status": "success",
-                    "sources": sources if sources else None,  # Include sources in response
-                    "used_knowledge_base": len(sources) > 0  # Flag indicating if KB was used
-                }
-            
-            logger.error("Received empty response from Gemini")
-            return {
-                "response": "No response generated from Gemini API.",
-                "status": "error"
-            }
+                response_text = response.text + self._source_attribution(response.text, sources)
+                return self._success_result(response_text, sources, cache_embedding)
+            return self._empty_response_result()
+        except Exception as e:
+            return self._api_error_result(e)
+
+    async def stream_response(self, message: str, conversation_context: Dict = None) -> AsyncIterator[Dict[str, Any]]:
+        """Async counterpart of ChatService.stream_response, yielding the same events.
+
+        Gemini's chunks are awaited as they arrive, so an ASGI server sends
+        every token to the client as soon as it is generated.
+        """
+        crisis = self._crisis_result(message, "stream")
+        if crisis is not None:
+            yield {"event": "token", "data": {"text": crisis["response"]}}
+            if not GEMINI_API_KEY:
+                yield {"event": "done", "data": crisis}
+                return
+        elif not GEMINI_API_KEY:
+            yield {"event": "error", "data": self._missing_key_result()}
+            return
+
+        parts = []
+        try:
+            model = get_chat_model()
+
+            cached, cache_embedding = await self._alookup_cached_response(message, conversation_context)
+            if cached is not None:
+                yield {"event": "token", "data": {"text": cached["response"]}}
+                yield {"event": "done", "data": cached}
+                return
+
+            formatted_message, sources = await self._abuild_prompt(message, conversation_context)
+            if crisis is not None:
+                formatted_message += CRISIS_FOLLOW_UP_NOTE
+            logger.info(f"Streaming message to Gemini (async): {message[:100]}...")
+            started = time.perf_counter()
+            breaker = get_breaker(GENERATION_BREAKER)
+            with breaker.guard():
+                chunks = await model.generate_content_async(
+                    formatted_message, stream=True, request_options={"timeout": GEMINI_GENERATE_TIMEOUT}
+                )
+                async for chunk in chunks:
+                    text = chunk.text
+                    if text:
+                        if not parts:
+                            STAGE_SECONDS.labels(stage="first_token").observe(time.perf_counter() - started)
+                            if crisis is not None:
+                                yield {"event": "token", "data": {"text": "\n\n"}}
+                        parts.append(text)
+                        yield {"event": "token", "data": {"text": text}}
+
+            response_text = "".join(parts)
+            if not response_text:
+                result = self._empty_response_result()
+                if crisis is not None:
+                    yield {"event": "done", "data": crisis}
+                    return
+                yield {"event": "error", "data": result}
+                return
+
+            attribution = self._source_attribution(response_text, sources)
+            if attribution:
+                yield {"event": "token", "data": {"text": attribution}}
+            result = self._success_result(response_text + attribution, sources, cache_embedding)
+            if crisis is not None:
+                result = dict(result, response=f"{crisis['response']}\n\n{result['response']}", crisis_detected=True)
+            yield {"event": "done", "data": result}
         except Exception as e:
-            logger.error(f"Gemini API error: {e}")
-            return {
-                "response": "Error contacting Gemini API.",
-                "status": "error",
-                "error": str(e)
-            }
-
-    def __call__(self, message: str, chat_history: list = None) -> Dict[str, Any]:
-        return self.generate_response(message, chat_history)
\ No newline at end of file
+            result = self._api_error_result(e)
+            if crisis is not None:
+                yield {"event": "done", "data": crisis}
+                return
+            if result["status"] == "fallback" and not parts:
+                yield {"event": "token", "data": {"text": result["response"]}}
+                yield {"event": "done", "data": result}
+                return
+            yield {"event": "error", "data": result}
+
+    async def __call__(self, message: str, conversation_context: Dict = None) -> Dict[str, Any]:
+        return await self.generate_response(message, conversation_context)
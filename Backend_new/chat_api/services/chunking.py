@@ -0,0 +1,80 @@
+from typing import Dict, List, Tuple
+import re
+
+DEFAULT_CHUNK_SIZE = 1200
+DEFAULT_CHUNK_OVERLAP = 200
+
+# A paragraph break, or whitespace following sentence-ending punctuation
+_BOUNDARY_RE = re.compile(r"\n\s*\n|(?<=[.!?。])[\"')\]]*\s+")
+
+
+def _split_units(text: str, max_chars: int) -> List[Tuple[int, int]]:
+    """Split text into (start, end) spans of sentences/paragraphs, none longer than max_chars"""
+    units = []
+    position = 0
+    for match in _BOUNDARY_RE.finditer(text):
+        units.append((position, match.start()))
+        position = match.end()
+    units.append((position, len(text)))
+
+    bounded = []
+    for start, end in units:
+        # Trim surrounding whitespace so offsets point at real content
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if start == end:
+            continue
+        # A single over-long sentence is hard-split, preferably at whitespace
+        while end - start > max_chars:
+            cut = text.rfind(" ", start + 1, start + max_chars)
+            if cut <= start:
+                cut = start + max_chars
+            bounded.append((start, cut))
+            start = cut
+            while start < end and text[start].isspace():
+                start += 1
+        if start < end:
+            bounded.append((start, end))
+    return bounded
+
+
+def split_into_chunks(text: str, max_chars: int = DEFAULT_CHUNK_SIZE,
+                      overlap: int = DEFAULT_CHUNK_OVERLAP) -> List[Dict]:
+    """Split text into overlapping chunks of at most `max_chars` characters.
+
+    Chunks end on sentence or paragraph boundaries, and each one starts with
+    the trailing sentences (up to `overlap` characters) of the previous chunk
+    so context that straddles a boundary is not lost. Every chunk carries the
+    `start`/`end` character offsets of its span in the source text.
+    """
+    if max_chars <= 0:
+        raise ValueError("max_chars must be positive")
+    if not 0 <= overlap < max_chars:
+        raise ValueError("overlap must be between 0 and max_chars")
+
+    units = _split_units(text, max_chars)
+    chunks = []
+    first = 0
+    while first < len(units):
+        start = units[first][0]
+        last = first
+        while last + 1 < len(units) and units[last + 1][1] - start <= max_chars:
+            last += 1
+        end = units[last][1]
+        chunks.append({
+            "index": len(chunks),
+            "content": text[start:end],
+            "start": start,
+            "end": end,
+        })
+        if last + 1 >= len(units):
+            break
+
+        # Step back over whole units that fit in the overlap window, always advancing
+        next_first = last + 1
+        while next_first - 1 > first and end - units[next_first - 1][0] <= overlap:
+            next_first -= 1
+        first = next_first
+    return chunks
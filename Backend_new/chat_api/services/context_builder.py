@@ -0,0 +1,139 @@
+from typing import Callable, Dict, List, Optional
+import logging
+import math
+import os
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_HEADER = "=== SUMMARY OF EARLIER CONVERSATION ===\n"
+RECENT_HEADER = "=== RECENT CONVERSATION ===\n"
+TURN_SEPARATOR = "\n\n"
+
+
+def estimate_tokens(text: str) -> int:
+    """Local token estimate (about four characters per token for Gemini models on English text).
+
+    Rounding up per piece means the estimate of a concatenation never exceeds
+    the sum of the estimates of its parts.
+    """
+    if not text:
+        return 0
+    return math.ceil(len(text) / 4)
+
+
+def truncate_to_tokens(text: str, max_tokens: int, token_counter: Callable[[str], int] = estimate_tokens,
+                       keep_end: bool = False) -> str:
+    """Longest prefix (or suffix with keep_end) of `text` that fits in `max_tokens`"""
+    if max_tokens <= 0 or not text:
+        return ""
+    if token_counter(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        candidate = text[-middle:] if keep_end else text[:middle]
+        if token_counter(candidate) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    if low == 0:
+        return ""
+    return text[-low:] if keep_end else text[:low]
+
+
+def format_turn(turn: Dict) -> str:
+    text = f"User: {turn.get('message') or ''}"
+    if turn.get("response"):
+        text += f"\nAssistant: {turn['response']}"
+    return text
+
+
+def extractive_summary(previous_summary: str, transcript: str) -> str:
+    """Fallback summarizer: append the new turns to the previous summary verbatim"""
+    if not previous_summary:
+        return transcript
+    return f"{previous_summary}\n{transcript}"
+
+
+class ContextBuilder:
+    """Fits a conversation into a fixed token budget for the prompt.
+
+    The most recent turns are included verbatim, newest first, until the
+    budget runs out; the conversation's rolling summary (capped at
+    `summary_max_tokens`) stands in for everything older. Turns that no
+    longer fit are returned as `evicted` so the caller can fold them into the
+    summary with update_summary(). The rendered context never exceeds
+    `max_tokens` as measured by `token_counter`.
+    """
+
+    def __init__(self, max_tokens: int = None, summary_max_tokens: int = None,
+                 token_counter: Callable[[str], int] = estimate_tokens,
+                 summarizer: Callable[[str, str], str] = None):
+        self.max_tokens = max_tokens if max_tokens is not None else int(
+            os.getenv("CONVERSATION_CONTEXT_TOKENS", 2000))
+        self.summary_max_tokens = summary_max_tokens if summary_max_tokens is not None else int(
+            os.getenv("CONVERSATION_SUMMARY_TOKENS", 400))
+        self.summary_max_tokens = min(self.summary_max_tokens, self.max_tokens)
+        self.token_counter = token_counter
+        self.summarizer = summarizer or extractive_summary
+
+    def _render(self, summary: str, turns: List[Dict]) -> str:
+        parts = []
+        if summary:
+            parts.append(SUMMARY_HEADER + summary)
+        if turns:
+            parts.append(RECENT_HEADER + TURN_SEPARATOR.join(format_turn(turn) for turn in turns))
+        return TURN_SEPARATOR.join(parts)
+
+    def build(self, turns: List[Dict], summary: Optional[str] = None) -> Dict:
+        """Select what of `turns` (oldest first) and `summary` goes into the prompt.
+
+        Returns {"text", "tokens", "summary", "turns", "evicted"}: `turns` are
+        the included turns and `evicted` the older ones that did not fit.
+        """
+        summary_budget = self.summary_max_tokens - self.token_counter(SUMMARY_HEADER)
+        summary = truncate_to_tokens(summary or "", summary_budget, self.token_counter, keep_end=True)
+        remaining = self.max_tokens - self.token_counter(self._render(summary, []))
+        remaining -= self.token_counter(RECENT_HEADER)
+
+        included: List[Dict] = []
+        for turn in reversed(turns):
+            cost = self.token_counter(format_turn(turn) + TURN_SEPARATOR)
+            if cost > remaining:
+                break
+            included.append(turn)
+            remaining -= cost
+        included.reverse()
+
+        # The per-piece accounting holds for subadditive counters; re-check the rendered
+        # text so the budget also holds for any other counter
+        text = self._render(summary, included)
+        while included and self.token_counter(text) > self.max_tokens:
+            included.pop(0)
+            text = self._render(summary, included)
+        if self.token_counter(text) > self.max_tokens:
+            summary = ""
+            text = ""
+
+        return {
+            "text": text,
+            "tokens": self.token_counter(text),
+            "summary": summary,
+            "turns": included,
+            "evicted": turns[:len(turns) - len(included)],
+        }
+
+    def update_summary(self, summary: Optional[str], evicted: List[Dict]) -> str:
+        """Fold evicted turns into the rolling summary, capped at the summary budget"""
+        summary = summary or ""
+        if not evicted:
+            return summary
+        transcript = TURN_SEPARATOR.join(format_turn(turn) for turn in evicted)
+        budget = self.summary_max_tokens - self.token_counter(SUMMARY_HEADER)
+        try:
+            updated = self.summarizer(summary, transcript)
+        except Exception as e:
+            logger.warning(f"Conversation summarizer failed, keeping recent text instead: {e}")
+            updated = extractive_summary(summary, transcript)
+        # Over budget, keep the end: the newest turns matter most for continuity
+        return truncate_to_tokens(updated, budget, self.token_counter, keep_end=True)
@@ -0,0 +1,170 @@
+from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.utils import timezone
+from .mongo_client import mongo_db
+
+logger = logging.getLogger(__name__)
+
+# Unsummarized turns loaded for the context builder; older ones only survive in the summary
+CONTEXT_TURN_LIMIT = int(os.getenv("CONVERSATION_CONTEXT_TURNS", 50))
+# Latest turns also kept on the conversation document, covering those the chat log writer has not stored yet
+RECENT_TURN_LIMIT = int(os.getenv("CONVERSATION_RECENT_TURNS", 10))
+
+_CONVERSATION_FIELDS = {"_id": 1, "summary": 1, "summarized_through": 1, "recent_turns": 1}
+_TURN_FIELDS = {"message": 1, "response": 1, "created_at": 1}
+
+
+class ConversationNotFound(Exception):
+    """The conversation id is malformed or belongs to another user"""
+
+
+def _parse_conversation_id(conversation_id) -> ObjectId:
+    try:
+        return ObjectId(conversation_id)
+    except (InvalidId, TypeError):
+        raise ConversationNotFound(conversation_id)
+
+
+def _new_conversation(user_id: int) -> Dict:
+    now = timezone.now()
+    return {"user_id": user_id, "created_at": now, "updated_at": now, "summary": "", "summarized_through": None}
+
+
+def _turns_query(conversation: Dict) -> Dict:
+    """Successful turns of the conversation that are not yet folded into its summary"""
+    query = {"conversation_id": conversation["_id"], "status": "success"}
+    through = conversation.get("summarized_through")
+    if through:
+        query["$or"] = [
+            {"created_at": {"$gt": through["created_at"]}},
+            {"created_at": through["created_at"], "_id": {"$gt": through["_id"]}},
+        ]
+    return query
+
+
+def _is_unsummarized(turn: Dict, through: Optional[Dict]) -> bool:
+    return not through or (turn["created_at"], turn["_id"]) > (through["created_at"], through["_id"])
+
+
+def _merge_turns(conversation: Dict, stored: List[Dict], limit: int) -> List[Dict]:
+    """Stored turns plus the recent turns of the conversation document not written to db.chats yet, oldest first"""
+    through = conversation.get("summarized_through")
+    turns = {
+        turn["_id"]: turn for turn in conversation.get("recent_turns") or [] if _is_unsummarized(turn, through)
+    }
+    turns.update((turn["_id"], turn) for turn in stored)
+    return sorted(turns.values(), key=lambda turn: (turn["created_at"], turn["_id"]))[-limit:]
+
+
+def _recent_turn_update(record: Dict) -> Dict:
+    turn = {key: record[key] for key in ("_id", *_TURN_FIELDS)}
+    return {
+        "$push": {"recent_turns": {"$each": [turn], "$slice": -RECENT_TURN_LIMIT}},
+        "$set": {"updated_at": record["created_at"]},
+    }
+
+
+def record_turn(db, conversation: Dict, record: Dict) -> None:
+    """Add a successful chat record to the conversation document.
+
+    Chat records reach db.chats through the write-behind writer, up to a
+    flush interval later; the next message of the conversation reads this
+    copy meanwhile. The record keeps the same _id, so it is merged, not
+    duplicated, once the writer has stored it.
+    """
+    if record.get("status") == "success":
+        db.conversations.update_one({"_id": conversation["_id"]}, _recent_turn_update(record))
+
+
+async def arecord_turn(db, conversation: Dict, record: Dict) -> None:
+    if record.get("status") == "success":
+        await db.conversations.update_one({"_id": conversation["_id"]}, _recent_turn_update(record))
+
+
+def resolve_conversation(db, user_id: int, conversation_id: Optional[str]) -> Dict:
+    """Return the user's conversation (_id, summary, summarized_through), starting one when no id is given.
+
+    Chat records reference their conversation by id instead of carrying a
+    copy of the history, so each turn is stored once.
+    """
+    if not conversation_id:
+        conversation = _new_conversation(user_id)
+        db.conversations.insert_one(conversation)
+        conversation["is_new"] = True
+        return conversation
+    conversation = db.conversations.find_one(
+        {"_id": _parse_conversation_id(conversation_id), "user_id": user_id}, _CONVERSATION_FIELDS
+    )
+    if conversation is None:
+        raise ConversationNotFound(conversation_id)
+    return conversation
+
+
+async def aresolve_conversation(db, user_id: int, conversation_id: Optional[str]) -> Dict:
+    """resolve_conversation for the async MongoDB client"""
+    if not conversation_id:
+        conversation = _new_conversation(user_id)
+        await db.conversations.insert_one(conversation)
+        conversation["is_new"] = True
+        return conversation
+    conversation = await db.conversations.find_one(
+        {"_id": _parse_conversation_id(conversation_id), "user_id": user_id}, _CONVERSATION_FIELDS
+    )
+    if conversation is None:
+        raise ConversationNotFound(conversation_id)
+    return conversation
+
+
+def load_recent_turns(db, conversation: Dict, limit: int = CONTEXT_TURN_LIMIT) -> List[Dict]:
+    """Most recent unsummarized turns, oldest first"""
+    if conversation.get("is_new"):
+        return []  # Started by this request, nothing stored yet
+    turns = list(
+        db.chats.find(_turns_query(conversation), _TURN_FIELDS)
+        .sort([("created_at", -1), ("_id", -1)])
+        .limit(limit)
+    )
+    return _merge_turns(conversation, turns, limit)
+
+
+async def aload_recent_turns(db, conversation: Dict, limit: int = CONTEXT_TURN_LIMIT) -> List[Dict]:
+    if conversation.get("is_new"):
+        return []
+    cursor = db.chats.find(_turns_query(conversation), _TURN_FIELDS).sort([("created_at", -1), ("_id", -1)])
+    return _merge_turns(conversation, await cursor.to_list(length=limit), limit)
+
+
+def save_summary(db, conversation: Dict, summary: str, last_turn: Dict) -> bool:
+    """Store the new summary unless another request already advanced it; returns True if stored"""
+    result = db.conversations.update_one(
+        # Only advance from the state this summary was built on, so concurrent updates never fold a turn twice
+        {"_id": conversation["_id"], "summarized_through": conversation.get("summarized_through")},
+        {"$set": {
+            "summary": summary,
+            "summarized_through": {"created_at": last_turn["created_at"], "_id": last_turn["_id"]},
+            "updated_at": timezone.now(),
+        }},
+    )
+    return result.modified_count == 1
+
+
+def _update_summary(conversation: Dict, evicted: List[Dict], context_builder) -> None:
+    try:
+        summary = context_builder.update_summary(conversation.get("summary"), evicted)
+        if not save_summary(mongo_db(), conversation, summary, evicted[-1]):
+            logger.info(f"Summary of conversation {conversation['_id']} was updated concurrently; skipped")
+    except Exception as e:
+        logger.warning(f"Failed to update summary of conversation {conversation['_id']}: {e}")
+
+
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="conversation-summary")
+
+
+def schedule_summary_update(conversation: Dict, context: Dict, context_builder) -> None:
+    """Fold the turns the context builder evicted into the stored summary, off the request path"""
+    if context["evicted"]:
+        _summary_executor.submit(_update_summary, conversation, context["evicted"], context_builder)
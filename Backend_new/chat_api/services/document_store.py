@@ -1,110 +1,542 @@
-from typing import List, Dict
+from typing import Hashable, List, Dict, Optional, Sequence, Tuple
+import asyncio
+import logging
 import os
+import threading
 from pathlib import Path
-import json
-import google.generativeai as genai
+from .bm25_index import BM25Index
+from .chunking import DEFAULT_CHUNK_OVERLAP, DEFAULT_CHUNK_SIZE, split_into_chunks
+from .embedding_cache import EmbeddingCache
+from .embedding_client import EmbeddingClient, get_embedding_client
+from .ivf_index import IVFIndex
+from .kb_storage import create_layout
+from .metrics import EMBEDDING_FAILURES, KB_RELOADS, KB_RETRIEVALS, time_stage
+from .query_cache import QueryEmbeddingCache
+from .vector_index import VectorIndex
+
+logger = logging.getLogger(__name__)
+
+IVF_INDEX_FILE = Path(".cache") / "ivf_index.npz"
+BM25_INDEX_FILE = Path(".cache") / "bm25_index.json"
+
+
+class KnowledgeBaseSnapshot:
+    """One version of the searchable knowledge base: documents, chunks and both indexes.
+
+    A query reads the current snapshot once and uses only that. Updates are
+    applied to a copy, which then replaces the current snapshot in a single
+    assignment, so queries see either the old or the new version and never a
+    half-applied update.
+    """
+
+    def __init__(self, version: int = 0, documents: List[Dict] = None, chunks: Dict = None,
+                 index: VectorIndex = None, lexical_index: BM25Index = None,
+                 files: Dict[str, Tuple[int, int]] = None):
+        self.version = version
+        self.documents = documents if documents is not None else []
+        self.chunks = chunks if chunks is not None else {}  # (source, chunk index) -> chunk
+        self.index = index if index is not None else VectorIndex()
+        self.lexical_index = lexical_index if lexical_index is not None else BM25Index()
+        # Document file name -> (mtime in ns, size) when it was loaded, to detect changed files
+        self.files = files if files is not None else {}
+
+    @property
+    def has_unembedded_chunks(self) -> bool:
+        return len(self.index) != len(self.chunks)
+
+    def copy(self) -> "KnowledgeBaseSnapshot":
+        """The next version, with its own indexes so it can be changed while this one serves queries"""
+        return KnowledgeBaseSnapshot(
+            version=self.version + 1,
+            documents=list(self.documents),
+            # Chunks get their embedding set in place, so every snapshot has its own chunk dicts
+            chunks={chunk_id: dict(chunk) for chunk_id, chunk in self.chunks.items()},
+            index=self.index.copy(),
+            lexical_index=self.lexical_index.copy(),
+            files=dict(self.files),
+        )
+
 
 class DocumentStore:
-    def __init__(self, docs_dir: str = "knowledge_base"):
-        self.docs_dir = Path(docs_dir)
+    # Minimum cosine similarity for a chunk to be used as context
+    SIMILARITY_THRESHOLD = 0.7
+    # Minimum BM25 score for a lexical match to be used as context when no chunk passes the similarity
+    # threshold. `evaluate_retrieval benchmarks/data/retrieval_queries.jsonl --document sample.txt
+    # --retrieval lexical`: at 3.0 no off-topic query retrieves anything and recall@1 is unchanged (0.44);
+    # at 2.0, 5 of the 8 off-topic queries still get a chunk
+    LEXICAL_MIN_SCORE = 3.0
+    # Candidates taken from each ranking before reciprocal rank fusion
+    FUSION_CANDIDATES = 20
+
+    def __init__(self, docs_dir: str = None, embedding_cache: EmbeddingCache = None,
+                 chunk_size: int = None, chunk_overlap: int = None,
+                 embedding_client: EmbeddingClient = None, index_backend: str = None,
+                 query_cache: QueryEmbeddingCache = None, storage: str = None, layout=None):
+        self.docs_dir = Path(docs_dir or os.getenv("KNOWLEDGE_BASE_DIR", "knowledge_base"))
         self.docs_dir.mkdir(exist_ok=True)
-        self.documents = []
+        # "files" keeps one JSON file per document, "packed" one JSONL file plus memory-mapped
+        # embeddings, "mongo" shares documents and embeddings between replicas through MongoDB
+        self.layout = layout or create_layout(self.docs_dir, storage)
+        self.chunk_size = chunk_size or int(os.getenv("KB_CHUNK_SIZE", DEFAULT_CHUNK_SIZE))
+        self.chunk_overlap = (
+            chunk_overlap if chunk_overlap is not None
+            else int(os.getenv("KB_CHUNK_OVERLAP", DEFAULT_CHUNK_OVERLAP))
+        )
+        self.embedding_client = embedding_client or get_embedding_client()
+        # Cache key of the embeddings: the model, qualified by the backend unless it is Gemini
+        self.embedding_model = self.embedding_client.cache_model
+        self.embedding_cache = embedding_cache or self.layout.create_embedding_cache(self.embedding_model)
+        self.query_cache = query_cache or QueryEmbeddingCache.from_settings()
+        # "exact" scans every chunk; "ivf" is an approximate index for large knowledge bases
+        self.index_backend = (index_backend or os.getenv("VECTOR_INDEX", "exact")).lower()
+        self._snapshot = KnowledgeBaseSnapshot()
+        # Serializes updates that build and swap in a new snapshot (add_documents, reload, embedding)
+        self._update_lock = threading.Lock()
+        self._watcher: Optional[threading.Thread] = None
+        self._stop_watching = threading.Event()
         self.load_documents()
 
+    @property
+    def snapshot(self) -> KnowledgeBaseSnapshot:
+        return self._snapshot
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version
+
+    @property
+    def documents(self) -> List[Dict]:
+        return self._snapshot.documents
+
+    @property
+    def chunks(self) -> Dict:
+        return self._snapshot.chunks
+
+    @property
+    def index(self) -> VectorIndex:
+        return self._snapshot.index
+
+    @property
+    def lexical_index(self) -> BM25Index:
+        return self._snapshot.lexical_index
+
     def add_document(self, content: str, source: str, metadata: Dict = None) -> None:
         """Add a document to the store and save it"""
-        doc = {
-            "content": content,
-            "source": source,
-            "metadata": metadata or {},
-            "embedding": None  # Will be computed when needed
-        }
-        self.documents.append(doc)
-        self._save_document(doc)
-
-    def _save_document(self, doc: Dict) -> None:
-        """Save a document to disk"""
-        filename = Path(doc["source"]).stem
-        filepath = self.docs_dir / f"{filename}.json"
-        with open(filepath, 'w', encoding='utf-8') as f:
-            # Save without embedding as it's not JSON serializable
-            doc_to_save = doc.copy()
-            doc_to_save.pop("embedding", None)
-            json.dump(doc_to_save, f, ensure_ascii=False, indent=2)
+        self.add_documents([{"content": content, "source": source, "metadata": metadata}])
+
+    def add_documents(self, docs: List[Dict]) -> None:
+        """Add and save several documents, embedding all of their chunks in batched API calls"""
+        with self._update_lock:
+            snapshot = self._snapshot.copy()
+            # Re-adding a source replaces it, the last of several docs with one source wins
+            docs = list({
+                doc["source"]: {"content": doc["content"], "source": doc["source"], "metadata": doc.get("metadata") or {}}
+                for doc in docs
+            }.values())
+            for doc in docs:
+                self._remove_source(snapshot, doc["source"])
+            snapshot.files.update(self.layout.save(docs, snapshot.documents + docs))
+            for doc in docs:
+                self._index_document(snapshot, doc)
+            self._embed_missing_chunks(snapshot)
+            self._publish(snapshot)
 
     def load_documents(self) -> None:
-        """Load all documents from disk"""
-        self.documents = []
+        """Load all documents from the storage layout"""
+        snapshot = KnowledgeBaseSnapshot(
+            version=self._snapshot.version + 1,
+            index=self._create_index(),
+            lexical_index=self._load_lexical_index(),
+        )
+        persisted_ids = set(snapshot.index.ids)
         if not self.docs_dir.exists():
+            self._snapshot = snapshot
             return
-        
-        for file in self.docs_dir.glob("*.json"):
-            with open(file, 'r', encoding='utf-8') as f:
-                self.documents.append(json.load(f))
 
-    def _get_embedding(self, text: str) -> List[float]:
-        """Get embedding for text using Gemini API"""
+        files = self.layout.scan()
+        for doc in self.layout.read_all(list(files)):
+            self._index_document(snapshot, doc)
+        snapshot.files.update(files)
+
+        # A persisted index may still hold chunks that were removed or lost their embedding
+        for chunk_id in persisted_ids:
+            chunk = snapshot.chunks.get(chunk_id)
+            if chunk is None or chunk.get("embedding") is None:
+                snapshot.index.remove(chunk_id)
+        if set(snapshot.index.ids) != persisted_ids:
+            self._persist_index(snapshot)
+        for chunk_id in snapshot.lexical_index.ids:
+            if chunk_id not in snapshot.chunks:
+                snapshot.lexical_index.remove(chunk_id)
+        self._persist_lexical_index(snapshot)
+        self._snapshot = snapshot
+
+    def reload(self) -> Optional[Dict[str, int]]:
+        """Apply added, changed and removed document files without a restart or a full rebuild.
+
+        Files are compared with the current snapshot by modification time and
+        size, then the documents of a changed file by source; documents that
+        turn out unchanged (the file was only touched) are skipped. The delta
+        is applied to a copy of the current snapshot, only new chunk texts are
+        embedded, and the copy is swapped in once complete. Returns the number
+        of documents added, changed and removed, or None if no document
+        changed.
+        """
+        with self._update_lock:
+            current = self._snapshot
+            files = self.layout.scan()
+            updated = [name for name, signature in files.items() if current.files.get(name) != signature]
+            removed = [name for name in current.files if name not in files]
+            if not updated and not removed:
+                return None
+
+            snapshot = self._snapshot.copy()
+            counts = {"added": 0, "changed": 0, "removed": 0}
+            for name in removed:
+                for doc in [doc for doc in snapshot.documents if doc.get("file") == name]:
+                    self._remove_source(snapshot, doc["source"])
+                    counts["removed"] += 1
+                del snapshot.files[name]
+            for name in updated:
+                try:
+                    docs = self.layout.read(name)
+                except (OSError, ValueError) as e:
+                    # Not recorded in the snapshot, so it is retried on the next reload
+                    logger.warning(f"Skipping unreadable knowledge base file {name}: {e}")
+                    continue
+                snapshot.files[name] = files[name]
+                previous = {d["source"]: d for d in snapshot.documents if d.get("file") == name}
+                for doc in docs:
+                    old = previous.pop(doc["source"], None)
+                    if old is not None and (old["content"], old.get("metadata", {})) == (
+                            doc["content"], doc.get("metadata", {})):
+                        continue
+                    self._remove_source(snapshot, doc["source"])
+                    self._index_document(snapshot, doc)
+                    counts["changed" if old is not None else "added"] += 1
+                # Sources no longer in the file
+                for source in previous:
+                    self._remove_source(snapshot, source)
+                    counts["removed"] += 1
+            if not any(counts.values()):
+                # Files were only touched: publish their new signatures, the current version stays
+                snapshot.version = current.version
+                self._snapshot = snapshot
+                return None
+
+            self._embed_missing_chunks(snapshot)
+            self._publish(snapshot)
+        KB_RELOADS.labels(result="applied").inc()
+        logger.info(
+            f"Reloaded knowledge base as version {snapshot.version}: {counts['added']} added, "
+            f"{counts['changed']} changed, {counts['removed']} removed"
+        )
+        return counts
+
+    def _publish(self, snapshot: KnowledgeBaseSnapshot) -> None:
+        """Make a fully built snapshot the one queries use, then persist its indexes"""
+        self._snapshot = snapshot
+        self._persist_lexical_index(snapshot)
+        self._persist_index(snapshot)
+
+    def start_watching(self, interval: float = None) -> bool:
+        """Reload changed document files every `interval` seconds (KB_RELOAD_INTERVAL, 0 disables)"""
+        interval = interval if interval is not None else float(os.getenv("KB_RELOAD_INTERVAL", 30))
+        if interval <= 0:
+            return False
+        with self._update_lock:
+            if self._watcher is None or not self._watcher.is_alive():
+                self._stop_watching.clear()
+                self._watcher = threading.Thread(
+                    target=self._watch, args=(interval,), name="knowledge-base-reload", daemon=True
+                )
+                self._watcher.start()
+        return True
+
+    def stop_watching(self) -> None:
+        self._stop_watching.set()
+        if self._watcher is not None:
+            self._watcher.join()
+
+    def _watch(self, interval: float) -> None:
+        while not self._stop_watching.wait(interval):
+            try:
+                self.reload()
+            except Exception as e:
+                KB_RELOADS.labels(result="failed").inc()
+                logger.warning(f"Knowledge base reload failed, still serving version {self.version}: {e}")
+
+    def _create_index(self) -> VectorIndex:
+        if self.index_backend == "exact":
+            return VectorIndex()
+        if self.index_backend != "ivf":
+            raise ValueError(f"Unknown VECTOR_INDEX backend: {self.index_backend}")
+
+        tuning = {"n_probe": int(os.getenv("IVF_N_PROBE", 8))}
+        if os.getenv("IVF_N_LISTS"):
+            tuning["n_lists"] = int(os.getenv("IVF_N_LISTS"))
+        path = self.docs_dir / IVF_INDEX_FILE
+        if path.exists():
+            try:
+                return IVFIndex.load(path, **tuning)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Rebuilding unreadable IVF index {path}: {e}")
+        return IVFIndex(**tuning)
+
+    def _persist_index(self, snapshot: KnowledgeBaseSnapshot) -> None:
+        """Save the IVF index (vectors and trained centroids) so restarts skip k-means"""
+        if not isinstance(snapshot.index, IVFIndex):
+            return
+        try:
+            snapshot.index.save(self.docs_dir / IVF_INDEX_FILE)
+        except OSError as e:
+            logger.warning(f"Failed to persist IVF index: {e}")
+
+    def _load_lexical_index(self) -> BM25Index:
+        path = self.docs_dir / BM25_INDEX_FILE
+        if path.exists():
+            try:
+                return BM25Index.load(path)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Rebuilding unreadable BM25 index {path}: {e}")
+        return BM25Index()
+
+    def _persist_lexical_index(self, snapshot: KnowledgeBaseSnapshot) -> None:
+        """Save the BM25 index next to the documents when it has changed"""
+        if not snapshot.lexical_index.dirty:
+            return
         try:
-            # Use Gemini's embedding model
-            embedding_model = "models/embedding-001"
-            result = genai.embed_content(
-                model=embedding_model,
-                content=text,
-                task_type="retrieval_query"
+            snapshot.lexical_index.save(self.docs_dir / BM25_INDEX_FILE)
+        except OSError as e:
+            logger.warning(f"Failed to persist BM25 index: {e}")
+
+    def _index_document(self, snapshot: KnowledgeBaseSnapshot, doc: Dict) -> None:
+        """Split a document into chunks and index those whose embedding is already cached"""
+        doc["chunks"] = split_into_chunks(doc["content"], self.chunk_size, self.chunk_overlap)
+        snapshot.documents.append(doc)
+        for chunk in doc["chunks"]:
+            chunk_id = (doc["source"], chunk["index"])
+            embedding = self.embedding_cache.get(self.embedding_model, chunk["content"])
+            snapshot.chunks[chunk_id] = dict(
+                chunk, source=doc["source"], metadata=doc.get("metadata", {}), embedding=embedding
             )
-            return result['embedding']
-        except Exception as e:
-            # If embedding fails (e.g., quota exceeded), raise the error
-            raise e
+            if embedding is not None:
+                snapshot.index.add(chunk_id, embedding)
+            if not snapshot.lexical_index.has_current(chunk_id, chunk["content"]):
+                snapshot.lexical_index.add(chunk_id, chunk["content"])
+
+    @staticmethod
+    def _remove_source(snapshot: KnowledgeBaseSnapshot, source: str) -> None:
+        """Drop a document and all of its chunks from the snapshot"""
+        snapshot.documents = [doc for doc in snapshot.documents if doc["source"] != source]
+        for chunk_id in [chunk_id for chunk_id in snapshot.chunks if chunk_id[0] == source]:
+            del snapshot.chunks[chunk_id]
+            snapshot.index.remove(chunk_id)
+            snapshot.lexical_index.remove(chunk_id)
+
+    def embed_query(self, query: str) -> List[float]:
+        """Get the query embedding, from the query cache when this query was seen recently"""
+        embedding = self.query_cache.get(self.embedding_model, query)
+        if embedding is None:
+            try:
+                with time_stage("query_embedding"):
+                    embedding = self.embedding_client.embed_query(query)
+            except Exception:
+                EMBEDDING_FAILURES.labels(kind="query").inc()
+                raise
+            self.query_cache.set(self.embedding_model, query, embedding)
+        return embedding
+
+    async def aembed_query(self, query: str) -> List[float]:
+        """Async counterpart of embed_query; awaits the embedding API instead of blocking a thread"""
+        embedding = self.query_cache.get(self.embedding_model, query)
+        if embedding is None:
+            try:
+                with time_stage("query_embedding"):
+                    embedding = await self.embedding_client.aembed_query(query)
+            except Exception:
+                EMBEDDING_FAILURES.labels(kind="query").inc()
+                raise
+            self.query_cache.set(self.embedding_model, query, embedding)
+        return embedding
+
+    @property
+    def has_unembedded_chunks(self) -> bool:
+        return self._snapshot.has_unembedded_chunks
+
+    def _ensure_document_embeddings(self) -> None:
+        """Embed chunks of the current snapshot missing from the embedding cache"""
+        if not self.has_unembedded_chunks:
+            return
+
+        # Concurrent requests on a cold store wait here instead of all embedding the same chunks
+        with self._update_lock:
+            if not self.has_unembedded_chunks:
+                return
+            # Embedded into a copy: queries may be scoring the current snapshot's index right now
+            snapshot = self._snapshot.copy()
+            if self._embed_missing_chunks(snapshot):
+                self._publish(snapshot)
 
-    def get_relevant_chunks(self, query: str, top_k: int = 2) -> List[Dict]:
-        """Get the most relevant document chunks for a query"""
+    def _embed_missing_chunks(self, snapshot: KnowledgeBaseSnapshot) -> int:
+        """Embed and index the snapshot's chunks that have no embedding; returns how many were added"""
+        if not snapshot.has_unembedded_chunks:
+            return 0
+        # Another worker process may have embedded these chunks already
+        self.embedding_cache.refresh()
+        missing = []
+        for chunk_id, chunk in list(snapshot.chunks.items()):
+            if chunk.get("embedding") is not None:
+                continue
+            cached = self.embedding_cache.get(self.embedding_model, chunk["content"])
+            if cached is None:
+                missing.append(chunk_id)
+                continue
+            chunk["embedding"] = cached
+            snapshot.index.add(chunk_id, cached)
+
+        texts = list(dict.fromkeys(snapshot.chunks[chunk_id]["content"] for chunk_id in missing))
+        with time_stage("document_embedding"):
+            embeddings = dict(zip(texts, self.embedding_client.embed_many(texts, "retrieval_document")))
+        failed = 0
+        for chunk_id in missing:
+            chunk = snapshot.chunks[chunk_id]
+            embedding = embeddings.get(chunk["content"])
+            if embedding is None:
+                failed += 1
+                continue
+            self.embedding_cache.set(self.embedding_model, chunk["content"], embedding)
+            chunk["embedding"] = embedding
+            snapshot.index.add(chunk_id, embedding)
+        if failed:
+            EMBEDDING_FAILURES.labels(kind="document").inc(failed)
+            # Left unembedded; they are retried on the next call
+            logger.warning(f"{failed} knowledge base chunk(s) could not be embedded and are not searchable yet")
+
+        try:
+            self.embedding_cache.save()
+        except OSError as e:
+            logger.warning(f"Failed to persist embedding cache: {e}")
+        return len(missing) - failed
+
+    def get_relevant_chunks(self, query: str, top_k: int = 2,
+                            similarity_threshold: float = None) -> List[Dict]:
+        """Get the most relevant document chunks for a query.
+
+        Chunks passing the similarity threshold are reordered by fusing the
+        vector and BM25 rankings with reciprocal rank fusion. If none passes,
+        or the query cannot be embedded (quota exceeded, timeout), results come
+        from the local BM25 index alone, scoring at least LEXICAL_MIN_SCORE.
+        """
         # If no documents, return empty list
-        if not self.documents:
+        if not self._snapshot.chunks:
             return []
-        
+
+        query_embedding = None
         try:
-            query_embedding = self._get_embedding(query)
-            
-            # Compute embeddings for documents if not already computed
-            for doc in self.documents:
-                if doc.get("embedding") is None:
-                    try:
-                        doc["embedding"] = self._get_embedding(doc["content"])
-                    except Exception:
-                        # If embedding fails for a document, skip it
-                        continue
-            
-            # Compute similarities
-            def compute_similarity(doc_embedding):
-                if doc_embedding is None:
-                    return 0.0
-                # Simple dot product similarity
-                return sum(q * d for q, d in zip(query_embedding, doc_embedding))
-            
-            # Sort documents by similarity
-            scored_docs = [
-                (compute_similarity(doc.get("embedding")), doc)
-                for doc in self.documents
-                if doc.get("embedding") is not None
-            ]
-            scored_docs.sort(reverse=True)
-            
-            # Return top_k most relevant documents
-            return [
-                {
-                    "content": doc["content"],
-                    "source": doc["source"],
-                    "metadata": doc.get("metadata", {}),
-                    "similarity": score
-                }
-                for score, doc in scored_docs[:top_k]
-                if score > 0.7  # Only include if similarity is high enough
-            ]
+            query_embedding = self.embed_query(query)
+
+            # Compute embeddings for chunks not yet in the embedding cache
+            self._ensure_document_embeddings()
         except Exception as e:
-            # If embedding fails (e.g., quota exceeded), return empty list
-            # This allows the chatbot to work without document context
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.warning(f"Failed to get embeddings for document retrieval: {e}")
+            # The chatbot keeps answering from lexical matches while embeddings are unavailable
+            logger.warning(f"Failed to get embeddings for document retrieval, using lexical search only: {e}")
+            query_embedding = None
+        return self._rank_chunks(self._snapshot, query, query_embedding, top_k, similarity_threshold)
+
+    async def aget_relevant_chunks(self, query: str, top_k: int = 2,
+                                   similarity_threshold: float = None) -> List[Dict]:
+        """Async counterpart of get_relevant_chunks for the ASGI request path"""
+        if not self._snapshot.chunks:
             return []
+
+        query_embedding = None
+        try:
+            query_embedding = await self.aembed_query(query)
+            if self.has_unembedded_chunks:
+                # Cold store: batch-embedding the knowledge base is blocking work, keep it off the event loop
+                await asyncio.to_thread(self._ensure_document_embeddings)
+        except Exception as e:
+            logger.warning(f"Failed to get embeddings for document retrieval, using lexical search only: {e}")
+            query_embedding = None
+        return self._rank_chunks(self._snapshot, query, query_embedding, top_k, similarity_threshold)
+
+    def _rank_chunks(self, snapshot: KnowledgeBaseSnapshot, query: str, query_embedding: Optional[List[float]],
+                     top_k: int, similarity_threshold: Optional[float]) -> List[Dict]:
+        """Fuse vector and BM25 rankings; lexical only when no chunk passes the similarity threshold"""
+        with time_stage("ranking"):
+            results = self._fuse_rankings(snapshot, query, query_embedding, top_k, similarity_threshold)
+        if results:
+            KB_RETRIEVALS.labels(result="hit", retrieval=results[0]["retrieval"]).inc()
+        else:
+            KB_RETRIEVALS.labels(result="miss", retrieval="lexical" if query_embedding is None else "hybrid").inc()
+        return results
+
+    def _fuse_rankings(self, snapshot: KnowledgeBaseSnapshot, query: str, query_embedding: Optional[List[float]],
+                       top_k: int, similarity_threshold: Optional[float]) -> List[Dict]:
+        if similarity_threshold is None:
+            similarity_threshold = self.SIMILARITY_THRESHOLD
+        candidates = max(top_k, self.FUSION_CANDIDATES)
+
+        vector_hits = []
+        if query_embedding is not None:
+            vector_hits = snapshot.index.search(query_embedding, top_k=candidates, min_score=similarity_threshold)
+
+        if vector_hits:
+            # BM25 only reorders the chunks that passed the similarity threshold
+            similar = dict(vector_hits)
+            lexical_hits = [
+                (chunk_id, score)
+                for chunk_id, score in snapshot.lexical_index.search(query, top_k=len(snapshot.lexical_index))
+                if chunk_id in similar
+            ]
+            ranked = reciprocal_rank_fusion([vector_hits, lexical_hits])[:top_k]
+            retrieval = "hybrid"
+        else:
+            lexical_hits = snapshot.lexical_index.search(query, top_k=top_k, min_score=self.LEXICAL_MIN_SCORE)
+            ranked = lexical_hits
+            retrieval = "lexical"
+
+        similarities = dict(vector_hits)
+        lexical_scores = dict(lexical_hits)
+        results = []
+        for chunk_id, _ in ranked:
+            chunk = snapshot.chunks[chunk_id]
+            results.append({
+                "content": chunk["content"],
+                "source": chunk["source"],
+                "metadata": chunk["metadata"],
+                "similarity": similarities.get(chunk_id),
+                "lexical_score": lexical_scores.get(chunk_id),
+                "retrieval": retrieval,
+                "chunk_index": chunk["index"],
+                "start": chunk["start"],
+                "end": chunk["end"],
+            })
+        return results
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Tuple[Hashable, float]]],
+                           k: int = 60) -> List[Tuple[Hashable, float]]:
+    """Merge ranked (id, score) lists by summing 1 / (k + rank) for every list an id appears in"""
+    fused: Dict[Hashable, float] = {}
+    for ranking in rankings:
+        for rank, (item_id, _) in enumerate(ranking, 1):
+            fused[item_id] = fused.get(item_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+_document_store = None
+_document_store_lock = threading.Lock()
+
+
+def get_document_store() -> DocumentStore:
+    """Process-wide DocumentStore, created on first use and shared by every request"""
+    global _document_store
+    if _document_store is None:
+        with _document_store_lock:
+            if _document_store is None:
+                _document_store = DocumentStore()
+                # Picks up knowledge base changes without a restart (KB_RELOAD_INTERVAL)
+                _document_store.start_watching()
+    return _document_store
@@ -0,0 +1,338 @@
+from typing import Dict, List, Optional
+from pathlib import Path
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+import numpy as np
+from bson import Binary
+from pymongo.errors import BulkWriteError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+
+def embedding_key(model: str, content: str) -> str:
+    """Stable cache key for an embedding of `content` produced by `model`"""
+    digest = hashlib.sha256()
+    digest.update(model.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(content.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _file_signature(path: Path) -> Optional[tuple]:
+    """(mtime in ns, size) of a cache file, to tell whether another process has saved it since"""
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class EmbeddingCache:
+    """Disk-backed map of content hash -> embedding vector.
+
+    Entries are keyed by a hash of the embedding model name and the exact text
+    that was embedded, so a document only has to be embedded once for as long as
+    neither its content nor the model changes. Every worker process has its
+    own copy: refresh() and save() merge in what the others saved since.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._entries: Dict[str, List[float]] = {}
+        self._loaded = None
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        self._loaded = _file_signature(self.path)
+        self._entries = self._read()
+
+    def _read(self) -> Dict[str, List[float]]:
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable embedding cache {self.path}: {e}")
+            return {}
+
+    def _merge_saved(self) -> None:
+        """Add the entries saved by other processes since the file was last read (with the lock held)"""
+        signature = _file_signature(self.path)
+        if signature is None or signature == self._loaded:
+            return
+        self._loaded = signature
+        entries = self._read()
+        entries.update(self._entries)
+        self._entries = entries
+
+    def refresh(self) -> None:
+        """Pick up embeddings other processes saved, before computing them again"""
+        with self._lock:
+            self._merge_saved()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, model: str, content: str) -> Optional[List[float]]:
+        return self._entries.get(embedding_key(model, content))
+
+    def set(self, model: str, content: str, embedding: List[float]) -> None:
+        with self._lock:
+            self._entries[embedding_key(model, content)] = list(embedding)
+            self._dirty = True
+
+    def save(self) -> None:
+        """Persist new entries; written to a temp file first so readers never see a partial cache.
+
+        Entries other processes saved meanwhile are merged in first instead of
+        being overwritten.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            self._merge_saved()
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.path)
+            self._loaded = _file_signature(self.path)
+            self._dirty = False
+
+
+class PackedEmbeddingCache:
+    """Embedding cache stored as one float32 matrix that is memory-mapped, not parsed.
+
+    File layout: an 8-byte magic, a little-endian uint32 header length, a
+    JSON header ({"version", "model", "dim", "count", "header_length",
+    "data_offset"}), the
+    32-byte key digest of every row, then the rows themselves starting at a
+    page-aligned offset. get() returns a read-only view of a mapped row, so
+    startup reads only the keys and every worker process shares the
+    embedding pages through the OS page cache. New embeddings are held in
+    memory until save() rewrites the file (atomically, so processes that
+    still map the old file keep working) together with the rows other
+    processes saved meanwhile. The file holds one model; rows of any other
+    model are ignored.
+    """
+
+    MAGIC = b"DGBKEMB\0"
+    FORMAT_VERSION = 1
+    ALIGNMENT = 4096
+
+    def __init__(self, path: Path, model: str):
+        self.path = Path(path)
+        self.model = model
+        self.dim: Optional[int] = None
+        self._rows: Dict[str, int] = {}
+        self._matrix: Optional[np.ndarray] = None
+        self._pending: Dict[str, np.ndarray] = {}
+        self._loaded = None
+        self._lock = threading.Lock()
+        self._load()
+
+    @classmethod
+    def read_header(cls, path: Path) -> Dict:
+        with open(path, 'rb') as f:
+            if f.read(len(cls.MAGIC)) != cls.MAGIC:
+                raise ValueError("not a packed embedding file")
+            (length,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(length).decode("utf-8"))
+        if header.get("version") != cls.FORMAT_VERSION:
+            raise ValueError(f"unsupported packed embedding version: {header.get('version')}")
+        return header
+
+    def _load(self) -> None:
+        self._loaded = _file_signature(self.path)
+        if self._loaded is None:
+            return
+        try:
+            header = self.read_header(self.path)
+            if header["model"] != self.model:
+                logger.warning(f"Ignoring packed embeddings of model {header['model']}, using {self.model}")
+                return
+            count, dim = header["count"], header["dim"]
+            with open(self.path, 'rb') as f:
+                f.seek(len(self.MAGIC) + 4 + header["header_length"])
+                digests = f.read(count * 32)
+            matrix = None
+            if count:
+                matrix = np.memmap(self.path, dtype="<f4", mode="r", offset=header["data_offset"], shape=(count, dim))
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable packed embeddings {self.path}: {e}")
+            return
+        self.dim = dim
+        # Rows keep their positions across saves, so readers never see a key pointing at the wrong row
+        self._matrix = matrix
+        self._rows = {digests[row * 32:(row + 1) * 32].hex(): row for row in range(count)}
+
+    def _map_saved(self) -> None:
+        """Map the file again if another process has saved it (with the lock held)"""
+        if _file_signature(self.path) == self._loaded:
+            return
+        self._load()
+        # Rows that process saved as well are read from the file from now on
+        self._pending = {key: vector for key, vector in self._pending.items() if key not in self._rows}
+
+    def refresh(self) -> None:
+        """Pick up embeddings other processes saved, before computing them again"""
+        with self._lock:
+            self._map_saved()
+
+    def __len__(self) -> int:
+        return len(self._rows) + len(self._pending)
+
+    def get(self, model: str, content: str) -> Optional[np.ndarray]:
+        if model != self.model:
+            return None
+        key = embedding_key(model, content)
+        row = self._rows.get(key)
+        if row is not None:
+            return self._matrix[row]
+        return self._pending.get(key)
+
+    def set(self, model: str, content: str, embedding: List[float]) -> None:
+        if model != self.model:
+            return
+        vector = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            if self.dim is None:
+                self.dim = vector.shape[0]
+            if vector.shape != (self.dim,):
+                raise ValueError(f"Expected embedding of dimension {self.dim}, got {vector.shape}")
+            key = embedding_key(model, content)
+            if key not in self._rows:
+                self._pending[key] = vector
+
+    def save(self) -> None:
+        """Write existing and new rows to a new file and map that instead"""
+        with self._lock:
+            if not self._pending:
+                return
+            self._map_saved()
+            if not self._pending:
+                return
+            keys = list(self._rows) + list(self._pending)
+            self.write(self.path, self.model, self.dim, keys, self._iter_rows())
+            self._load()
+            self._pending = {}
+
+    def _iter_rows(self):
+        if self._matrix is not None:
+            yield from self._matrix
+        yield from self._pending.values()
+
+    @classmethod
+    def write(cls, path: Path, model: str, dim: int, keys: List[str], rows) -> None:
+        """Write `rows` (an iterable of `dim`-sized vectors, one per key) as a packed embedding file"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        header = {"version": cls.FORMAT_VERSION, "model": model, "dim": dim, "count": len(keys)}
+        # The header records where the rows start, which depends on the header's own length
+        header_length = len(json.dumps(dict(header, header_length=0, data_offset=0)).encode("utf-8")) + 32
+        keys_end = len(cls.MAGIC) + 4 + header_length + 32 * len(keys)
+        header["header_length"] = header_length
+        header["data_offset"] = -(-keys_end // cls.ALIGNMENT) * cls.ALIGNMENT
+        encoded = json.dumps(header).encode("utf-8")
+        if len(encoded) > header_length:
+            raise ValueError("packed embedding header does not fit its reserved space")
+        encoded = encoded.ljust(header_length)
+
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(cls.MAGIC + struct.pack("<I", header_length) + encoded)
+            f.write(b"".join(bytes.fromhex(key) for key in keys))
+            f.write(b"\0" * (header["data_offset"] - keys_end))
+            written = 0
+            for row in rows:
+                f.write(np.asarray(row, dtype="<f4").tobytes())
+                written += 1
+        if written != len(keys):
+            os.remove(tmp_path)
+            raise ValueError(f"Expected {len(keys)} embeddings, got {written}")
+        os.replace(tmp_path, path)
+
+
+class MongoEmbeddingCache:
+    """Embedding cache in a MongoDB collection shared by every backend replica.
+
+    Each entry is {_id: embedding key, model, dim, vector: float32 bytes}. All
+    embeddings of `model` are loaded once when the cache is created; keys
+    missing from memory are looked up by _id, so embeddings another replica
+    stored later are found instead of computed again. New embeddings are
+    held in memory until save() upserts them.
+    """
+
+    def __init__(self, collection, model: str):
+        self.collection = collection
+        self.model = model
+        self._entries: Dict[str, np.ndarray] = {}
+        self._pending: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+        for entry in collection.find({"model": model}, {"vector": 1}):
+            self._entries[entry["_id"]] = self._decode(entry["vector"])
+
+    @staticmethod
+    def _decode(vector: bytes) -> np.ndarray:
+        return np.frombuffer(vector, dtype="<f4")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, model: str, content: str) -> Optional[np.ndarray]:
+        if model != self.model:
+            return None
+        key = embedding_key(model, content)
+        embedding = self._entries.get(key)
+        if embedding is None:
+            try:
+                entry = self.collection.find_one({"_id": key}, {"vector": 1})
+            except PyMongoError as e:
+                logger.warning(f"Embedding cache lookup failed: {e}")
+                return None
+            if entry is not None:
+                embedding = self._entries[key] = self._decode(entry["vector"])
+        return embedding
+
+    def refresh(self) -> None:
+        """Nothing to do: keys missing from memory are already looked up in the collection"""
+
+    def set(self, model: str, content: str, embedding: List[float]) -> None:
+        if model != self.model:
+            return
+        vector = np.asarray(embedding, dtype="<f4")
+        key = embedding_key(model, content)
+        with self._lock:
+            self._entries[key] = vector
+            self._pending[key] = vector
+
+    def save(self) -> None:
+        """Insert new entries; kept for the next save if MongoDB is unavailable"""
+        with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+        entries = [
+            {"_id": key, "model": self.model, "dim": len(vector), "vector": Binary(vector.tobytes())}
+            for key, vector in pending.items()
+        ]
+        try:
+            try:
+                self.collection.insert_many(entries, ordered=False)
+            except BulkWriteError as e:
+                # Another replica stored the same embedding first; every other error is a real failure
+                details = e.details or {}
+                if details.get("writeConcernErrors") or any(
+                        error.get("code") != 11000 for error in details.get("writeErrors", [])):
+                    raise
+        except PyMongoError as e:
+            with self._lock:
+                self._pending = dict(pending, **self._pending)
+            logger.warning(f"Failed to persist {len(pending)} embedding(s) to MongoDB: {e}")
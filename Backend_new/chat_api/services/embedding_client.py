@@ -0,0 +1,348 @@
+from typing import Callable, List, Optional, Sequence
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from .resilience import GEMINI_EMBED_TIMEOUT, get_breaker
+from .single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = "models/embedding-001"
+
+# Gemini error types worth retrying: quota (429), transient server errors (5xx) and timeouts
+RETRYABLE_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.DeadlineExceeded,
+)
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Identical batches in flight at the same time (a burst of one popular query, a knowledge base being
+# embedded by two stores) share one API call
+_embedding_flights = SingleFlight("embedding")
+
+
+class EmbeddingError(Exception):
+    """Raised when texts could not be embedded, after retries where applicable"""
+
+
+class RetryableEmbeddingError(EmbeddingError):
+    """Transient backend failure (rate limited or unavailable); the request may be retried"""
+
+    def __init__(self, message: str, code: int = 503):
+        super().__init__(message)
+        self.code = code
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    return getattr(error, "code", None) in RETRYABLE_STATUS_CODES
+
+
+class GeminiEmbeddingBackend:
+    """Embeds texts with Gemini's batch embedding endpoint.
+
+    Calls carry a deadline and go through the "gemini_embed" circuit breaker,
+    so while the API is down they fail at once (CircuitOpenError is not
+    retried) and retrieval falls back to lexical search.
+    """
+
+    name = "gemini"
+    max_batch_size = 100  # batchEmbedContents accepts at most 100 requests
+
+    def __init__(self, timeout: float = GEMINI_EMBED_TIMEOUT):
+        self.timeout = timeout
+        self.breaker = get_breaker("gemini_embed")
+
+    def embed_batch(self, model: str, texts: Sequence[str], task_type: str) -> List[List[float]]:
+        result = self.breaker.call(
+            genai.embed_content, model=model, content=list(texts), task_type=task_type,
+            request_options={"timeout": self.timeout},
+        )
+        return result['embedding']
+
+    async def aembed_batch(self, model: str, texts: Sequence[str], task_type: str) -> List[List[float]]:
+        result = await self.breaker.acall(
+            genai.embed_content_async, model=model, content=list(texts), task_type=task_type,
+            request_options={"timeout": self.timeout},
+        )
+        return result['embedding']
+
+
+class FakeEmbeddingBackend:
+    """Deterministic offline backend for tests, benchmarks and local development.
+
+    Texts are embedded as feature-hashed bags of words, so texts that share
+    words get similar vectors. `latency` (seconds per call) and `failure_rate`
+    (probability of a retryable 429) simulate a real API.
+    """
+
+    name = "fake"
+    max_batch_size = 100
+    _TOKEN_RE = re.compile(r"\w+")
+
+    def __init__(self, dim: int = 768, latency: float = 0.0, failure_rate: float = 0.0, seed: int = 0):
+        self.dim = dim
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self.texts_embedded = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def embed_text(self, text: str) -> List[float]:
+        vector = [0.0] * self.dim
+        for token in self._TOKEN_RE.findall(text.lower()):
+            digest = hashlib.md5(token.encode("utf-8")).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        return vector
+
+    def _start_call(self) -> bool:
+        """Count a call; returns True if it should fail"""
+        with self._lock:
+            self.calls += 1
+            return self._random.random() < self.failure_rate
+
+    def _finish_call(self, texts: Sequence[str], fail: bool) -> List[List[float]]:
+        if fail:
+            raise RetryableEmbeddingError("429 Resource has been exhausted (simulated)", code=429)
+        with self._lock:
+            self.texts_embedded += len(texts)
+        return [self.embed_text(text) for text in texts]
+
+    def embed_batch(self, model: str, texts: Sequence[str], task_type: str) -> List[List[float]]:
+        fail = self._start_call()
+        if self.latency:
+            time.sleep(self.latency)
+        return self._finish_call(texts, fail)
+
+    async def aembed_batch(self, model: str, texts: Sequence[str], task_type: str) -> List[List[float]]:
+        fail = self._start_call()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._finish_call(texts, fail)
+
+
+class RateLimiter:
+    """Token bucket allowing `requests_per_minute` calls, shared by all threads"""
+
+    def __init__(self, requests_per_minute: float, burst: int = None,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self.rate = requests_per_minute / 60.0
+        self.capacity = burst or max(1, int(requests_per_minute // 60) or 1)
+        self._tokens = float(self.capacity)
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _try_acquire(self) -> float:
+        """Take a token if one is available; otherwise return how long to wait for one"""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self) -> None:
+        wait = self._try_acquire()
+        while wait:
+            self._sleep(wait)
+            wait = self._try_acquire()
+
+    async def aacquire(self) -> None:
+        wait = self._try_acquire()
+        while wait:
+            await asyncio.sleep(wait)
+            wait = self._try_acquire()
+
+
+def embedding_cache_model(backend_name: str, model: str = EMBEDDING_MODEL) -> str:
+    """Model name cached embeddings are keyed by.
+
+    Only Gemini's vectors are the model's own; other backends (the offline
+    fake) are cached under their own name, so their vectors are never served
+    once Gemini is used again.
+    """
+    return model if backend_name == GeminiEmbeddingBackend.name else f"{backend_name}:{model}"
+
+
+class EmbeddingClient:
+    """Batches texts per API call, bounds concurrency and retries transient failures.
+
+    Texts are split into batches of at most `batch_size`, which run on a thread
+    pool of `max_workers`. Each API call first takes a token from the
+    requests-per-minute limiter and is retried with exponential backoff and
+    jitter when the backend reports a 429/5xx.
+    """
+
+    def __init__(self, backend=None, model: str = EMBEDDING_MODEL, batch_size: int = None,
+                 max_workers: int = None, requests_per_minute: float = None, max_retries: int = None,
+                 backoff_base: float = None, backoff_max: float = None,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.backend = backend or GeminiEmbeddingBackend()
+        self.model = model
+        self.batch_size = min(
+            batch_size or int(os.getenv("EMBEDDING_BATCH_SIZE", 100)), self.backend.max_batch_size
+        )
+        self.max_workers = max_workers or int(os.getenv("EMBEDDING_MAX_WORKERS", 4))
+        requests_per_minute = requests_per_minute or float(os.getenv("EMBEDDING_REQUESTS_PER_MINUTE", 1500))
+        self.rate_limiter = RateLimiter(requests_per_minute, sleep=sleep)
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("EMBEDDING_MAX_RETRIES", 5))
+        # Query embedding sits on the request path, so it gives up sooner and lets retrieval fall back
+        self.query_max_retries = int(os.getenv("EMBEDDING_QUERY_MAX_RETRIES", 1))
+        self.backoff_base = backoff_base if backoff_base is not None else float(os.getenv("EMBEDDING_BACKOFF_BASE", 0.5))
+        self.backoff_max = backoff_max if backoff_max is not None else float(os.getenv("EMBEDDING_BACKOFF_MAX", 30))
+        self._sleep = sleep
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def cache_model(self) -> str:
+        return embedding_cache_model(self.backend.name, self.model)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix="embedding"
+                    )
+        return self._executor
+
+    def _embed_batch(self, texts: Sequence[str], task_type: str, max_retries: int = None) -> List[List[float]]:
+        key = SingleFlight.key(self.backend.name, self.model, task_type, list(texts))
+        return _embedding_flights.do(key, self._embed_batch_with_retries, texts, task_type, max_retries)
+
+    async def _aembed_batch(self, texts: Sequence[str], task_type: str, max_retries: int = None) -> List[List[float]]:
+        """Async counterpart of _embed_batch for the ASGI request path"""
+        key = SingleFlight.key(self.backend.name, self.model, task_type, list(texts))
+        return await _embedding_flights.ado(key, self._aembed_batch_with_retries, texts, task_type, max_retries)
+
+    def _embed_batch_with_retries(self, texts: Sequence[str], task_type: str,
+                                  max_retries: int = None) -> List[List[float]]:
+        max_retries = self.max_retries if max_retries is None else max_retries
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                embeddings = self.backend.embed_batch(self.model, texts, task_type)
+            except Exception as e:
+                if not is_retryable(e) or attempt >= max_retries:
+                    raise EmbeddingError(f"Embedding {len(texts)} text(s) failed: {e}") from e
+                delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+                delay *= random.uniform(0.5, 1.0)
+                attempt += 1
+                logger.info(f"Embedding backend error ({e}); retry {attempt}/{max_retries} in {delay:.2f}s")
+                self._sleep(delay)
+                continue
+            if len(embeddings) != len(texts):
+                raise EmbeddingError(f"Expected {len(texts)} embeddings, got {len(embeddings)}")
+            return embeddings
+
+    async def _aembed_batch_with_retries(self, texts: Sequence[str], task_type: str,
+                                         max_retries: int = None) -> List[List[float]]:
+        max_retries = self.max_retries if max_retries is None else max_retries
+        attempt = 0
+        while True:
+            await self.rate_limiter.aacquire()
+            try:
+                embeddings = await self.backend.aembed_batch(self.model, texts, task_type)
+            except Exception as e:
+                if not is_retryable(e) or attempt >= max_retries:
+                    raise EmbeddingError(f"Embedding {len(texts)} text(s) failed: {e}") from e
+                delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+                delay *= random.uniform(0.5, 1.0)
+                attempt += 1
+                logger.info(f"Embedding backend error ({e}); retry {attempt}/{max_retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            if len(embeddings) != len(texts):
+                raise EmbeddingError(f"Expected {len(texts)} embeddings, got {len(embeddings)}")
+            return embeddings
+
+    def embed_many(self, texts: Sequence[str], task_type: str = "retrieval_document") -> List[Optional[List[float]]]:
+        """Embed texts in concurrent batches; texts whose batch failed come back as None"""
+        texts = list(texts)
+        batches = [
+            (start, texts[start:start + self.batch_size])
+            for start in range(0, len(texts), self.batch_size)
+        ]
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        if not batches:
+            return results
+
+        if len(batches) == 1:
+            outcomes = [self._try_embed_batch(batches[0][1], task_type)]
+        else:
+            executor = self._get_executor()
+            futures = [executor.submit(self._try_embed_batch, batch, task_type) for _, batch in batches]
+            outcomes = [future.result() for future in futures]
+
+        for (start, batch), embeddings in zip(batches, outcomes):
+            if embeddings is not None:
+                results[start:start + len(batch)] = embeddings
+        return results
+
+    def _try_embed_batch(self, texts: Sequence[str], task_type: str) -> Optional[List[List[float]]]:
+        try:
+            return self._embed_batch(texts, task_type)
+        except EmbeddingError as e:
+            logger.warning(str(e))
+            return None
+
+    def embed(self, texts: Sequence[str], task_type: str = "retrieval_document") -> List[List[float]]:
+        """Embed texts, raising EmbeddingError if any batch fails"""
+        embeddings = self.embed_many(texts, task_type)
+        failed = sum(1 for embedding in embeddings if embedding is None)
+        if failed:
+            raise EmbeddingError(f"{failed} of {len(embeddings)} text(s) could not be embedded")
+        return embeddings
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_batch([text], "retrieval_query", max_retries=self.query_max_retries)[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        embeddings = await self._aembed_batch([text], "retrieval_query", max_retries=self.query_max_retries)
+        return embeddings[0]
+
+
+def create_embedding_backend(name: str = None):
+    name = (name or os.getenv("EMBEDDING_BACKEND", "gemini")).lower()
+    if name == "fake":
+        return FakeEmbeddingBackend()
+    if name == "gemini":
+        return GeminiEmbeddingBackend()
+    raise ValueError(f"Unknown EMBEDDING_BACKEND: {name}")
+
+
+_embedding_client = None
+_embedding_client_lock = threading.Lock()
+
+
+def get_embedding_client() -> EmbeddingClient:
+    """Process-wide EmbeddingClient, so every caller shares one rate limit and thread pool"""
+    global _embedding_client
+    if _embedding_client is None:
+        with _embedding_client_lock:
+            if _embedding_client is None:
+                _embedding_client = EmbeddingClient(backend=create_embedding_backend())
+    return _embedding_client
@@ -0,0 +1,176 @@
+from typing import Hashable, List, Optional, Sequence, Tuple
+from pathlib import Path
+import json
+import logging
+import os
+import numpy as np
+from .vector_index import VectorIndex
+
+logger = logging.getLogger(__name__)
+
+
+def _kmeans(vectors: np.ndarray, n_clusters: int, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    """Spherical k-means (cosine) over L2-normalized rows; returns normalized centroids"""
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        # Re-seed empty clusters from random points so every list stays in use
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+
+class IVFIndex(VectorIndex):
+    """Approximate cosine index: inverted file over k-means centroids.
+
+    Vectors are assigned to their nearest of `n_lists` centroids and a query
+    only scores the vectors in its `n_probe` nearest lists. Raising `n_probe`
+    trades latency for recall (`n_probe == n_lists` is exact). Until
+    `min_train_size` vectors exist the index searches exhaustively; it trains
+    then, and retrains once it has grown by `retrain_factor`. New vectors are
+    assigned to the existing centroids, so inserts stay incremental.
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, dim: Optional[int] = None, n_lists: Optional[int] = None, n_probe: int = 8,
+                 min_train_size: int = 2048, retrain_factor: float = 4.0, kmeans_iterations: int = 10,
+                 max_training_points: int = 50000, initial_capacity: int = 64, seed: int = 0):
+        self._assignments = np.empty(0, dtype=np.int32)
+        super().__init__(dim=dim, initial_capacity=initial_capacity)
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.min_train_size = min_train_size
+        self.retrain_factor = retrain_factor
+        self.kmeans_iterations = kmeans_iterations
+        self.max_training_points = max_training_points
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self._trained_size = 0
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    @property
+    def nbytes(self) -> int:
+        centroid_bytes = self.centroids.nbytes if self.is_trained else 0
+        return super().nbytes + self._assignments.nbytes + centroid_bytes
+
+    def copy(self) -> "IVFIndex":
+        clone = super().copy()
+        # Centroids are replaced, never modified, when the index retrains, so the copy can share them
+        clone._assignments = self._assignments.copy()
+        return clone
+
+    def _on_resize(self, capacity: int) -> None:
+        grown = np.full(capacity, -1, dtype=np.int32)
+        grown[:len(self._assignments)] = self._assignments
+        self._assignments = grown
+
+    def _on_row_set(self, row: int) -> None:
+        if self.is_trained:
+            self._assignments[row] = int(np.argmax(self.centroids @ self._matrix[row]))
+        if len(self) >= self._next_train_size():
+            self.train()
+
+    def _on_row_moved(self, source_row: int, target_row: int) -> None:
+        self._assignments[target_row] = self._assignments[source_row]
+
+    def _next_train_size(self) -> float:
+        if not self.is_trained:
+            return self.min_train_size
+        return self._trained_size * self.retrain_factor
+
+    def train(self) -> None:
+        """(Re)compute centroids from the current vectors and reassign every row"""
+        size = len(self)
+        if size == 0:
+            return
+        n_lists = self.n_lists or max(1, int(np.sqrt(size)))
+        n_lists = min(n_lists, size)
+        rng = np.random.default_rng(self.seed)
+        vectors = self.vectors
+        if size > self.max_training_points:
+            vectors = vectors[rng.choice(size, self.max_training_points, replace=False)]
+        self.centroids = _kmeans(vectors, n_lists, self.kmeans_iterations, rng)
+        self._assignments[:size] = np.argmax(self.vectors @ self.centroids.T, axis=1)
+        self._trained_size = size
+        logger.info(f"Trained IVF index: {size} vectors in {n_lists} lists")
+
+    def search(self, query: Sequence[float], top_k: int = 2, min_score: Optional[float] = None,
+               n_probe: Optional[int] = None) -> List[Tuple[Hashable, float]]:
+        """Return up to `top_k` (id, cosine similarity) pairs from the `n_probe` nearest lists"""
+        size = len(self)
+        if not self.is_trained or size == 0 or top_k <= 0:
+            return super().search(query, top_k=top_k, min_score=min_score)
+
+        query_vector = self._normalize(query)
+        n_probe = min(n_probe or self.n_probe, len(self.centroids))
+        centroid_scores = self.centroids @ query_vector
+        probed = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe]
+        rows = np.flatnonzero(np.isin(self._assignments[:size], probed))
+        if len(rows) == 0:
+            return []
+        scores = self._matrix[rows] @ query_vector
+        return self._top_k(rows, scores, top_k, min_score)
+
+    def save(self, path: Path) -> None:
+        """Write vectors, ids, centroids and list assignments to a single .npz file"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        size = len(self)
+        params = {
+            "version": self.FORMAT_VERSION,
+            "n_lists": self.n_lists,
+            "n_probe": self.n_probe,
+            "min_train_size": self.min_train_size,
+            "retrain_factor": self.retrain_factor,
+            "trained_size": self._trained_size,
+        }
+        arrays = {
+            "vectors": self.vectors,
+            "assignments": self._assignments[:size],
+            "ids": np.array(json.dumps([list(i) if isinstance(i, tuple) else i for i in self._ids])),
+            "params": np.array(json.dumps(params)),
+        }
+        if self.is_trained:
+            arrays["centroids"] = self.centroids
+        tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npz")
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path, **overrides) -> "IVFIndex":
+        """Load an index written by save(); keyword overrides replace saved tuning parameters"""
+        with np.load(Path(path)) as data:
+            params = json.loads(str(data["params"]))
+            if params.get("version") != cls.FORMAT_VERSION:
+                raise ValueError(f"Unsupported IVF index version: {params.get('version')}")
+            ids = [tuple(i) if isinstance(i, list) else i for i in json.loads(str(data["ids"]))]
+            vectors = data["vectors"]
+            index = cls(
+                dim=vectors.shape[1] if len(vectors) else None,
+                n_lists=overrides.get("n_lists", params["n_lists"]),
+                n_probe=overrides.get("n_probe", params["n_probe"]),
+                min_train_size=overrides.get("min_train_size", params["min_train_size"]),
+                retrain_factor=overrides.get("retrain_factor", params["retrain_factor"]),
+                initial_capacity=max(1, len(ids)),
+            )
+            if ids:
+                index._reserve(len(ids))
+                index._matrix[:len(ids)] = vectors
+                index._assignments[:len(ids)] = data["assignments"]
+                index._ids = ids
+                index._rows = {item_id: row for row, item_id in enumerate(ids)}
+            if "centroids" in data:
+                index.centroids = data["centroids"]
+                index._trained_size = params["trained_size"]
+        return index
@@ -0,0 +1,236 @@
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime, timezone
+from pathlib import Path
+import json
+import os
+from .embedding_cache import EmbeddingCache, MongoEmbeddingCache, PackedEmbeddingCache
+
+EMBEDDING_CACHE_FILE = Path(".cache") / "embeddings.json"
+PACKED_DIR = Path("packed")
+PACKED_DOCUMENTS_FILE = PACKED_DIR / "documents.jsonl"
+PACKED_EMBEDDINGS_FILE = PACKED_DIR / "embeddings.f32"
+KB_DOCUMENTS_COLLECTION = "kb_documents"
+KB_EMBEDDINGS_COLLECTION = "kb_embeddings"
+KB_META_COLLECTION = "kb_meta"
+
+# Only these keys are stored; chunks are derived from the content and embeddings live in the embedding cache
+DOCUMENT_KEYS = ("content", "source", "metadata")
+
+
+def file_signature(path: Path) -> Tuple[int, int]:
+    stat = path.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _replace_atomically(path: Path, write) -> None:
+    """Write through a temp file so a reload never reads a half-written file"""
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+class FileLayout:
+    """One pretty-printed JSON file per document, named after the source's stem"""
+
+    name = "files"
+
+    def __init__(self, docs_dir: Path):
+        self.docs_dir = Path(docs_dir)
+
+    def scan(self) -> Dict[str, Tuple[int, int]]:
+        """File name -> (mtime in ns, size) of every document file"""
+        files = {}
+        for file in self.docs_dir.glob("*.json"):
+            try:
+                files[file.name] = file_signature(file)
+            except OSError:
+                continue  # Removed while scanning
+        return files
+
+    def read(self, name: str) -> List[Dict]:
+        with open(self.docs_dir / name, 'r', encoding='utf-8') as f:
+            doc = json.load(f)
+        doc["file"] = name
+        return [doc]
+
+    def read_all(self, names: List[str]) -> List[Dict]:
+        return [doc for name in names for doc in self.read(name)]
+
+    def save(self, docs: List[Dict], documents: List[Dict]) -> Dict[str, Tuple[int, int]]:
+        """Write `docs` (new or replaced) and return the signatures of the files written"""
+        files = {}
+        for doc in docs:
+            path = self.docs_dir / f"{Path(doc['source']).stem}.json"
+            _replace_atomically(path, lambda f: json.dump(
+                {key: doc[key] for key in DOCUMENT_KEYS if key in doc}, f, ensure_ascii=False, indent=2
+            ))
+            doc["file"] = path.name
+            files[path.name] = file_signature(path)
+        return files
+
+    def create_embedding_cache(self, model: str) -> EmbeddingCache:
+        return EmbeddingCache(self.docs_dir / EMBEDDING_CACHE_FILE)
+
+
+class PackedLayout:
+    """All documents in one JSONL file and their embeddings in one memory-mapped float32 file.
+
+    Startup opens two files instead of one per document, and embeddings are
+    mapped rather than parsed from JSON (see PackedEmbeddingCache). Saving
+    rewrites the JSONL file with every document, so the packed layout suits
+    knowledge bases that are updated in batches.
+    """
+
+    name = "packed"
+
+    def __init__(self, docs_dir: Path):
+        self.docs_dir = Path(docs_dir)
+        self.path = self.docs_dir / PACKED_DOCUMENTS_FILE
+
+    def scan(self) -> Dict[str, Tuple[int, int]]:
+        try:
+            return {self.path.name: file_signature(self.path)}
+        except OSError:
+            return {}
+
+    def read(self, name: str) -> List[Dict]:
+        docs = []
+        with open(self.docs_dir / PACKED_DIR / name, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    doc = json.loads(line)
+                    doc["file"] = name
+                    docs.append(doc)
+        return docs
+
+    def read_all(self, names: List[str]) -> List[Dict]:
+        return [doc for name in names for doc in self.read(name)]
+
+    def save(self, docs: List[Dict], documents: List[Dict]) -> Dict[str, Tuple[int, int]]:
+        """Rewrite the JSONL file with all of `documents`, which include `docs`"""
+        self.write_documents(self.docs_dir, documents)
+        for doc in docs:
+            doc["file"] = self.path.name
+        return {self.path.name: file_signature(self.path)}
+
+    @staticmethod
+    def write_documents(docs_dir: Path, documents: List[Dict]) -> None:
+        path = Path(docs_dir) / PACKED_DOCUMENTS_FILE
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        def write(f):
+            for doc in documents:
+                f.write(json.dumps({key: doc[key] for key in DOCUMENT_KEYS if key in doc}, ensure_ascii=False))
+                f.write("\n")
+        _replace_atomically(path, write)
+
+    def create_embedding_cache(self, model: str) -> PackedEmbeddingCache:
+        return PackedEmbeddingCache(self.docs_dir / PACKED_EMBEDDINGS_FILE, model)
+
+
+class MongoLayout:
+    """Documents and embeddings in MongoDB, shared by every backend replica.
+
+    Documents are {_id: source, content, metadata, revision, size}; saving
+    one increments its revision and then the knowledge base version in
+    kb_meta. scan() only reads that version document and lists the
+    documents when it has changed, so replicas can poll it cheaply (change
+    streams would need a replica set). A document changed outside
+    DocumentStore is picked up once the version is incremented as well.
+    """
+
+    name = "mongo"
+    META_ID = "knowledge_base"
+
+    def __init__(self, db=None):
+        self._db = db
+        self._version: Optional[int] = None
+        self._files: Dict[str, Tuple[int, int]] = {}
+
+    @property
+    def db(self):
+        if self._db is None:
+            from .mongo_client import mongo_db
+            self._db = mongo_db()
+        return self._db
+
+    def scan(self) -> Dict[str, Tuple[int, int]]:
+        """Source -> (revision, size) of every document"""
+        meta = self.db[KB_META_COLLECTION].find_one({"_id": self.META_ID})
+        version = meta["version"] if meta else 0
+        if version != self._version:
+            # Listed after reading the version, so the listing is at least as new as the version
+            self._files = {
+                doc["_id"]: (doc["revision"], doc["size"])
+                for doc in self.db[KB_DOCUMENTS_COLLECTION].find({}, {"revision": 1, "size": 1})
+            }
+            self._version = version
+        return dict(self._files)
+
+    @staticmethod
+    def _to_document(entry: Dict) -> Dict:
+        return {"content": entry["content"], "source": entry["_id"], "metadata": entry.get("metadata") or {},
+                "file": entry["_id"]}
+
+    def read(self, name: str) -> List[Dict]:
+        entry = self.db[KB_DOCUMENTS_COLLECTION].find_one({"_id": name})
+        return [self._to_document(entry)] if entry is not None else []
+
+    def read_all(self, names: List[str]) -> List[Dict]:
+        entries = self.db[KB_DOCUMENTS_COLLECTION].find({"_id": {"$in": list(names)}})
+        return [self._to_document(entry) for entry in entries]
+
+    def save(self, docs: List[Dict], documents: List[Dict]) -> Dict[str, Tuple[int, int]]:
+        """Upsert `docs`, then publish them to other replicas by incrementing the version"""
+        if not docs:
+            return {}
+        now = datetime.now(timezone.utc)
+        collection = self.db[KB_DOCUMENTS_COLLECTION]
+        for doc in docs:
+            collection.update_one(
+                {"_id": doc["source"]},
+                {
+                    "$set": {"content": doc["content"], "metadata": doc.get("metadata") or {},
+                             "size": len(doc["content"]), "updated_at": now},
+                    "$inc": {"revision": 1},
+                },
+                upsert=True,
+            )
+        self.db[KB_META_COLLECTION].update_one({"_id": self.META_ID}, {"$inc": {"version": 1}}, upsert=True)
+        sources = [doc["source"] for doc in docs]
+        files = {
+            entry["_id"]: (entry["revision"], entry["size"])
+            for entry in collection.find({"_id": {"$in": sources}}, {"revision": 1, "size": 1})
+        }
+        for doc in docs:
+            doc["file"] = doc["source"]
+        return files
+
+    def delete_missing(self, sources: List[str]) -> List[str]:
+        """Delete the documents whose source is not in `sources` and publish that; returns their sources"""
+        collection = self.db[KB_DOCUMENTS_COLLECTION]
+        stale = [entry["_id"] for entry in collection.find({"_id": {"$nin": list(sources)}}, {"_id": 1})]
+        if stale:
+            collection.delete_many({"_id": {"$in": stale}})
+            # Replicas see the sources missing from their next scan and drop them
+            self.db[KB_META_COLLECTION].update_one({"_id": self.META_ID}, {"$inc": {"version": 1}}, upsert=True)
+        return stale
+
+    def create_embedding_cache(self, model: str) -> MongoEmbeddingCache:
+        return MongoEmbeddingCache(self.db[KB_EMBEDDINGS_COLLECTION], model)
+
+
+def create_layout(docs_dir: Path, storage: str = None):
+    """Storage layout of a knowledge base (KB_STORAGE: auto, files, packed or mongo)"""
+    storage = (storage or os.getenv("KB_STORAGE", "auto")).lower()
+    if storage == "auto":
+        # A migrated knowledge base is used as soon as pack_knowledge_base has written it
+        storage = "packed" if (Path(docs_dir) / PACKED_DOCUMENTS_FILE).exists() else "files"
+    if storage == "files":
+        return FileLayout(docs_dir)
+    if storage == "packed":
+        return PackedLayout(docs_dir)
+    if storage == "mongo":
+        return MongoLayout()
+    raise ValueError(f"Unknown KB_STORAGE layout: {storage}")
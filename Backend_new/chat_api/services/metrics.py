@@ -0,0 +1,134 @@
+from typing import Iterator
+import logging
+from prometheus_client import REGISTRY, Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+logger = logging.getLogger(__name__)
+
+# Gemini calls take seconds, so the default buckets (capped at 10s) would hide the tail
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+REQUEST_SECONDS = Histogram(
+    "digibuddy_chat_request_seconds",
+    "End-to-end latency of chat requests",
+    ["view", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+
+# Stages of one chat request: conversation_lookup, user_lookup, context_load (views),
+# crisis_detection, response_cache_lookup, retrieval, generation, first_token (ChatService),
+# query_embedding, document_embedding, ranking (DocumentStore) and chat_log_enqueue (views)
+STAGE_SECONDS = Histogram(
+    "digibuddy_chat_stage_seconds",
+    "Latency of each stage of a chat request",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+
+CHAT_LOG_BATCH_SECONDS = Histogram(
+    "digibuddy_chat_log_batch_seconds",
+    "Time to insert one batch of chat records, including retries",
+    buckets=LATENCY_BUCKETS,
+)
+
+KB_RETRIEVALS = Counter(
+    "digibuddy_kb_retrievals_total",
+    "Knowledge base lookups by whether they returned context (hit) and how they were ranked",
+    ["result", "retrieval"],
+)
+
+KB_RELOADS = Counter(
+    "digibuddy_kb_reloads_total",
+    "Knowledge base hot reloads that swapped in a new version (applied) or failed",
+    ["result"],
+)
+
+RESPONSE_CACHE_LOOKUPS = Counter(
+    "digibuddy_response_cache_lookups_total",
+    "Semantic response cache lookups",
+    ["result"],
+)
+
+EMBEDDING_FAILURES = Counter(
+    "digibuddy_embedding_failures_total",
+    "Embedding calls that failed after retries (query) or chunks left unembedded (document)",
+    ["kind"],
+)
+
+GEMINI_ERRORS = Counter(
+    "digibuddy_gemini_errors_total",
+    "Failed Gemini generations",
+    ["kind"],
+)
+
+SINGLE_FLIGHT_CALLS = Counter(
+    "digibuddy_single_flight_calls_total",
+    "Gemini calls made upstream or shared with an identical call already in flight",
+    ["name", "result"],
+)
+
+CRISIS_DETECTIONS = Counter(
+    "digibuddy_crisis_detections_total",
+    "Messages answered with the crisis response by the local detector (reply or stream)",
+    ["mode"],
+)
+
+
+def time_stage(stage: str):
+    """Context manager that records the duration of one request stage"""
+    return STAGE_SECONDS.labels(stage=stage).time()
+
+
+class ServiceStatsCollector(Collector):
+    """Exports the chat log writer, caches, MongoDB pool and circuit breaker state at scrape time.
+
+    These components already keep their own counters, so they are read when
+    Prometheus scrapes instead of being mirrored into metrics on every event.
+    The writer, the query embedding cache and the response cache are only
+    reported once a request has created them.
+    """
+
+    def describe(self) -> Iterator[GaugeMetricFamily]:
+        # Registration calls describe() (or else collect(), while the services may still be importing);
+        # the metric families are only known at scrape time
+        return iter(())
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        from . import chat_log_writer, document_store, response_cache
+        from .mongo_client import pool_stats
+        from .resilience import CLOSED, HALF_OPEN, OPEN, breaker_states
+
+        store = document_store._document_store
+        for name, documentation, component in (
+            ("digibuddy_chat_log_writer", "Chat log write-behind buffer counters", chat_log_writer._chat_log_writer),
+            ("digibuddy_query_embedding_cache", "Query embedding cache counters",
+             store.query_cache if store is not None else None),
+            ("digibuddy_response_cache", "Semantic response cache counters", response_cache._response_cache),
+        ):
+            if component is None:
+                continue
+            family = GaugeMetricFamily(name, documentation, labels=["stat"])
+            for stat, value in component.stats().items():
+                family.add_metric([stat], value)
+            yield family
+
+        family = GaugeMetricFamily("digibuddy_mongo_pool", "MongoDB connection pool counters", labels=["stat"])
+        for stat, value in pool_stats().items():
+            family.add_metric([stat], value)
+        yield family
+
+        breakers = breaker_states()
+        states = GaugeMetricFamily("digibuddy_circuit_breaker_state", "1 for the current state of each circuit breaker",
+                                   labels=["name", "state"])
+        rejected = CounterMetricFamily("digibuddy_circuit_breaker_rejected", "Calls rejected by an open circuit breaker",
+                                       labels=["name"])
+        for name, snapshot in breakers.items():
+            for state in (CLOSED, HALF_OPEN, OPEN):
+                states.add_metric([name, state], 1 if snapshot["state"] == state else 0)
+            rejected.add_metric([name], snapshot["rejected"])
+        yield states
+        yield rejected
+
+
+REGISTRY.register(ServiceStatsCollector())
@@ -1,26 +1,159 @@
-from pymongo import MongoClient
+from typing import Dict, List
+from pymongo import ASCENDING, DESCENDING, AsyncMongoClient, IndexModel, MongoClient, monitoring
 from django.conf import settings
+import asyncio
 import logging
 import os
+import threading
+import weakref
 
 logger = logging.getLogger(__name__)
 
-def get_mongo_db():
-    """Get MongoDB database connection with lazy initialization"""
+# Indexes every collection needs; created idempotently by ensure_indexes()
+INDEXES: Dict[str, List[IndexModel]] = {
+    # ChatHistoryView: filter on user_id, keyset-paginated newest first on (created_at, _id)
+    "chats": [
+        IndexModel(
+            [("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+            name="user_id_created_at_id",
+        ),
+        # Conversation memory: the latest unsummarized turns of one conversation
+        IndexModel(
+            [("conversation_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+            name="conversation_id_created_at_id",
+        ),
+        # Reviewing flagged crisis conversations, newest first; only flagged records are indexed
+        IndexModel(
+            [("created_at", DESCENDING)],
+            name="crisis_detected_created_at",
+            partialFilterExpression={"crisis_detected": True},
+        ),
+    ],
+    # Chat views and the OAuth callback look users up (and upsert them) by email
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    # KB_STORAGE=mongo: every replica loads the embeddings of its model at startup
+    "kb_embeddings": [
+        IndexModel([("model", ASCENDING)], name="model"),
+    ],
+}
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Counts connection pool events so pool pressure can be monitored"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {
+            "pools": 0,
+            "connections_open": 0,
+            "connections_in_use": 0,
+            "connections_created": 0,
+            "connections_closed": 0,
+            "checkouts": 0,
+            "checkout_failures": 0,
+            "pool_clears": 0,
+        }
+
+    def _update(self, **deltas) -> None:
+        with self._lock:
+            for key, delta in deltas.items():
+                self._stats[key] += delta
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def pool_created(self, event):
+        self._update(pools=1)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._update(pool_clears=1)
+
+    def pool_closed(self, event):
+        self._update(pools=-1)
+
+    def connection_created(self, event):
+        self._update(connections_created=1, connections_open=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._update(connections_closed=1, connections_open=-1)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._update(checkout_failures=1)
+
+    def connection_checked_out(self, event):
+        self._update(checkouts=1, connections_in_use=1)
+
+    def connection_checked_in(self, event):
+        self._update(connections_in_use=-1)
+
+
+pool_stats_listener = PoolStatsListener()
+
+
+def pool_stats() -> Dict[str, int]:
+    """Connection pool counters for every client created by this module"""
+    return pool_stats_listener.stats()
+
+
+def _mongo_settings():
     mongo_uri = os.getenv('MONGODB_URI') or getattr(settings, 'MONGODB_URI', 'mongodb://mongodb-service:27017')
     mongo_db_name = os.getenv('MONGODB_DB') or getattr(settings, 'MONGODB_DB', 'digibuddy')
-    
+    return mongo_uri, mongo_db_name
+
+def _client_options():
+    """Pool size and timeouts from Django settings, shared by the sync and async clients"""
+    return {
+        "maxPoolSize": getattr(settings, 'MONGODB_MAX_POOL_SIZE', 100),
+        "minPoolSize": getattr(settings, 'MONGODB_MIN_POOL_SIZE', 0),
+        "maxIdleTimeMS": getattr(settings, 'MONGODB_MAX_IDLE_TIME_MS', None),
+        "waitQueueTimeoutMS": getattr(settings, 'MONGODB_WAIT_QUEUE_TIMEOUT_MS', None),
+        "serverSelectionTimeoutMS": getattr(settings, 'MONGODB_SERVER_SELECTION_TIMEOUT_MS', 5000),
+        "connectTimeoutMS": getattr(settings, 'MONGODB_CONNECT_TIMEOUT_MS', 5000),
+        "socketTimeoutMS": getattr(settings, 'MONGODB_SOCKET_TIMEOUT_MS', None),
+        "event_listeners": [pool_stats_listener],
+    }
+
+def ensure_indexes(db) -> Dict[str, List[str]]:
+    """Create any missing declared indexes; a no-op for indexes that already exist"""
+    created = {}
+    for collection, indexes in INDEXES.items():
+        created[collection] = db[collection].create_indexes(indexes)
+    return created
+
+def get_mongo_db():
+    """Get MongoDB database connection with lazy initialization"""
+    mongo_uri, mongo_db_name = _mongo_settings()
+
     try:
-        client = MongoClient(mongo_uri, serverSelectionTimeoutMS=5000)
+        client = MongoClient(mongo_uri, **_client_options())
         db = client[mongo_db_name]
         # Test connection
         client.admin.command('ping')
         logger.info(f"Connected to MongoDB: {mongo_uri}/{mongo_db_name}")
-        return db
     except Exception as e:
         logger.error(f"Failed to connect to MongoDB: {e}")
         raise
 
+    if getattr(settings, 'MONGODB_ENSURE_INDEXES', True):
+        try:
+            ensure_indexes(db)
+        except Exception as e:
+            # Serving without an index is slow, not broken; `manage.py ensure_mongo_indexes` reports details
+            logger.error(f"Failed to ensure MongoDB indexes: {e}")
+    return db
+
 # Module-level lazy initialization
 _mongo_db = None
 
@@ -31,3 +164,20 @@ def mongo_db():
         _mongo_db = get_mongo_db()
     return _mongo_db
 
+_async_mongo_dbs = weakref.WeakKeyDictionary()
+
+def async_mongo_db():
+    """Lazy asyncio MongoDB database for async views, one client per event loop.
+
+    The async client binds to the loop it first runs on. Under the ASGI
+    server that is the one loop every request shares; the development server
+    (WSGI) runs each async view on a fresh loop, which gets its own client.
+    """
+    loop = asyncio.get_running_loop()
+    db = _async_mongo_dbs.get(loop)
+    if db is None:
+        mongo_uri, mongo_db_name = _mongo_settings()
+        client = AsyncMongoClient(mongo_uri, **_client_options())
+        db = _async_mongo_dbs[loop] = client[mongo_db_name]
+        logger.info(f"Created async MongoDB client: {mongo_uri}/{mongo_db_name}")
+    return db
@@ -0,0 +1,26 @@
+from functools import lru_cache
+from pathlib import Path
+import os
+
+PROMPTS_DIR = Path(__file__).resolve().parent.parent / "prompts"
+
+# Bump by adding system_prompt_v2.txt and setting SYSTEM_PROMPT_VERSION; old versions stay for rollback
+SYSTEM_PROMPT_VERSION = os.getenv("SYSTEM_PROMPT_VERSION", "v1")
+# Same scheme for the vetted crisis resources reply (crisis_response_v1.txt, ...)
+CRISIS_RESPONSE_VERSION = os.getenv("CRISIS_RESPONSE_VERSION", "v1")
+
+
+@lru_cache(maxsize=None)
+def load_system_prompt(version: str = None) -> str:
+    """System instruction text for the chat model, read once per version"""
+    version = version or SYSTEM_PROMPT_VERSION
+    path = PROMPTS_DIR / f"system_prompt_{version}.txt"
+    return path.read_text(encoding="utf-8").strip()
+
+
+@lru_cache(maxsize=None)
+def load_crisis_response(version: str = None) -> str:
+    """Reply sent as-is when the local detector finds crisis indicators, read once per version"""
+    version = version or CRISIS_RESPONSE_VERSION
+    path = PROMPTS_DIR / f"crisis_response_{version}.txt"
+    return path.read_text(encoding="utf-8").strip()
@@ -0,0 +1,135 @@
+from typing import Dict, List, Optional
+from collections import OrderedDict
+import hashlib
+import logging
+import re
+import threading
+import time
+import unicodedata
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_EDGE_PUNCTUATION = " \t\n.,!?;:\"'()[]…"
+
+
+def normalize_query(text: str) -> str:
+    """Canonical form of a query so trivially different phrasings share a cache entry"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = text.replace("’", "'").replace("‘", "'")
+    text = _WHITESPACE_RE.sub(" ", text)
+    return text.strip(_EDGE_PUNCTUATION)
+
+
+class QueryEmbeddingCache:
+    """Two-tier cache of query embeddings keyed on normalized query text.
+
+    The in-process tier is a bounded LRU with per-entry TTL. The optional
+    shared tier is a Django cache alias (e.g. Redis) so every backend replica
+    benefits from embeddings computed by the others; it is consulted on a local
+    miss and errors there never fail the request.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600, shared_cache_alias: str = None,
+                 key_prefix: str = "query-embedding", clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared_cache_alias = shared_cache_alias or None
+        self.key_prefix = key_prefix
+        self._clock = clock
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_settings(cls) -> "QueryEmbeddingCache":
+        """Build a cache from Django settings when they are configured, else use defaults"""
+        options = {}
+        try:
+            from django.conf import settings
+            if settings.configured:
+                options = {
+                    "max_entries": getattr(settings, "QUERY_EMBEDDING_CACHE_SIZE", 1024),
+                    "ttl": getattr(settings, "QUERY_EMBEDDING_CACHE_TTL", 3600),
+                    "shared_cache_alias": getattr(settings, "QUERY_EMBEDDING_SHARED_CACHE", None),
+                }
+        except ImportError:
+            pass
+        return cls(**options)
+
+    def _key(self, model: str, query: str) -> str:
+        digest = hashlib.sha256(f"{model}\0{normalize_query(query)}".encode("utf-8")).hexdigest()
+        return f"{self.key_prefix}:{digest}"
+
+    def _shared_cache(self):
+        if not self.shared_cache_alias:
+            return None
+        from django.core.cache import caches
+        return caches[self.shared_cache_alias]
+
+    def get(self, model: str, query: str) -> Optional[List[float]]:
+        key = self._key(model, query)
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, embedding = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return embedding
+                del self._entries[key]
+
+        embedding = None
+        try:
+            shared = self._shared_cache()
+            packed = shared.get(key) if shared is not None else None
+            if packed is not None:
+                embedding = np.frombuffer(packed, dtype=np.float32).tolist()
+        except Exception as e:
+            logger.warning(f"Shared query embedding cache unavailable: {e}")
+
+        with self._lock:
+            if embedding is None:
+                self.misses += 1
+                return None
+            self.shared_hits += 1
+        self._set_local(key, embedding)
+        return embedding
+
+    def set(self, model: str, query: str, embedding: List[float]) -> None:
+        key = self._key(model, query)
+        self._set_local(key, embedding)
+        try:
+            shared = self._shared_cache()
+            if shared is not None:
+                shared.set(key, np.asarray(embedding, dtype=np.float32).tobytes(), timeout=self.ttl)
+        except Exception as e:
+            logger.warning(f"Shared query embedding cache unavailable: {e}")
+
+    def _set_local(self, key: str, embedding: List[float]) -> None:
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
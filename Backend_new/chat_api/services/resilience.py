@@ -0,0 +1,180 @@
+from typing import Callable, Dict
+from contextlib import contextmanager
+import asyncio
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+from google.api_core import exceptions as google_exceptions
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Per-call deadlines, passed to the Gemini client as request_options={"timeout": ...}
+GEMINI_GENERATE_TIMEOUT = float(os.getenv("GEMINI_GENERATE_TIMEOUT", 30))
+GEMINI_EMBED_TIMEOUT = float(os.getenv("GEMINI_EMBED_TIMEOUT", 10))
+
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit breaker is open"""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"{name} is unavailable (circuit open, next probe in {retry_in:.0f}s)")
+        self.name = name
+        self.retry_in = retry_in
+
+
+def is_transient(error: BaseException) -> bool:
+    """Timeouts, quota and server errors: failures that say the dependency is unhealthy.
+
+    Anything else (e.g. an invalid request) means the service answered, so it
+    does not count against the breaker.
+    """
+    if isinstance(error, (google_exceptions.DeadlineExceeded, google_exceptions.TooManyRequests,
+                          google_exceptions.ResourceExhausted, google_exceptions.ServerError,
+                          TimeoutError, asyncio.TimeoutError, concurrent.futures.TimeoutError,
+                          ConnectionError)):
+        return True
+    return getattr(error, "code", None) in TRANSIENT_STATUS_CODES
+
+
+class CircuitBreaker:
+    """Fails fast while a dependency is down instead of waiting out every failure.
+
+    Closed: calls go through; `failure_threshold` consecutive transient
+    failures open the circuit. Open: calls raise CircuitOpenError without
+    touching the dependency. After `reset_timeout` seconds the breaker is
+    half-open and lets `half_open_max_calls` probes through; a successful
+    probe closes it, a failed one opens it for another `reset_timeout`.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = None, reset_timeout: float = None,
+                 half_open_max_calls: int = 1, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold or int(os.getenv("GEMINI_BREAKER_FAILURES", 5))
+        self.reset_timeout = reset_timeout if reset_timeout is not None else float(
+            os.getenv("GEMINI_BREAKER_RESET_TIMEOUT", 30))
+        self.half_open_max_calls = half_open_max_calls
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self.rejected = 0
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    def _before_call(self) -> bool:
+        """Raise CircuitOpenError if the call may not proceed; returns True for a half-open probe"""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return False
+            if state == HALF_OPEN and self._probes < self.half_open_max_calls:
+                self._probes += 1
+                return True
+            self.rejected += 1
+            retry_in = max(0.0, self.reset_timeout - (self._clock() - self._opened_at))
+        raise CircuitOpenError(self.name, retry_in)
+
+    def _trip(self) -> None:
+        self._state = OPEN
+        self._opened_at = self._clock()
+        self.opened += 1
+
+    def record_success(self, probe: bool = False) -> None:
+        with self._lock:
+            if probe:
+                self._probes -= 1
+            if self._state != CLOSED:
+                logger.info(f"Circuit breaker {self.name} closed")
+            self._state = CLOSED
+            self._failures = 0
+
+    def record_failure(self, probe: bool = False) -> None:
+        with self._lock:
+            if probe:
+                self._probes -= 1
+            self._failures += 1
+            if self._state == HALF_OPEN or (self._state == CLOSED and self._failures >= self.failure_threshold):
+                self._trip()
+                logger.warning(f"Circuit breaker {self.name} opened after {self._failures} consecutive failure(s)")
+
+    def _release(self, probe: bool) -> None:
+        if probe:
+            with self._lock:
+                self._probes -= 1
+
+    @contextmanager
+    def guard(self):
+        """Run the block as one call through the breaker (works around awaits and streamed responses too)"""
+        probe = self._before_call()
+        try:
+            yield
+        except Exception as e:
+            if is_transient(e):
+                self.record_failure(probe)
+            else:
+                self.record_success(probe)
+            raise
+        except BaseException:
+            # Cancelled or abandoned (e.g. the client closed a stream): says nothing about the dependency
+            self._release(probe)
+            raise
+        self.record_success(probe)
+
+    def call(self, fn: Callable, *args, **kwargs):
+        with self.guard():
+            return fn(*args, **kwargs)
+
+    async def acall(self, fn: Callable, *args, **kwargs):
+        with self.guard():
+            return await fn(*args, **kwargs)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "state": self._current_state(),
+                "consecutive_failures": self._failures,
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """Process-wide breaker for one dependency, e.g. "gemini_generate" or "gemini_embed" """
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = _breakers[name] = CircuitBreaker(name)
+    return breaker
+
+
+def breaker_states() -> Dict[str, Dict]:
+    """Snapshot of every breaker created so far, for health checks and metrics"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.snapshot() for breaker in breakers}
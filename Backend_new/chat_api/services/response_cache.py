@@ -0,0 +1,83 @@
+from typing import Any, Dict, List, Optional
+from collections import OrderedDict
+import itertools
+import logging
+import os
+import threading
+from .safety import contains_crisis_indicators, contains_personal_details
+from .vector_index import VectorIndex
+
+logger = logging.getLogger(__name__)
+
+
+def is_generic_question(message: str) -> bool:
+    """True for messages whose answer does not depend on who is asking.
+
+    Anything with crisis indicators or personal details (first-person context,
+    emails, phone numbers, links) must always reach the model.
+    """
+    return not contains_crisis_indicators(message) and not contains_personal_details(message)
+
+
+class SemanticResponseCache:
+    """Serves stored responses to questions whose embedding is close to an earlier one.
+
+    Entries are held in a VectorIndex for similarity lookup and evicted least
+    recently used first once `max_entries` is reached.
+    """
+
+    def __init__(self, max_entries: int = 512, similarity_threshold: float = 0.95):
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self._index = VectorIndex()
+        self._responses: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._responses)
+
+    def lookup(self, query_embedding: List[float]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            matches = self._index.search(query_embedding, top_k=1, min_score=self.similarity_threshold)
+            if not matches:
+                self.misses += 1
+                return None
+            entry_id, _ = matches[0]
+            self._responses.move_to_end(entry_id)
+            self.hits += 1
+            return dict(self._responses[entry_id])
+
+    def store(self, query_embedding: List[float], response: Dict[str, Any]) -> None:
+        with self._lock:
+            entry_id = next(self._ids)
+            self._index.add(entry_id, query_embedding)
+            self._responses[entry_id] = dict(response)
+            while len(self._responses) > self.max_entries:
+                evicted_id, _ = self._responses.popitem(last=False)
+                self._index.remove(evicted_id)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._responses), "hits": self.hits, "misses": self.misses}
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[SemanticResponseCache]:
+    """Process-wide response cache, or None unless SEMANTIC_RESPONSE_CACHE_ENABLED is true"""
+    global _response_cache
+    if os.getenv("SEMANTIC_RESPONSE_CACHE_ENABLED", "false").lower() != "true":
+        return None
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = SemanticResponseCache(
+                    max_entries=int(os.getenv("SEMANTIC_RESPONSE_CACHE_SIZE", 512)),
+                    similarity_threshold=float(os.getenv("SEMANTIC_RESPONSE_CACHE_THRESHOLD", 0.95)),
+                )
+    return _response_cache
@@ -0,0 +1,71 @@
+from typing import Dict, List, Sequence, Union
+import json
+import math
+import re
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def _normalize(text: str) -> str:
+    return _WHITESPACE_RE.sub(" ", text).strip().lower()
+
+
+def load_labelled_queries(path) -> List[Dict]:
+    """Read a JSONL file of {"query": ..., "relevant": [...]} objects.
+
+    Each relevant entry is either a source name (any chunk of that document
+    counts) or {"source": ..., "text": ...} (only a chunk of that document
+    containing the passage counts). Passage labels survive chunking changes as
+    long as the passage is shorter than a chunk. An empty list marks an
+    off-topic query, for which nothing should be retrieved.
+    """
+    queries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+                query, relevant = item["query"], item["relevant"]
+            except (ValueError, KeyError) as e:
+                raise ValueError(f"{path}:{line_number}: expected {{\"query\", \"relevant\"}}: {e}") from e
+            labels = [label if isinstance(label, dict) else {"source": label} for label in relevant]
+            queries.append({"query": query, "relevant": labels})
+    return queries
+
+
+def matches(chunk: Dict, label: Dict) -> bool:
+    if chunk["source"] != label["source"]:
+        return False
+    return "text" not in label or _normalize(label["text"]) in _normalize(chunk["content"])
+
+
+def relevance_ranks(results: Sequence[Dict], labels: Sequence[Dict]) -> List[Union[int, None]]:
+    """For every label, the 1-based rank of the first result that satisfies it (None if none does).
+
+    A result is credited to at most one label, so retrieving the same passage
+    twice does not count as finding two relevant documents.
+    """
+    ranks = [None] * len(labels)
+    for rank, chunk in enumerate(results, 1):
+        for i, label in enumerate(labels):
+            if ranks[i] is None and matches(chunk, label):
+                ranks[i] = rank
+                break
+    return ranks
+
+
+def recall_at_k(ranks: Sequence[Union[int, None]], k: int) -> float:
+    return sum(1 for rank in ranks if rank is not None and rank <= k) / len(ranks)
+
+
+def reciprocal_rank(ranks: Sequence[Union[int, None]]) -> float:
+    found = [rank for rank in ranks if rank is not None]
+    return 1.0 / min(found) if found else 0.0
+
+
+def ndcg_at_k(ranks: Sequence[Union[int, None]], k: int) -> float:
+    """Binary-relevance nDCG: the ideal ranking puts one relevant result at each of the top positions"""
+    dcg = sum(1.0 / math.log2(rank + 1) for rank in ranks if rank is not None and rank <= k)
+    ideal = sum(1.0 / math.log2(position + 1) for position in range(1, min(k, len(ranks)) + 1))
+    return dcg / ideal
@@ -0,0 +1,49 @@
+from typing import List
+import re
+from .aho_corasick import AhoCorasick
+
+# Phrases that mark a message as a potential crisis (see the crisis protocol in the system prompt).
+# A match skips Gemini, so topics people also ask about in general (suicide, chest pain, heart
+# attacks) are only listed in the first-person forms of someone in danger
+CRISIS_PHRASES = [
+    "kill myself", "killing myself", "end my life", "ending my life", "take my own life",
+    "want to die", "wanna die", "wish i was dead", "wish i were dead", "better off dead",
+    "don't want to live", "dont want to live", "do not want to live", "no reason to live",
+    "commit suicide", "committing suicide", "thinking about suicide", "thinking of suicide",
+    "considering suicide", "suicide note", "i'm suicidal", "im suicidal", "i am suicidal",
+    "feel suicidal", "feeling suicidal", "self harm", "self-harm", "hurt myself", "hurting myself",
+    "cut myself", "cutting myself", "overdose", "hang myself", "disappear forever",
+    "kill someone", "kill him", "kill her", "kill them", "hurt someone",
+    "i can't breathe", "i cant breathe", "i cannot breathe", "have chest pain", "having chest pain",
+    "have chest pains", "having chest pains", "my chest hurts", "having a heart attack",
+]
+# Built once at import: one pass over the message whatever the number of phrases. Matches must start a
+# word ("kill him" is not in "skill him") but may end inside one ("overdose" matches "overdosed")
+_CRISIS_MATCHER = AhoCorasick(CRISIS_PHRASES, word_start=True)
+
+_PERSONAL_PATTERNS = [
+    # First-person context: the answer depends on the user's own situation
+    re.compile(r"\b(i|i'm|im|i've|i'd|i'll|me|my|mine|myself)\b", re.IGNORECASE),
+    re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+"),  # email address
+    re.compile(r"\+?\(?\d(?:[\s().-]{0,2}\d){7,}"),  # phone number: 8+ digits, optionally separated
+    re.compile(r"https?://\S+", re.IGNORECASE),
+]
+
+
+def _normalize(text: str) -> str:
+    # Lower case, straight apostrophes and single spaces, the form CRISIS_PHRASES are written in
+    return " ".join(text.replace("’", "'").lower().split())
+
+
+def find_crisis_indicators(text: str) -> List[str]:
+    """Crisis phrases found in `text`, in order of appearance and without repeats"""
+    return list(dict.fromkeys(phrase for _, phrase in _CRISIS_MATCHER.iter_matches(_normalize(text))))
+
+
+def contains_crisis_indicators(text: str) -> bool:
+    return _CRISIS_MATCHER.search(_normalize(text)) is not None
+
+
+def contains_personal_details(text: str) -> bool:
+    text = text.replace("’", "'")
+    return any(pattern.search(text) for pattern in _PERSONAL_PATTERNS)
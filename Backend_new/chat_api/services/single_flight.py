@@ -0,0 +1,84 @@
+from typing import Any, Awaitable, Callable, Dict, Tuple
+import asyncio
+import hashlib
+import threading
+from .metrics import SINGLE_FLIGHT_CALLS
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Lets concurrent identical calls share one upstream request.
+
+    The first caller for a key (the leader) runs the call; callers arriving
+    with the same key while it is in flight wait for it and get the same
+    result, or the same exception. Nothing is kept once the call finishes, so
+    this only collapses bursts; caching results is left to the caches.
+
+    Threads coalesce with threads (do) and tasks with tasks of the same event
+    loop (ado). An async call runs as its own task, so a cancelled caller
+    does not cancel the request the others are waiting on.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self._tasks: Dict[Tuple[int, str], asyncio.Task] = {}
+
+    @staticmethod
+    def key(*parts: Any) -> str:
+        """Hash of the model and input that identify a call"""
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(repr(part).encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def do(self, key: str, fn: Callable, *args, **kwargs):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            SINGLE_FLIGHT_CALLS.labels(name=self.name, result="shared").inc()
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        SINGLE_FLIGHT_CALLS.labels(name=self.name, result="upstream").inc()
+        try:
+            flight.result = fn(*args, **kwargs)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    async def ado(self, key: str, fn: Callable[..., Awaitable], *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        task_key = (id(loop), key)
+        with self._lock:
+            task = self._tasks.get(task_key)
+            leader = task is None
+            if leader:
+                task = self._tasks[task_key] = loop.create_task(fn(*args, **kwargs))
+                task.add_done_callback(lambda finished: self._finish(task_key, finished))
+        SINGLE_FLIGHT_CALLS.labels(name=self.name, result="upstream" if leader else "shared").inc()
+        return await asyncio.shield(task)
+
+    def _finish(self, task_key: Tuple[int, str], task: asyncio.Task) -> None:
+        with self._lock:
+            self._tasks.pop(task_key, None)
+        if not task.cancelled():
+            task.exception()  # Retrieved here so a failure nobody awaits any more is not reported as lost
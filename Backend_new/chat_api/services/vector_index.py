@@ -0,0 +1,142 @@
+from typing import Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+import copy
+import numpy as np
+
+
+class VectorIndex:
+    """Exact cosine-similarity index over a contiguous float32 matrix.
+
+    Rows are L2-normalized on insert, so scoring a query is a single
+    matrix-vector product and top-k selection uses argpartition instead of a
+    full sort. Capacity grows geometrically and removals swap the last row into
+    the freed slot, so add/remove never rebuild the whole matrix.
+    """
+
+    def __init__(self, dim: Optional[int] = None, initial_capacity: int = 64):
+        self.dim = dim
+        self._initial_capacity = max(1, initial_capacity)
+        self._matrix = np.empty((0, dim or 0), dtype=np.float32)
+        self._ids: List[Hashable] = []
+        self._rows: Dict[Hashable, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, item_id: Hashable) -> bool:
+        return item_id in self._rows
+
+    @property
+    def ids(self) -> List[Hashable]:
+        return list(self._ids)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """Normalized rows currently in the index (a view, do not modify)"""
+        return self._matrix[:len(self._ids)]
+
+    @property
+    def nbytes(self) -> int:
+        return self._matrix.nbytes
+
+    def copy(self) -> "VectorIndex":
+        """Independent copy: adding to or removing from one index leaves the other unchanged"""
+        clone = copy.copy(self)
+        clone._matrix = self._matrix.copy()
+        clone._ids = list(self._ids)
+        clone._rows = dict(self._rows)
+        return clone
+
+    @staticmethod
+    def _normalize(vector: Sequence[float]) -> np.ndarray:
+        arr = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(arr)
+        if norm == 0:
+            return arr
+        return arr / norm
+
+    def _reserve(self, size: int) -> None:
+        capacity = self._matrix.shape[0]
+        if size <= capacity:
+            return
+        new_capacity = max(self._initial_capacity, capacity * 2)
+        while new_capacity < size:
+            new_capacity *= 2
+        grown = np.empty((new_capacity, self.dim), dtype=np.float32)
+        grown[:len(self._ids)] = self._matrix[:len(self._ids)]
+        self._matrix = grown
+        self._on_resize(new_capacity)
+
+    def add(self, item_id: Hashable, vector: Sequence[float]) -> None:
+        """Insert a vector, replacing any existing vector with the same id"""
+        row_vector = self._normalize(vector)
+        if self.dim is None:
+            self.dim = row_vector.shape[0]
+            self._matrix = np.empty((0, self.dim), dtype=np.float32)
+        if row_vector.shape != (self.dim,):
+            raise ValueError(f"Expected vector of dimension {self.dim}, got {row_vector.shape}")
+
+        row = self._rows.get(item_id)
+        if row is None:
+            row = len(self._ids)
+            self._reserve(row + 1)
+            self._ids.append(item_id)
+            self._rows[item_id] = row
+        self._matrix[row] = row_vector
+        self._on_row_set(row)
+
+    def add_many(self, items: Iterable[Tuple[Hashable, Sequence[float]]]) -> None:
+        for item_id, vector in items:
+            self.add(item_id, vector)
+
+    def remove(self, item_id: Hashable) -> bool:
+        """Remove a vector by id; returns False if it was not present"""
+        row = self._rows.pop(item_id, None)
+        if row is None:
+            return False
+        last = len(self._ids) - 1
+        if row != last:
+            moved_id = self._ids[last]
+            self._matrix[row] = self._matrix[last]
+            self._ids[row] = moved_id
+            self._rows[moved_id] = row
+            self._on_row_moved(last, row)
+        self._ids.pop()
+        return True
+
+    # Hooks for subclasses that keep per-row state alongside the matrix
+    def _on_resize(self, capacity: int) -> None:
+        pass
+
+    def _on_row_set(self, row: int) -> None:
+        pass
+
+    def _on_row_moved(self, source_row: int, target_row: int) -> None:
+        pass
+
+    def _top_k(self, rows: np.ndarray, scores: np.ndarray, top_k: int,
+               min_score: Optional[float]) -> List[Tuple[Hashable, float]]:
+        """Select the best `top_k` of `scores`, where scores[i] belongs to matrix row rows[i]"""
+        k = min(top_k, len(scores))
+        if k < len(scores):
+            candidates = np.argpartition(-scores, k - 1)[:k]
+        else:
+            candidates = np.arange(len(scores))
+        candidates = candidates[np.argsort(-scores[candidates])]
+
+        results = []
+        for i in candidates:
+            score = float(scores[i])
+            if min_score is not None and score <= min_score:
+                break
+            results.append((self._ids[rows[i]], score))
+        return results
+
+    def search(self, query: Sequence[float], top_k: int = 2,
+               min_score: Optional[float] = None) -> List[Tuple[Hashable, float]]:
+        """Return up to `top_k` (id, cosine similarity) pairs, best first"""
+        size = len(self._ids)
+        if size == 0 or top_k <= 0:
+            return []
+        query_vector = self._normalize(query)
+        scores = self._matrix[:size] @ query_vector
+        return self._top_k(np.arange(size), scores, top_k, min_score)
@@ -1,3 +1,1453 @@
-from django.test import TestCase
+import asyncio
+import base64
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+from urllib.parse import urlencode
 
-# Create your tests here.
+import numpy as np
+from bson import ObjectId
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
+
+from google.api_core import exceptions as google_exceptions
+from prometheus_client import REGISTRY
+from pymongo.errors import AutoReconnect, BulkWriteError
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+from .services.aho_corasick import AhoCorasick
+from .services.document_store import DocumentStore, get_document_store, reciprocal_rank_fusion
+from .services.embedding_cache import EmbeddingCache, PackedEmbeddingCache, embedding_key
+from .services.embedding_client import (
+    EMBEDDING_MODEL,
+    EmbeddingClient,
+    EmbeddingError,
+    FakeEmbeddingBackend,
+    GeminiEmbeddingBackend,
+    RateLimiter,
+    RetryableEmbeddingError,
+    embedding_cache_model,
+)
+from .services.ivf_index import IVFIndex
+from .services.kb_storage import MongoLayout
+from .services.mongo_client import INDEXES, ensure_indexes
+from .services.query_cache import QueryEmbeddingCache
+from .services.vector_index import VectorIndex
+from .services.conversations import load_recent_turns, record_turn, resolve_conversation
+from .services.chat_log_writer import DUPLICATE_KEY_ERROR, ChatLogWriter
+from .services.chat_service import ChatService
+from .services.chunking import split_into_chunks
+from .services.context_builder import ContextBuilder, estimate_tokens, format_turn, truncate_to_tokens
+from .services.prompts import load_crisis_response
+from .services.response_cache import SemanticResponseCache, is_generic_question
+from .services.resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+from .services.safety import contains_crisis_indicators, find_crisis_indicators
+from .services.single_flight import SingleFlight
+from .views import ChatDetailView, ChatHistoryView
+
+
+def _turns(count, rng=None, max_words=80):
+    rng = rng or random.Random(0)
+    return [
+        {
+            "message": " ".join(f"m{i}w{j}" for j in range(rng.randint(1, max_words))),
+            "response": " ".join(f"r{i}w{j}" for j in range(rng.randint(0, max_words * 2))),
+        }
+        for i in range(count)
+    ]
+
+
+def _word_count(text):
+    return len(text.split())
+
+
+class ChunkingTests(SimpleTestCase):
+    SENTENCES = [f"Sentence {i} is about sleep and stress." for i in range(12)]
+
+    def test_text_shorter_than_a_chunk(self):
+        self.assertEqual(split_into_chunks("  Take a short walk.  ", max_chars=100, overlap=20),
+                         [{"index": 0, "content": "Take a short walk.", "start": 2, "end": 20}])
+        self.assertEqual(split_into_chunks("", max_chars=100, overlap=20), [])
+
+    def test_chunks_end_at_sentence_boundaries(self):
+        text = " ".join(self.SENTENCES)
+        chunks = split_into_chunks(text, max_chars=100, overlap=0)
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(len(chunk["content"]), 100)
+            self.assertEqual(chunk["content"], text[chunk["start"]:chunk["end"]])
+            self.assertTrue(chunk["content"].startswith("Sentence"))
+            self.assertTrue(chunk["content"].endswith("."))
+        # Without overlap every sentence lands in exactly one chunk
+        self.assertEqual(" ".join(chunk["content"] for chunk in chunks), text)
+
+    def test_chunks_end_at_paragraph_boundaries(self):
+        text = "First paragraph without punctuation\n\nSecond paragraph without punctuation"
+        chunks = split_into_chunks(text, max_chars=50, overlap=0)
+        self.assertEqual([chunk["content"] for chunk in chunks],
+                         ["First paragraph without punctuation", "Second paragraph without punctuation"])
+
+    def test_chunks_overlap_by_whole_sentences(self):
+        text = " ".join(self.SENTENCES)
+        chunks = split_into_chunks(text, max_chars=120, overlap=50)
+        self.assertGreater(len(chunks), 2)
+        for previous, chunk in zip(chunks, chunks[1:]):
+            shared = text[chunk["start"]:previous["end"]]
+            # The previous chunk's last sentence is repeated, never more than the overlap allows
+            self.assertIn(shared, self.SENTENCES)
+            self.assertLessEqual(len(shared), 50)
+            self.assertGreater(chunk["end"], previous["end"])
+        self.assertEqual(chunks[-1]["end"], len(text))
+
+    def test_long_sentence_is_split_at_whitespace(self):
+        text = "word " * 60
+        chunks = split_into_chunks(text, max_chars=50, overlap=0)
+        self.assertTrue(all(len(chunk["content"]) <= 50 for chunk in chunks))
+        # No word is cut in two
+        self.assertEqual({word for chunk in chunks for word in chunk["content"].split(" ")}, {"word"})
+        self.assertEqual(" ".join(chunk["content"] for chunk in chunks), text.strip())
+
+    def test_invalid_sizes(self):
+        with self.assertRaises(ValueError):
+            split_into_chunks("text", max_chars=0)
+        with self.assertRaises(ValueError):
+            split_into_chunks("text", max_chars=100, overlap=100)
+
+
+class ContextBuilderTests(SimpleTestCase):
+    def test_budget_never_exceeded(self):
+        rng = random.Random(42)
+        for _ in range(300):
+            builder = ContextBuilder(
+                max_tokens=rng.randint(1, 1500),
+                summary_max_tokens=rng.randint(0, 400),
+            )
+            summary = "s " * rng.randint(0, 1000)
+            context = builder.build(_turns(rng.randint(0, 40), rng), summary)
+            self.assertLessEqual(estimate_tokens(context["text"]), builder.max_tokens)
+            self.assertEqual(context["tokens"], estimate_tokens(context["text"]))
+
+    def test_budget_never_exceeded_with_custom_counter(self):
+        rng = random.Random(7)
+        for _ in range(200):
+            builder = ContextBuilder(
+                max_tokens=rng.randint(1, 600),
+                summary_max_tokens=rng.randint(0, 100),
+                token_counter=_word_count,
+            )
+            context = builder.build(_turns(rng.randint(0, 30), rng), "earlier " * rng.randint(0, 300))
+            self.assertLessEqual(_word_count(context["text"]), builder.max_tokens)
+
+    def test_keeps_most_recent_turns_and_evicts_oldest(self):
+        turns = _turns(30)
+        context = ContextBuilder(max_tokens=800, summary_max_tokens=100).build(turns)
+        included, evicted = context["turns"], context["evicted"]
+        self.assertTrue(included)
+        self.assertTrue(evicted)
+        self.assertEqual(evicted + included, turns)
+        self.assertIn(format_turn(turns[-1]), context["text"])
+        self.assertNotIn(format_turn(evicted[-1]), context["text"])
+
+    def test_everything_fits_within_generous_budget(self):
+        turns = _turns(5)
+        context = ContextBuilder(max_tokens=100000, summary_max_tokens=500).build(turns, "They feel stressed.")
+        self.assertEqual(context["turns"], turns)
+        self.assertEqual(context["evicted"], [])
+        self.assertIn("They feel stressed.", context["text"])
+
+    def test_oversized_turn_is_evicted(self):
+        turns = [{"message": "x" * 10000, "response": "y"}]
+        context = ContextBuilder(max_tokens=100, summary_max_tokens=20).build(turns)
+        self.assertEqual(context["turns"], [])
+        self.assertEqual(context["evicted"], turns)
+        self.assertLessEqual(context["tokens"], 100)
+
+    def test_summary_is_capped(self):
+        builder = ContextBuilder(max_tokens=1000, summary_max_tokens=50)
+        context = builder.build([], "word " * 1000)
+        self.assertLessEqual(context["tokens"], 50)
+        self.assertTrue(context["summary"])
+
+    def test_empty_conversation(self):
+        context = ContextBuilder(max_tokens=100).build([], None)
+        self.assertEqual(context["text"], "")
+        self.assertEqual(context["tokens"], 0)
+
+    def test_update_summary_uses_summarizer_and_caps_result(self):
+        calls = []
+
+        def summarizer(previous, transcript):
+            calls.append((previous, transcript))
+            return previous + " | " + transcript
+
+        builder = ContextBuilder(max_tokens=1000, summary_max_tokens=60, summarizer=summarizer)
+        turns = _turns(10)
+        summary = builder.update_summary("Earlier summary", turns)
+        self.assertEqual(calls[0][0], "Earlier summary")
+        self.assertIn(format_turn(turns[0]), calls[0][1])
+        self.assertLessEqual(estimate_tokens(builder.build([], summary)["text"]), 60)
+        # The newest turns are kept when the summary has to be cut
+        self.assertTrue(summary.endswith(format_turn(turns[-1])[-20:]))
+
+    def test_update_summary_falls_back_when_summarizer_fails(self):
+        def summarizer(previous, transcript):
+            raise RuntimeError("quota exceeded")
+
+        builder = ContextBuilder(max_tokens=1000, summary_max_tokens=200, summarizer=summarizer)
+        summary = builder.update_summary("", [{"message": "I can't sleep", "response": "Try a wind-down routine."}])
+        self.assertIn("I can't sleep", summary)
+
+    def test_update_summary_without_evicted_turns_keeps_summary(self):
+        builder = ContextBuilder(max_tokens=100, summary_max_tokens=50)
+        self.assertEqual(builder.update_summary("unchanged", []), "unchanged")
+
+
+class TruncateToTokensTests(SimpleTestCase):
+    def test_prefix_and_suffix(self):
+        text = "abcdefghijklmnopqrstuvwxyz"
+        self.assertEqual(truncate_to_tokens(text, 2), "abcdefgh")
+        self.assertEqual(truncate_to_tokens(text, 2, keep_end=True), "stuvwxyz")
+        self.assertEqual(truncate_to_tokens(text, 0), "")
+        self.assertEqual(truncate_to_tokens(text, 100), text)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _unavailable():
+    raise google_exceptions.ServiceUnavailable("down")
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=10, clock=self.clock)
+
+    def _fail(self, times):
+        for _ in range(times):
+            with self.assertRaises(google_exceptions.ServiceUnavailable):
+                self.breaker.call(_unavailable)
+
+    def test_opens_after_consecutive_failures_and_fails_fast(self):
+        self._fail(2)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self._fail(1)
+        self.assertEqual(self.breaker.state, OPEN)
+        calls = []
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.call(calls.append, 1)
+        self.assertEqual(calls, [])
+        self.assertEqual(self.breaker.snapshot()["rejected"], 1)
+
+    def test_success_resets_failure_count(self):
+        self._fail(2)
+        self.breaker.call(lambda: None)
+        self._fail(2)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_non_transient_errors_do_not_open(self):
+        for _ in range(5):
+            with self.assertRaises(ValueError):
+                self.breaker.call(int, "not a number")
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_half_open_probe_closes_on_success(self):
+        self._fail(3)
+        self.clock.now = 10
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        with self.breaker.guard():
+            # Only one probe at a time
+            with self.assertRaises(CircuitOpenError):
+                self.breaker.call(lambda: None)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_failed_probe_reopens(self):
+        self._fail(3)
+        self.clock.now = 10
+        self._fail(1)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.clock.now = 19
+        self.assertEqual(self.breaker.state, OPEN)
+        self.clock.now = 20
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+
+    def test_abandoned_probe_frees_the_slot(self):
+        self._fail(3)
+        self.clock.now = 10
+
+        def stream():
+            with self.breaker.guard():
+                yield "token"
+                yield "token"
+
+        tokens = stream()
+        next(tokens)
+        tokens.close()  # The client went away mid-stream
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.breaker.call(lambda: None)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+
+class FakeChatCollection:
+    """Stands in for db.chats; the first `failures` inserts raise, `gate` holds the first insert until set"""
+
+    def __init__(self, failures=0, gate=None):
+        self.failures = failures
+        self.gate = gate
+        self.records = []
+        self.calls = 0
+
+    def insert_many(self, records, ordered=True):
+        self.calls += 1
+        if self.gate is not None and self.calls == 1:
+            self.gate.wait(5)
+        if self.failures:
+            self.failures -= 1
+            raise AutoReconnect("connection reset")
+        self.records.extend(records)
+
+
+class ChatLogWriterTests(SimpleTestCase):
+    def _writer(self, collection, **options):
+        self.delays = []
+        writer = ChatLogWriter(insert_many=collection.insert_many, sleep=self.delays.append, **options)
+        self.addCleanup(writer.close)
+        return writer
+
+    def test_failed_batch_is_retried(self):
+        collection = FakeChatCollection(failures=1)
+        writer = self._writer(collection, batch_size=2, flush_interval=0.05)
+        records = [{"message": "first"}, {"message": "second"}]
+        for record in records:
+            self.assertTrue(writer.submit(record))
+        writer.close()
+
+        self.assertEqual(collection.records, records)
+        self.assertEqual(self.delays, [0.5])
+        stats = writer.stats()
+        self.assertEqual((stats["written"], stats["retries"], stats["failed"]), (2, 1, 0))
+
+    def test_close_flushes_queued_records(self):
+        gate = threading.Event()
+        collection = FakeChatCollection(gate=gate)
+        writer = self._writer(collection, batch_size=1, flush_interval=0.05)
+        records = [{"message": f"turn {i}"} for i in range(3)]
+        writer.submit(records[0])
+        # The first insert is in progress, so the others are still queued when close() is called
+        while collection.calls == 0:
+            time.sleep(0.001)
+        for record in records[1:]:
+            writer.submit(record)
+        closer = threading.Thread(target=writer.close)
+        closer.start()
+        while not writer._closed.is_set():
+            time.sleep(0.001)
+        gate.set()
+        closer.join(5)
+
+        self.assertEqual(collection.records, records)
+        self.assertEqual(writer.stats()["queue_depth"], 0)
+        self.assertEqual(writer.stats()["written"], 3)
+
+    def test_duplicate_keys_of_a_retried_batch_count_as_written(self):
+        def insert_many(records):
+            raise BulkWriteError({"writeErrors": [{"code": DUPLICATE_KEY_ERROR, "index": 0}]})
+
+        writer = self._writer(SimpleNamespace(insert_many=insert_many), flush_interval=0.05)
+        writer.submit({"message": "first"})
+        writer.close()
+        self.assertEqual((writer.stats()["written"], writer.stats()["retries"]), (1, 0))
+
+
+SHARED_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "shared": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "query-embedding-tests"},
+}
+
+
+class QueryEmbeddingCacheTests(SimpleTestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = QueryEmbeddingCache(max_entries=2)
+        cache.set("model", "first", [1.0])
+        cache.set("model", "second", [2.0])
+        cache.get("model", "first")
+        cache.set("model", "third", [3.0])
+
+        self.assertIsNone(cache.get("model", "second"))
+        self.assertEqual(cache.get("model", "first"), [1.0])
+        self.assertEqual(cache.get("model", "third"), [3.0])
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_entries_expire_after_the_ttl(self):
+        clock = FakeClock()
+        cache = QueryEmbeddingCache(ttl=10, clock=clock)
+        cache.set("model", "how to sleep", [1.0])
+        clock.now = 9.9
+        self.assertEqual(cache.get("model", "how to sleep"), [1.0])
+        clock.now = 10.0
+        self.assertIsNone(cache.get("model", "how to sleep"))
+        self.assertEqual(cache.stats()["size"], 0)
+
+    def test_queries_are_normalized_and_keyed_by_model(self):
+        cache = QueryEmbeddingCache()
+        cache.set("model", "How to sleep?", [1.0])
+        self.assertEqual(cache.get("model", "  how to   SLEEP "), [1.0])
+        self.assertIsNone(cache.get("other-model", "How to sleep?"))
+
+    @override_settings(CACHES=SHARED_CACHES)
+    def test_shared_tier_is_written_through_and_read_through(self):
+        first = QueryEmbeddingCache(shared_cache_alias="shared")
+        second = QueryEmbeddingCache(shared_cache_alias="shared")
+        first.set("model", "how to sleep", [0.5, 0.25])
+
+        # Another replica finds it in the shared tier, then in its own
+        self.assertEqual(second.get("model", "how to sleep"), [0.5, 0.25])
+        self.assertEqual(second.get("model", "how to sleep"), [0.5, 0.25])
+        self.assertEqual({stat: second.stats()[stat] for stat in ("hits", "shared_hits", "misses")},
+                         {"hits": 1, "shared_hits": 1, "misses": 0})
+        self.assertIsNone(second.get("model", "exam stress"))
+
+    def test_shared_tier_errors_are_misses(self):
+        cache = QueryEmbeddingCache(shared_cache_alias="shared")
+        with mock.patch.object(cache, "_shared_cache", side_effect=ConnectionError("redis down")):
+            cache.set("model", "how to sleep", [1.0])
+            self.assertIsNone(cache.get("model", "exam stress"))
+        self.assertEqual(cache.get("model", "how to sleep"), [1.0])
+
+
+class ServiceStatsCollectorTests(SimpleTestCase):
+    def test_cache_counters_are_exported(self):
+        query_cache = QueryEmbeddingCache()
+        query_cache.set("model", "how to sleep", [1.0, 0.0])
+        query_cache.get("model", "how to sleep")
+        query_cache.get("model", "exam stress")
+        response_cache = SemanticResponseCache()
+        response_cache.store([1.0, 0.0], {"response": "Keep a routine"})
+        response_cache.lookup([1.0, 0.0])
+
+        with mock.patch("chat_api.services.document_store._document_store", SimpleNamespace(query_cache=query_cache)), \
+                mock.patch("chat_api.services.response_cache._response_cache", response_cache):
+            for stat, value in {"size": 1, "hits": 1, "misses": 1}.items():
+                self.assertEqual(REGISTRY.get_sample_value("digibuddy_query_embedding_cache", {"stat": stat}), value)
+            self.assertEqual(REGISTRY.get_sample_value("digibuddy_response_cache", {"stat": "hits"}), 1)
+            self.assertEqual(REGISTRY.get_sample_value("digibuddy_response_cache", {"stat": "misses"}), 0)
+
+
+class AhoCorasickTests(SimpleTestCase):
+    def test_matches_agree_with_brute_force(self):
+        rng = random.Random(7)
+        for _ in range(200):
+            patterns = ["".join(rng.choice("ab") for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 6))]
+            text = "".join(rng.choice("abc") for _ in range(40))
+            expected = sorted(
+                (start, pattern) for pattern in set(patterns)
+                for start in range(len(text)) if text.startswith(pattern, start)
+            )
+            self.assertEqual(sorted(AhoCorasick(patterns).iter_matches(text)), expected)
+
+    def test_word_start(self):
+        matcher = AhoCorasick(["kill him", "overdose"], word_start=True)
+        self.assertIsNone(matcher.search("a skill him"))
+        self.assertEqual(matcher.search("he overdosed"), "overdose")
+
+
+class CrisisDetectionTests(SimpleTestCase):
+    def test_normalizes_case_spacing_and_apostrophes(self):
+        self.assertEqual(find_crisis_indicators("I  DON’T want\nto live, I want to die"),
+                         ["don't want to live", "want to die"])
+
+    def test_benign_messages(self):
+        self.assertFalse(contains_crisis_indicators("How can I sleep better before exams?"))
+        self.assertFalse(contains_crisis_indicators("I need the skill himself taught me"))
+
+    def test_informational_questions_are_not_crises(self):
+        for message in [
+            "What are the warning signs of suicide?",
+            "How do I tell chest pain from anxiety?",
+            "What does a heart attack feel like?",
+            "Why do people say they can't breathe during a panic attack?",
+            "My grandfather had a heart attack last year, how can I support him?",
+        ]:
+            self.assertEqual(find_crisis_indicators(message), [], message)
+
+    def test_first_person_emergencies_are_crises(self):
+        for message in [
+            "I think I'm having a heart attack",
+            "I can't breathe and my chest hurts",
+            "I have chest pain",
+            "I've been thinking about suicide",
+            "I am feeling suicidal",
+        ]:
+            self.assertTrue(contains_crisis_indicators(message), message)
+
+    def test_crisis_reply_is_sent_without_calling_gemini(self):
+        service = ChatService.__new__(ChatService)
+        with mock.patch.object(ChatService, "_build_prompt") as build_prompt, \
+                mock.patch("chat_api.services.chat_service.get_chat_model") as get_chat_model:
+            response = service.generate_response("I want to kill myself")
+        build_prompt.assert_not_called()
+        get_chat_model.assert_not_called()
+        self.assertEqual(response["response"], load_crisis_response())
+        self.assertTrue(response["crisis_detected"])
+
+
+def _unit_vector(cosine):
+    """2-d unit vector whose cosine similarity with [1, 0] is `cosine`"""
+    return [cosine, (1 - cosine ** 2) ** 0.5]
+
+
+class SemanticResponseCacheTests(SimpleTestCase):
+    def test_only_questions_above_the_threshold_hit(self):
+        cache = SemanticResponseCache(similarity_threshold=0.95)
+        cache.store([1.0, 0.0], {"response": "Keep a routine"})
+
+        self.assertEqual(cache.lookup(_unit_vector(0.96)), {"response": "Keep a routine"})
+        self.assertIsNone(cache.lookup(_unit_vector(0.94)))
+        self.assertIsNone(cache.lookup([0.0, 1.0]))
+        self.assertEqual(cache.stats(), {"size": 1, "hits": 1, "misses": 2})
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = SemanticResponseCache(max_entries=2)
+        cache.store([1.0, 0.0, 0.0], {"response": "first"})
+        cache.store([0.0, 1.0, 0.0], {"response": "second"})
+        cache.lookup([1.0, 0.0, 0.0])
+        cache.store([0.0, 0.0, 1.0], {"response": "third"})
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.lookup([0.0, 1.0, 0.0]))
+        self.assertEqual(cache.lookup([1.0, 0.0, 0.0]), {"response": "first"})
+        self.assertEqual(cache.lookup([0.0, 0.0, 1.0]), {"response": "third"})
+
+    def test_entries_are_copied(self):
+        cache = SemanticResponseCache()
+        response = {"response": "Keep a routine"}
+        cache.store([1.0, 0.0], response)
+        response["response"] = "changed"
+        cache.lookup([1.0, 0.0])["response"] = "changed again"
+        self.assertEqual(cache.lookup([1.0, 0.0]), {"response": "Keep a routine"})
+
+    def test_crisis_and_personal_messages_are_not_generic(self):
+        self.assertTrue(is_generic_question("What helps with exam stress?"))
+        for message in [
+            "Is an overdose of sleeping pills dangerous?",
+            "How can I sleep better?",
+            "Email tips to jane@example.com",
+            "Call +44 20 7946 0958 about therapy",
+            "Is https://example.com/quiz a good test?",
+        ]:
+            with self.subTest(message=message):
+                self.assertFalse(is_generic_question(message))
+
+    def test_chat_service_bypasses_the_cache_for_personal_messages(self):
+        service = ChatService.__new__(ChatService)
+        service.response_cache = SemanticResponseCache()
+        service.document_store = mock.Mock()
+        service.document_store.embed_query.return_value = [1.0, 0.0]
+
+        self.assertEqual(service._lookup_cached_response("My exams stress me out"), (None, None))
+        # Follow-ups depend on the earlier turns
+        self.assertEqual(
+            service._lookup_cached_response("What helps with exam stress?", {"text": "user: earlier turn"}),
+            (None, None),
+        )
+        service.document_store.embed_query.assert_not_called()
+        self.assertEqual(service._lookup_cached_response("What helps with exam stress?"), (None, [1.0, 0.0]))
+
+
+class SingleFlightTests(SimpleTestCase):
+    def _call_concurrently(self, flight, upstream, callers=5):
+        """Run `callers` threads through the flight; upstream is released once they all joined it"""
+        release = threading.Event()
+        calls = []
+        outcomes = []
+
+        def blocked_upstream():
+            calls.append(1)
+            release.wait(5)
+            return upstream()
+
+        def caller():
+            try:
+                outcomes.append(flight.do("key", blocked_upstream))
+            except Exception as e:
+                outcomes.append(e)
+
+        threads = [threading.Thread(target=caller) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        labels = {"name": flight.name, "result": "shared"}
+        deadline = time.monotonic() + 5
+        while (REGISTRY.get_sample_value("digibuddy_single_flight_calls_total", labels) or 0) < callers - 1:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        return calls, outcomes
+
+    def test_concurrent_identical_calls_share_one_result(self):
+        flight = SingleFlight("test_shared_result")
+        calls, outcomes = self._call_concurrently(flight, lambda: {"text": "answer"})
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(outcomes), 5)
+        self.assertTrue(all(outcome is outcomes[0] for outcome in outcomes))
+        # Nothing is cached once the call has finished
+        self.assertEqual(flight.do("key", lambda: "fresh"), "fresh")
+
+    def test_concurrent_identical_calls_share_one_exception(self):
+        flight = SingleFlight("test_shared_error")
+
+        def upstream():
+            raise google_exceptions.ServiceUnavailable("down")
+
+        calls, outcomes = self._call_concurrently(flight, upstream)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(outcomes), 5)
+        self.assertTrue(all(outcome is outcomes[0] for outcome in outcomes))
+        self.assertIsInstance(outcomes[0], google_exceptions.ServiceUnavailable)
+
+    def test_async_callers_share_one_task_and_survive_cancellation(self):
+        flight = SingleFlight("test_async")
+        calls = []
+
+        async def upstream():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "answer"
+
+        async def scenario():
+            callers = [asyncio.ensure_future(flight.ado("key", upstream)) for _ in range(5)]
+            await asyncio.sleep(0.01)
+            callers[0].cancel()
+            return await asyncio.gather(*callers[1:])
+
+        self.assertEqual(asyncio.run(scenario()), ["answer"] * 4)
+        self.assertEqual(len(calls), 1)
+
+
+class FlakyEmbeddingBackend(FakeEmbeddingBackend):
+    """Fails the first `failures` calls with `error`, then embeds like the fake backend"""
+
+    def __init__(self, failures, error):
+        super().__init__()
+        self.failures = failures
+        self.error = error
+
+    def embed_batch(self, model, texts, task_type):
+        if self.failures:
+            self.failures -= 1
+            self.calls += 1
+            raise self.error
+        return super().embed_batch(model, texts, task_type)
+
+
+class EmbeddingClientTests(SimpleTestCase):
+    def setUp(self):
+        self.delays = []
+
+    def _client(self, backend, **options):
+        options.setdefault("requests_per_minute", 600000)
+        return EmbeddingClient(backend=backend, backoff_base=1.0, backoff_max=8.0, sleep=self.delays.append,
+                               **options)
+
+    def test_texts_are_embedded_in_batches(self):
+        backend = FakeEmbeddingBackend()
+        texts = [f"batching text {i}" for i in range(7)]
+
+        embeddings = self._client(backend, batch_size=3).embed(texts)
+        self.assertEqual(backend.calls, 3)
+        self.assertEqual(backend.texts_embedded, 7)
+        # Results keep the order of the texts across batches
+        self.assertEqual(embeddings, [backend.embed_text(text) for text in texts])
+
+    def test_transient_errors_are_retried_with_backoff(self):
+        backend = FlakyEmbeddingBackend(2, RetryableEmbeddingError("429 quota", code=429))
+
+        embeddings = self._client(backend, max_retries=3).embed(["retried text"])
+        self.assertEqual(embeddings, [backend.embed_text("retried text")])
+        self.assertEqual(backend.calls, 3)
+        # Exponential backoff with jitter of up to half the delay
+        self.assertEqual(len(self.delays), 2)
+        self.assertTrue(0.5 <= self.delays[0] <= 1.0)
+        self.assertTrue(1.0 <= self.delays[1] <= 2.0)
+
+    def test_retries_give_up_after_max_retries(self):
+        backend = FlakyEmbeddingBackend(5, google_exceptions.ServiceUnavailable("down"))
+
+        with self.assertRaises(EmbeddingError):
+            self._client(backend, max_retries=2).embed(["unlucky text"])
+        self.assertEqual(backend.calls, 3)
+        self.assertEqual(len(self.delays), 2)
+
+    def test_other_errors_are_not_retried(self):
+        backend = FlakyEmbeddingBackend(1, google_exceptions.InvalidArgument("bad request"))
+        client = self._client(backend, batch_size=1)
+
+        # The failed batch comes back as None, the others are embedded
+        embeddings = client.embed_many(["rejected text", "accepted text"])
+        self.assertIsNone(embeddings[0])
+        self.assertEqual(embeddings[1], backend.embed_text("accepted text"))
+        self.assertEqual(backend.calls, 2)
+        self.assertEqual(self.delays, [])
+        backend.failures = 1
+        with self.assertRaises(EmbeddingError):
+            client.embed_query("rejected query")
+
+    def test_rate_limiter_waits_for_a_token(self):
+        clock = FakeClock()
+        waits = []
+
+        def sleep(seconds):
+            waits.append(seconds)
+            clock.now += seconds
+
+        limiter = RateLimiter(60, burst=2, clock=clock, sleep=sleep)
+        limiter.acquire()
+        limiter.acquire()
+        self.assertEqual(waits, [])
+        # The bucket is empty; one token comes back every second
+        limiter.acquire()
+        self.assertEqual(waits, [1.0])
+        clock.now += 5
+        limiter.acquire()
+        limiter.acquire()
+        self.assertEqual(waits, [1.0])
+
+    def test_cached_embeddings_are_keyed_by_backend(self):
+        fake = EmbeddingClient(backend=FakeEmbeddingBackend())
+        gemini = EmbeddingClient(backend=GeminiEmbeddingBackend())
+        self.assertEqual(gemini.cache_model, EMBEDDING_MODEL)
+        self.assertNotEqual(fake.cache_model, gemini.cache_model)
+        self.assertEqual(fake.cache_model, embedding_cache_model("fake"))
+
+
+class VectorIndexTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        self.vectors = rng.normal(size=(200, 16)).astype(np.float32)
+        self.index = VectorIndex(initial_capacity=4)
+        self.index.add_many(enumerate(self.vectors))
+
+    def _exact(self, query, top_k):
+        normalized = self.vectors / np.linalg.norm(self.vectors, axis=1, keepdims=True)
+        scores = normalized @ (query / np.linalg.norm(query))
+        return [int(i) for i in np.argsort(-scores)[:top_k]]
+
+    def test_top_k_is_ordered_by_cosine_similarity(self):
+        query = self.vectors[7] + 0.1
+        results = self.index.search(query, top_k=10)
+        self.assertEqual([item_id for item_id, _ in results], self._exact(query, 10))
+        scores = [score for _, score in results]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        self.assertAlmostEqual(self.index.search(self.vectors[7], top_k=1)[0][1], 1.0, places=5)
+        self.assertEqual(len(self.index.search(query, top_k=500)), 200)
+
+    def test_min_score_keeps_only_higher_similarities(self):
+        index = VectorIndex()
+        index.add_many([("same", [1.0, 0.0]), ("close", _unit_vector(0.8)), ("far", [0.0, 1.0])])
+        self.assertEqual([item_id for item_id, _ in index.search([1.0, 0.0], top_k=3, min_score=0.7)],
+                         ["same", "close"])
+        self.assertEqual(index.search([1.0, 0.0], top_k=3, min_score=1.0), [])
+
+    def test_zero_vectors_score_zero(self):
+        index = VectorIndex()
+        index.add_many([("zero", [0.0, 0.0]), ("unit", [1.0, 0.0])])
+        self.assertEqual(index.search([1.0, 0.0], top_k=2), [("unit", 1.0), ("zero", 0.0)])
+        self.assertEqual([score for _, score in index.search([0.0, 0.0], top_k=2)], [0.0, 0.0])
+        self.assertEqual(index.search([0.0, 0.0], top_k=2, min_score=0.0), [])
+
+    def test_adding_an_existing_id_replaces_its_vector(self):
+        self.index.add(7, -self.vectors[7])
+        self.assertEqual(len(self.index), 200)
+        self.assertNotEqual(self.index.search(self.vectors[7], top_k=1)[0][0], 7)
+        self.assertAlmostEqual(self.index.search(-self.vectors[7], top_k=1)[0][1], 1.0, places=5)
+        with self.assertRaises(ValueError):
+            self.index.add(7, [1.0, 0.0])
+
+    def test_removing_keeps_the_other_rows_searchable(self):
+        copy = self.index.copy()
+        self.assertTrue(self.index.remove(7))
+        self.assertFalse(self.index.remove(7))
+        self.assertEqual(len(self.index), 199)
+        # The last row moved into the freed slot
+        self.assertEqual(self.index.search(self.vectors[199], top_k=1)[0][0], 199)
+        self.assertNotIn(7, [item_id for item_id, _ in self.index.search(self.vectors[7], top_k=5)])
+        # The copy is left alone
+        self.assertEqual(copy.search(self.vectors[7], top_k=1)[0][0], 7)
+
+
+class IVFIndexTests(SimpleTestCase):
+    def setUp(self):
+        # Clustered data, like embeddings of documents on a handful of topics
+        rng = np.random.default_rng(5)
+        centers = rng.normal(size=(20, 32))
+        self.vectors = (centers[rng.integers(0, 20, 2000)] + 1.2 * rng.normal(size=(2000, 32))).astype(np.float32)
+        self.queries = (centers[rng.integers(0, 20, 50)] + 1.2 * rng.normal(size=(50, 32))).astype(np.float32)
+        self.exact = VectorIndex()
+        self.exact.add_many(enumerate(self.vectors))
+        self.index = IVFIndex(n_lists=20, n_probe=4, min_train_size=1000)
+        self.index.add_many(enumerate(self.vectors))
+
+    def _recall(self, index, top_k=10, **options):
+        found = 0
+        for query in self.queries:
+            expected = {item_id for item_id, _ in self.exact.search(query, top_k=top_k)}
+            found += len(expected & {item_id for item_id, _ in index.search(query, top_k=top_k, **options)})
+        return found / (top_k * len(self.queries))
+
+    def test_recall_compared_with_exact_search(self):
+        self.assertTrue(self.index.is_trained)
+        recall = self._recall(self.index)
+        self.assertGreaterEqual(recall, 0.95)
+        # Fewer probed lists, lower recall
+        self.assertLess(self._recall(self.index, n_probe=1), recall)
+        # Probing every list is exact
+        self.assertEqual(self._recall(self.index, n_probe=20), 1.0)
+
+    def test_untrained_index_searches_exhaustively(self):
+        index = IVFIndex(n_lists=20)
+        index.add_many(enumerate(self.vectors[:100]))
+        self.assertFalse(index.is_trained)
+        self.assertEqual(index.search(self.queries[0], top_k=5), VectorIndex.search(index, self.queries[0], top_k=5))
+
+    def test_save_and_load_keep_vectors_and_centroids(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = Path(directory.name) / "ivf_index.npz"
+        self.index.remove(3)
+        self.index.save(path)
+
+        loaded = IVFIndex.load(path)
+        self.assertEqual(len(loaded), len(self.index))
+        np.testing.assert_array_equal(loaded.centroids, self.index.centroids)
+        for query in self.queries[:10]:
+            self.assertEqual(loaded.search(query, top_k=10), self.index.search(query, top_k=10))
+        # Tuning can be changed without retraining
+        self.assertEqual(IVFIndex.load(path, n_probe=20).n_probe, 20)
+        # New vectors go to the loaded centroids
+        loaded.add("new", self.vectors[3])
+        self.assertEqual(loaded.search(self.vectors[3], top_k=1)[0][0], "new")
+
+
+class EmbeddingCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / "embeddings.json"
+
+    def test_entries_are_keyed_by_content_and_model(self):
+        cache = EmbeddingCache(self.path)
+        cache.set("model", "Slow breathing lowers stress.", [1.0, 0.0])
+
+        self.assertEqual(cache.get("model", "Slow breathing lowers stress."), [1.0, 0.0])
+        self.assertIsNone(cache.get("model", "Slow breathing lowers stress"))
+        self.assertIsNone(cache.get("other-model", "Slow breathing lowers stress."))
+        self.assertEqual(embedding_key("model", "text"), embedding_key("model", "text"))
+        self.assertNotEqual(embedding_key("model", "text"), embedding_key("other-model", "text"))
+
+    def test_saved_entries_are_loaded_again(self):
+        cache = EmbeddingCache(self.path)
+        cache.set("model", "text", [1.0, 0.0])
+        cache.save()
+        self.assertEqual(EmbeddingCache(self.path).get("model", "text"), [1.0, 0.0])
+
+    def test_chunks_with_cached_text_are_not_embedded_again(self):
+        backend = FakeEmbeddingBackend()
+        client = EmbeddingClient(backend=backend, requests_per_minute=600000)
+        docs_dir = self.path.parent
+        store = DocumentStore(docs_dir=str(docs_dir), embedding_client=client, query_cache=QueryEmbeddingCache())
+        store.add_document("Slow breathing lowers stress.", "stress.txt")
+        store.add_document("Slow breathing lowers stress.", "copy.txt")
+        self.assertEqual(backend.texts_embedded, 1)
+
+        # Another model does not reuse the embeddings
+        other = EmbeddingClient(backend=backend, model="models/other-embedding", requests_per_minute=600000)
+        other_store = DocumentStore(docs_dir=str(docs_dir), embedding_client=other, query_cache=QueryEmbeddingCache())
+        other_store._ensure_document_embeddings()
+        self.assertEqual(backend.texts_embedded, 2)
+
+
+class DocumentStoreSingletonTests(SimpleTestCase):
+    def test_one_store_is_shared_by_all_threads(self):
+        created = []
+
+        def create_store():
+            time.sleep(0.01)  # Slow enough for the other threads to race the first one
+            store = mock.Mock()
+            created.append(store)
+            return store
+
+        stores = []
+        with mock.patch("chat_api.services.document_store._document_store", None), \
+                mock.patch("chat_api.services.document_store.DocumentStore", side_effect=create_store):
+            threads = [threading.Thread(target=lambda: stores.append(get_document_store())) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertIs(get_document_store(), created[0])
+
+        self.assertEqual(len(created), 1)
+        self.assertTrue(all(store is created[0] for store in stores))
+        created[0].start_watching.assert_called_once_with()
+
+
+class KnowledgeBaseTestCase(SimpleTestCase):
+    """A temporary knowledge base directory and stores embedding with the offline backend"""
+
+    DOCUMENTS = [
+        {"content": "Keep a regular sleep schedule. " * 40, "source": "sleep.txt"},
+        {"content": "Slow breathing lowers stress. " * 40, "source": "stress.txt", "metadata": {"topic": "stress"}},
+    ]
+
+    def setUp(self):
+        docs_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(docs_dir.cleanup)
+        self.docs_dir = Path(docs_dir.name)
+        self.backend = FakeEmbeddingBackend()
+        # What the stores key their embeddings by, for pack_knowledge_base
+        self.model = embedding_cache_model(self.backend.name)
+
+    def _store(self, **options):
+        client = EmbeddingClient(backend=self.backend, requests_per_minute=600000)
+        options.setdefault("docs_dir", str(self.docs_dir))
+        return DocumentStore(embedding_client=client, query_cache=QueryEmbeddingCache(), **options)
+
+
+class DocumentStoreReloadTests(KnowledgeBaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = self._store()
+        self.store.add_documents(self.DOCUMENTS)
+
+    def _write(self, name, content, source):
+        (self.docs_dir / name).write_text(json.dumps({"content": content, "source": source, "metadata": {}}))
+
+    def test_reload_applies_only_the_delta(self):
+        before = self.store.snapshot
+        embedded = self.backend.texts_embedded
+        self._write("exams.json", "Plan revision in short blocks. " * 40, "exams.txt")
+        (self.docs_dir / "sleep.json").unlink()
+
+        self.assertEqual(self.store.reload(), {"added": 1, "changed": 0, "removed": 1})
+        # Only the new document's chunks were embedded
+        new_chunks = [chunk_id for chunk_id in self.store.chunks if chunk_id[0] == "exams.txt"]
+        self.assertEqual(self.backend.texts_embedded - embedded, len(new_chunks))
+        self.assertEqual(self.store.version, before.version + 1)
+        self.assertEqual(sorted(doc["source"] for doc in self.store.documents), ["exams.txt", "stress.txt"])
+        self.assertEqual(len(self.store.index), len(self.store.chunks))
+        # The replaced snapshot is left as it was for queries still using it
+        self.assertIn(("sleep.txt", 0), before.chunks)
+        self.assertIn(("sleep.txt", 0), before.index)
+        self.assertNotIn(("exams.txt", 0), before.lexical_index)
+        self.assertEqual(self.store.get_relevant_chunks("plan revision in short blocks")[0]["source"], "exams.txt")
+
+    def test_touched_and_unchanged_files_keep_the_version(self):
+        before = self.store.snapshot
+        files = dict(before.files)
+        self.assertIsNone(self.store.reload())
+        os.utime(self.docs_dir / "sleep.json", ns=(0, 0))
+        self.assertIsNone(self.store.reload())
+        self.assertEqual(self.store.version, before.version)
+        # The new signatures are published in a copy, the snapshot queries hold is left alone
+        self.assertIsNot(self.store.snapshot, before)
+        self.assertEqual(before.files, files)
+        self.assertIsNone(self.store.reload())
+
+    def test_embedding_on_first_query_publishes_a_copy(self):
+        # The same documents without their cached embeddings
+        cold_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cold_dir.cleanup)
+        for file in self.docs_dir.glob("*.json"):
+            file.rename(Path(cold_dir.name) / file.name)
+        self.docs_dir = Path(cold_dir.name)
+        store = self._store()
+        before = store.snapshot
+        self.assertTrue(before.has_unembedded_chunks)
+
+        self.assertEqual(store.get_relevant_chunks("breathing stress")[0]["source"], "stress.txt")
+        self.assertFalse(store.has_unembedded_chunks)
+        self.assertEqual(store.version, before.version + 1)
+        # Queries still ranking against the old snapshot never see a half-added vector
+        self.assertEqual(len(before.index), 0)
+        self.assertTrue(all(chunk["embedding"] is None for chunk in before.chunks.values()))
+
+    def test_changed_file_replaces_its_chunks(self):
+        self._write("stress.json", "Grounding: name five things you can see.", "stress.txt")
+        self.assertEqual(self.store.reload(), {"added": 0, "changed": 1, "removed": 0})
+        self.assertEqual([chunk_id for chunk_id in self.store.chunks if chunk_id[0] == "stress.txt"],
+                         [("stress.txt", 0)])
+        self.assertEqual(len(self._store().chunks), len(self.store.chunks))
+
+    def test_other_processes_reuse_saved_embeddings(self):
+        # Each store has its own copy of the embedding cache, like a worker process
+        other = self._store()
+        self._write("exams.json", "Plan revision in short blocks. " * 40, "exams.txt")
+        self.store.reload()
+        embedded = self.backend.texts_embedded
+
+        self.assertEqual(other.reload(), {"added": 1, "changed": 0, "removed": 0})
+        self.assertFalse(other.has_unembedded_chunks)
+        self.assertEqual(self.backend.texts_embedded, embedded)
+
+    def test_saving_merges_entries_of_other_processes(self):
+        path = self.docs_dir / "cache.json"
+        first, second = EmbeddingCache(path), EmbeddingCache(path)
+        first.set("model", "first text", [1.0])
+        first.save()
+        second.set("model", "second text", [2.0])
+        second.save()
+
+        merged = EmbeddingCache(path)
+        self.assertEqual(merged.get("model", "first text"), [1.0])
+        self.assertEqual(merged.get("model", "second text"), [2.0])
+
+
+class RetrievalRankingTests(KnowledgeBaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = self._store()
+        self.store.add_documents(self.DOCUMENTS + [
+            {"content": "Short walks help with stress and sleep. " * 5, "source": "walks.txt"},
+        ])
+
+    def test_reciprocal_rank_fusion_favours_ids_in_both_rankings(self):
+        fused = reciprocal_rank_fusion([[("a", 0.9), ("b", 0.8)], [("b", 5.0), ("c", 4.0)]])
+        self.assertEqual([item_id for item_id, _ in fused], ["b", "a", "c"])
+        self.assertAlmostEqual(fused[0][1], 1 / 62 + 1 / 61)
+
+    def test_hybrid_results_pass_the_similarity_threshold(self):
+        results = self.store.get_relevant_chunks("slow breathing lowers stress", top_k=5)
+        # walks.txt matches "stress" lexically but is not similar enough to be used
+        self.assertEqual([result["source"] for result in results], ["stress.txt"])
+        self.assertEqual(results[0]["retrieval"], "hybrid")
+        self.assertGreaterEqual(results[0]["similarity"], DocumentStore.SIMILARITY_THRESHOLD)
+
+    def test_lexical_fallback_when_no_chunk_is_similar(self):
+        results = self.store.get_relevant_chunks("slow breathing", top_k=5, similarity_threshold=1.01)
+        self.assertEqual([(result["source"], result["retrieval"]) for result in results], [("stress.txt", "lexical")])
+        self.assertIsNone(results[0]["similarity"])
+        self.assertGreaterEqual(results[0]["lexical_score"], DocumentStore.LEXICAL_MIN_SCORE)
+
+    def test_weak_lexical_matches_are_not_used(self):
+        self.assertEqual(self.store.get_relevant_chunks("stress", top_k=5, similarity_threshold=1.01), [])
+        self.assertEqual(self.store.get_relevant_chunks("weather in paris", top_k=5), [])
+
+    def test_lexical_fallback_when_the_query_cannot_be_embedded(self):
+        with mock.patch.object(self.store.embedding_client, "embed_query", side_effect=EmbeddingError("quota")):
+            results = self.store.get_relevant_chunks("slow breathing", top_k=5)
+        self.assertEqual([(result["source"], result["retrieval"]) for result in results], [("stress.txt", "lexical")])
+
+
+class PackedKnowledgeBaseTests(KnowledgeBaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self._store().add_documents(self.DOCUMENTS)
+
+    def test_migration_keeps_documents_and_embeddings(self):
+        files_store = self._store()
+        call_command("pack_knowledge_base", docs_dir=str(self.docs_dir), model=self.model, remove_files=True,
+                     stdout=io.StringIO())
+        self.assertEqual(list(self.docs_dir.glob("*.json")), [])
+
+        embedded = self.backend.texts_embedded
+        store = self._store()
+        self.assertEqual(store.layout.name, "packed")
+        self.assertIsInstance(store.embedding_cache, PackedEmbeddingCache)
+        self.assertEqual(sorted(store.chunks), sorted(files_store.chunks))
+        self.assertFalse(store.has_unembedded_chunks)
+        self.assertEqual(self.backend.texts_embedded, embedded)
+        self.assertEqual(store.get_relevant_chunks("breathing stress")[0]["metadata"], {"topic": "stress"})
+        header = PackedEmbeddingCache.read_header(self.docs_dir / "packed" / "embeddings.f32")
+        self.assertEqual((header["model"], header["count"]), (store.embedding_model, len(store.index)))
+
+    def test_packed_store_adds_and_reloads_documents(self):
+        call_command("pack_knowledge_base", docs_dir=str(self.docs_dir), model=self.model, stdout=io.StringIO())
+        store = self._store()
+        other = self._store()
+        store.add_documents([{"content": "Plan revision in short blocks. " * 40, "source": "exams.txt"}])
+
+        self.assertEqual(other.reload(), {"added": 1, "changed": 0, "removed": 0})
+        self.assertEqual(sorted(doc["source"] for doc in other.documents), ["exams.txt", "sleep.txt", "stress.txt"])
+        # Embeddings written by the first store are mapped, not computed again
+        self.assertFalse(self._store().has_unembedded_chunks)
+
+    def test_saving_keeps_rows_of_other_processes(self):
+        path = self.docs_dir / "embeddings.f32"
+        first, second = PackedEmbeddingCache(path, "model"), PackedEmbeddingCache(path, "model")
+        first.set("model", "first text", [1.0, 0.0])
+        first.save()
+        second.set("model", "second text", [0.0, 2.0])
+        second.save()
+
+        merged = PackedEmbeddingCache(path, "model")
+        self.assertEqual(list(merged.get("model", "first text")), [1.0, 0.0])
+        self.assertEqual(list(merged.get("model", "second text")), [0.0, 2.0])
+        self.assertEqual(len(merged), 2)
+
+
+@skipUnless(mongomock, "needs mongomock (pip install -r benchmarks/requirements.txt)")
+class MongoKnowledgeBaseTests(KnowledgeBaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db = mongomock.MongoClient()["digibuddy"]
+
+    def _replica(self):
+        # Each replica has its own directory for the local index files
+        docs_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(docs_dir.cleanup)
+        return self._store(docs_dir=docs_dir.name, layout=MongoLayout(self.db))
+
+    def _pack(self):
+        with mock.patch("chat_api.services.mongo_client.mongo_db", return_value=self.db):
+            call_command("pack_knowledge_base", docs_dir=str(self.docs_dir), model=self.model, storage="mongo",
+                         stdout=io.StringIO())
+
+    def test_documents_are_embedded_once_for_all_replicas(self):
+        first = self._replica()
+        first.add_documents(self.DOCUMENTS)
+        embedded = self.backend.texts_embedded
+
+        second = self._replica()
+        self.assertEqual(sorted(second.chunks), sorted(first.chunks))
+        self.assertFalse(second.has_unembedded_chunks)
+        self.assertIsNone(second.reload())
+
+        first.add_documents([{"content": "Plan revision in short blocks. " * 40, "source": "exams.txt"}])
+        self.assertIsNone(first.reload())
+        self.assertEqual(second.reload(), {"added": 1, "changed": 0, "removed": 0})
+        self.assertFalse(second.has_unembedded_chunks)
+        new_chunks = [chunk_id for chunk_id in second.chunks if chunk_id[0] == "exams.txt"]
+        self.assertEqual(self.backend.texts_embedded - embedded, len(new_chunks))
+
+    def test_packing_again_deletes_removed_sources(self):
+        self._store().add_documents(self.DOCUMENTS)
+        self._pack()
+        replica = self._replica()
+        self.assertEqual(sorted(doc["source"] for doc in replica.documents), ["sleep.txt", "stress.txt"])
+
+        (self.docs_dir / "sleep.json").unlink()
+        self._pack()
+        self.assertEqual(self.db.kb_documents.distinct("_id"), ["stress.txt"])
+        self.assertEqual(replica.reload(), {"added": 0, "changed": 0, "removed": 1})
+        self.assertEqual([doc["source"] for doc in replica.documents], ["stress.txt"])
+        self.assertNotIn(("sleep.txt", 0), replica.chunks)
+
+
+    def test_evaluate_retrieval_leaves_the_shared_knowledge_base_alone(self):
+        document = self.docs_dir / "sleep.txt"
+        document.write_text("Keep a regular sleep schedule. " * 40)
+        queries = self.docs_dir / "queries.jsonl"
+        queries.write_text(json.dumps({"query": "sleep schedule", "relevant": ["sleep.txt"]}) + "\n")
+        with mock.patch.dict(os.environ, {"KB_STORAGE": "mongo"}), \
+                mock.patch("chat_api.services.mongo_client.mongo_db", return_value=self.db):
+            call_command("evaluate_retrieval", str(queries), document=[str(document)], repeat=1, stdout=io.StringIO())
+        self.assertEqual(self.db.list_collection_names(), [])
+
+
+@skipUnless(mongomock, "needs mongomock (pip install -r benchmarks/requirements.txt)")
+class EnsureMongoIndexesTests(SimpleTestCase):
+    def setUp(self):
+        self.db = mongomock.MongoClient()["digibuddy"]
+
+    def _ensure(self):
+        with mock.patch("chat_api.management.commands.ensure_mongo_indexes.mongo_db", return_value=self.db):
+            call_command("ensure_mongo_indexes", stdout=io.StringIO(), stderr=io.StringIO())
+
+    def _declared(self):
+        return {
+            collection: {index.document["name"]: index.document for index in indexes}
+            for collection, indexes in INDEXES.items()
+        }
+
+    def test_declared_indexes_are_created_once(self):
+        self._ensure()
+        created = {collection: self.db[collection].index_information() for collection in INDEXES}
+        self._ensure()
+        self.assertEqual({collection: self.db[collection].index_information() for collection in INDEXES}, created)
+
+        for collection, indexes in self._declared().items():
+            for name, declared in indexes.items():
+                with self.subTest(collection=collection, index=name):
+                    index = created[collection][name]
+                    self.assertEqual(list(index["key"]), list(declared["key"].items()))
+                    # mongomock does not keep partialFilterExpression, so only the key and uniqueness are compared
+                    self.assertEqual(index.get("unique", False), declared.get("unique", False))
+            # Only the declared indexes and the default one on _id
+            self.assertEqual(set(created[collection]), set(indexes) | {"_id_"})
+
+    def test_existing_duplicates_fail_the_command(self):
+        self.db.users.insert_many([{"email": "student@example.com"}, {"email": "student@example.com"}])
+        with self.assertRaises(CommandError):
+            self._ensure()
+        # The other collections still get their indexes
+        self.assertIn("user_id_created_at_id", self.db.chats.index_information())
+        self.assertEqual(ensure_indexes(self.db.client["other"])["users"], ["email_unique"])
+
+
+@skipUnless(mongomock, "needs mongomock (pip install -r benchmarks/requirements.txt)")
+class ConversationTurnsTests(SimpleTestCase):
+    def setUp(self):
+        self.db = mongomock.MongoClient()["digibuddy"]
+        self.conversation_id = resolve_conversation(self.db, 1, None)["_id"]
+
+    def _reply(self, message, status="success"):
+        """Record a turn the way the chat views do: on the conversation now, in db.chats once the writer flushes"""
+        record = {"_id": ObjectId(), "conversation_id": self.conversation_id, "message": message,
+                  "response": f"reply to {message}", "status": status, "created_at": timezone.now()}
+        record_turn(self.db, {"_id": self.conversation_id}, record)
+        return record
+
+    def _recent_messages(self):
+        conversation = resolve_conversation(self.db, 1, str(self.conversation_id))
+        return [turn["message"] for turn in load_recent_turns(self.db, conversation)]
+
+    def test_back_to_back_turns_are_seen_before_the_chat_log_is_written(self):
+        self._reply("first")
+        self.assertEqual(self._recent_messages(), ["first"])
+        self._reply("second")
+        self.assertEqual(self._recent_messages(), ["first", "second"])
+
+    def test_written_turns_are_not_duplicated(self):
+        records = [self._reply("first"), self._reply("second")]
+        self.db.chats.insert_many(records[:1])
+        self.assertEqual(self._recent_messages(), ["first", "second"])
+        self.db.chats.insert_many(records[1:])
+        self.assertEqual(self._recent_messages(), ["first", "second"])
+
+    def test_failed_and_summarized_turns_are_left_out(self):
+        first = self._reply("first")
+        self._reply("broken", status="error")
+        self._reply("second")
+        self.db.conversations.update_one(
+            {"_id": self.conversation_id},
+            {"$set": {"summarized_through": {"created_at": first["created_at"], "_id": first["_id"]}}},
+        )
+        self.assertEqual(self._recent_messages(), ["second"])
+
+
+class SnippetProjectingCursor:
+    """Cursor over mongomock records that applies the {$substrCP} projections mongomock lacks"""
+
+    def __init__(self, cursor, snippets):
+        self.cursor = cursor
+        self.snippets = snippets
+
+    def sort(self, keys):
+        self.cursor = self.cursor.sort(keys)
+        return self
+
+    def limit(self, count):
+        self.cursor = self.cursor.limit(count)
+        return self
+
+    def __iter__(self):
+        for record in self.cursor:
+            response = record.pop("response", None) or ""
+            for field, (_, start, length) in self.snippets.items():
+                record[field] = response[start:start + length]
+            yield record
+
+
+class SnippetProjectingCollection:
+    """A mongomock chats collection whose find() handles ChatHistoryView's response snippet projection"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def find(self, query, projection):
+        projection = dict(projection)
+        snippets = {
+            field: projection.pop(field)["$substrCP"] for field, value in list(projection.items())
+            if isinstance(value, dict) and "$substrCP" in value
+        }
+        return SnippetProjectingCursor(self.collection.find(query, dict(projection, response=1)), snippets)
+
+    def find_one(self, *args, **kwargs):
+        return self.collection.find_one(*args, **kwargs)
+
+
+@skipUnless(mongomock, "needs mongomock (pip install -r benchmarks/requirements.txt)")
+class ChatHistoryViewTests(SimpleTestCase):
+    def setUp(self):
+        self.db = mongomock.MongoClient()["digibuddy"]
+        db = SimpleNamespace(chats=SnippetProjectingCollection(self.db.chats))
+        patcher = mock.patch("chat_api.views.get_mongo_db", return_value=db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = SimpleNamespace(id=1, is_authenticated=True)
+        self.other_user = SimpleNamespace(id=2, is_authenticated=True)
+        start = timezone.now().replace(microsecond=0, tzinfo=None)
+        # Pairs of records with equal timestamps
+        for i in range(7):
+            self.db.chats.insert_one({
+                "user_id": self.user.id, "message": f"message {i}", "response": "reply " * 100,
+                "created_at": start + timedelta(seconds=i // 2),
+            })
+        self.foreign_id = self.db.chats.insert_one(
+            {"user_id": self.other_user.id, "message": "not yours", "response": "", "created_at": start}
+        ).inserted_id
+
+    def _get(self, view, path, user=None, **kwargs):
+        request = APIRequestFactory().get(path)
+        force_authenticate(request, user=user or self.user)
+        return view.as_view()(request, **kwargs)
+
+    def _history(self, user=None, **params):
+        return self._get(ChatHistoryView, "/api/chat/history/?" + urlencode(params), user)
+
+    def test_pages_continue_without_gaps_or_repeats(self):
+        messages, cursor = [], None
+        for _ in range(4):
+            response = self._history(limit=2, **({"cursor": cursor} if cursor else {}))
+            self.assertEqual(response.status_code, 200)
+            messages += [chat["message"] for chat in response.data["chats"]]
+            cursor = response.data["next_cursor"]
+            if cursor is None:
+                break
+        self.assertIsNone(cursor)
+        # Newest first; records sharing a timestamp are split across pages by _id
+        self.assertEqual(messages, [f"message {i}" for i in reversed(range(7))])
+        self.assertEqual(len(self._history(limit=7).data["chats"]), 7)
+        self.assertEqual(len(self._history(limit=2).data["chats"][0]["response_snippet"]),
+                         ChatHistoryView.SNIPPET_LENGTH)
+
+    def test_malformed_or_foreign_cursor_is_rejected(self):
+        cursor = self._history(limit=2).data["next_cursor"]
+        self.assertEqual(self._history(self.other_user, cursor=cursor).status_code, 400)
+        for malformed in ["not-a-cursor", base64.urlsafe_b64encode(b'["1", "yesterday", "x"]').decode()]:
+            with self.subTest(cursor=malformed):
+                self.assertEqual(self._history(cursor=malformed).status_code, 400)
+        self.assertEqual(self._history(limit=0).status_code, 400)
+
+    def test_detail_of_another_users_chat_is_not_found(self):
+        response = self._get(ChatDetailView, "/api/chat/history/x/", chat_id=str(self.foreign_id))
+        self.assertEqual(response.status_code, 404)
+        response = self._get(ChatDetailView, "/api/chat/history/x/", self.other_user, chat_id=str(self.foreign_id))
+        self.assertEqual((response.status_code, response.data["message"]), (200, "not yours"))
+        self.assertEqual(self._get(ChatDetailView, "/api/chat/history/x/", chat_id="bad-id").status_code, 404)
+
+
+class AsgiChatViewTests(SimpleTestCase):
+    """The chat views as uvicorn runs them: through the ASGI application on one event loop"""
+
+    def setUp(self):
+        from digibuddy.asgi import application
+        self.application = application
+        user = SimpleNamespace(id=1, email="student@example.com", is_authenticated=True)
+        context = {"turns": [], "summary": "", "evicted": []}
+
+        async def authenticate(request):
+            return user
+
+        async def load_context(view, user, data):
+            return {"_id": "conversation"}, (None, None), context
+
+        for target, replacement in (
+            ("chat_api.views._aauthenticate", authenticate),
+            ("chat_api.views.ChatbotView._load_context", load_context),
+            ("chat_api.views._store_chat_record", mock.AsyncMock()),
+            ("chat_api.views.schedule_summary_update", lambda *args: None),
+        ):
+            patcher = mock.patch(target, replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def _post(self, path, on_body=None):
+        """POST to the ASGI application; returns (status, body) and calls on_body(chunk) per body message"""
+        payload = json.dumps({"message": "How can I sleep better?"}).encode("utf-8")
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+            "scheme": "http", "path": path, "raw_path": path.encode("ascii"), "query_string": b"",
+            "root_path": "", "client": ("127.0.0.1", 50000), "server": ("testserver", 80),
+            "headers": [(b"host", b"testserver"), (b"content-type", b"application/json"),
+                        (b"content-length", str(len(payload)).encode("ascii"))],
+        }
+        finished = asyncio.Event()
+        messages = iter([{"type": "http.request", "body": payload, "more_body": False}])
+        response = {"status": None, "body": b""}
+
+        async def receive():
+            message = next(messages, None)
+            if message is None:
+                await finished.wait()
+                return {"type": "http.disconnect"}
+            return message
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response["body"] += message.get("body", b"")
+                if on_body is not None and message.get("body"):
+                    on_body(message["body"])
+                if not message.get("more_body", False):
+                    finished.set()
+
+        await self.application(scope, receive, send)
+        return response["status"], response["body"]
+
+    def test_stream_sends_tokens_before_generation_finishes(self):
+        first_token_sent = asyncio.Event()
+        release = asyncio.Event()
+
+        async def stream_response(service, message, context):
+            yield {"event": "token", "data": {"text": "Try "}}
+            # Only released once the client has received the first token
+            await release.wait()
+            yield {"event": "done", "data": {"response": "Try this", "status": "success"}}
+
+        def on_body(chunk):
+            if b"event: token" in chunk:
+                first_token_sent.set()
+
+        async def scenario():
+            request = asyncio.ensure_future(self._post("/api/chat/stream/", on_body))
+            await asyncio.wait_for(first_token_sent.wait(), timeout=5)
+            release.set()
+            return await asyncio.wait_for(request, timeout=5)
+
+        with mock.patch("chat_api.views.AsyncChatService.stream_response", stream_response):
+            status_code, body = asyncio.run(scenario())
+        self.assertEqual(status_code, 200)
+        self.assertIn(b"event: done", body)
+
+    def test_chat_requests_run_concurrently(self):
+        entered = []
+        both_entered = asyncio.Event()
+
+        async def generate_response(service, message, context=None):
+            entered.append(message)
+            if len(entered) == 2:
+                both_entered.set()
+            # Returns only once the other request is in flight too, so serialized views would time out
+            await asyncio.wait_for(both_entered.wait(), timeout=5)
+            return {"response": "Try this", "status": "success"}
+
+        async def scenario():
+            return await asyncio.gather(self._post("/api/chat/"), self._post("/api/chat/"))
+
+        with mock.patch("chat_api.views.AsyncChatService.generate_response", generate_response):
+            responses = asyncio.run(scenario())
+        self.assertEqual([status_code for status_code, _ in responses], [200, 200])
+        self.assertEqual([json.loads(body)["status"] for _, body in responses], ["success", "success"])
@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import ChatbotView, ChatHistoryView
+from .views import ChatbotView, ChatDetailView, ChatHistoryView, ChatStreamView, HealthView
 from .auth_views import (
     GoogleAuthInitView,
     GoogleAuthCallbackView,
@@ -8,7 +8,10 @@ from .auth_views import (
 
 urlpatterns = [
     path('chat/', ChatbotView.as_view(), name='chat'),
+    path('chat/stream/', ChatStreamView.as_view(), name='chat-stream'),
     path('chat/history/', ChatHistoryView.as_view(), name='chat-history'),
+    path('chat/history/<str:chat_id>/', ChatDetailView.as_view(), name='chat-detail'),
+    path('health/', HealthView.as_view(), name='health'),
     path('auth/google/login/', GoogleAuthInitView.as_view(), name='google-login'),
     path('auth/google/callback/', GoogleAuthCallbackView.as_view(), name='google-callback'),
     path('auth/me/', CurrentUserView.as_view(), name='current-user'),
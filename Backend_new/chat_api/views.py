@@ -1,64 +1,242 @@
+import base64
+import functools
+import inspect
+import json
+import time
+from datetime import datetime
+from asgiref.sync import sync_to_async
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
 from django.utils import timezone
-from .services.chat_service import ChatService
+from .services.chat_log_writer import get_chat_log_writer
+from .services.chat_service import AsyncChatService
+from .services.conversations import (
+    ConversationNotFound,
+    aload_recent_turns,
+    arecord_turn,
+    aresolve_conversation,
+    schedule_summary_update,
+)
+from .services.mongo_client import async_mongo_db
+from .services.metrics import REQUEST_SECONDS, time_stage
 from .services.mongo_client import mongo_db as get_mongo_db
+from .services.resilience import CLOSED, breaker_states
 import logging
 
 logger = logging.getLogger(__name__)
 
-class ChatbotView(APIView):
-    permission_classes = [IsAuthenticated]
+
+async def _aget_mongo_user_ids(email):
+    """Return (mongo _id, google id) for the user's Mongo profile, if any"""
+    mongo_user = await async_mongo_db().users.find_one({"email": email})
+    user_mongo_id = str(mongo_user["_id"]) if mongo_user else None
+    user_google_id = mongo_user.get("google_id") if mongo_user else None
+    return user_mongo_id, user_google_id
+
+
+def _chat_record(user, user_ids, conversation_id, message, response):
+    user_mongo_id, user_google_id = user_ids
+    return {
+        # Assigned here so the copy on the conversation document and the stored record share it
+        "_id": ObjectId(),
+        "user_id": user.id,
+        "user_email": user.email,
+        "user_mongo_id": user_mongo_id,
+        "user_google_id": user_google_id,
+        "conversation_id": conversation_id,
+        "message": message,
+        "response": response.get("response"),
+        "status": response.get("status"),
+        "sources": response.get("sources"),
+        "used_knowledge_base": response.get("used_knowledge_base"),
+        "crisis_detected": response.get("crisis_detected", False),
+        "created_at": timezone.now(),
+    }
+
+
+async def _store_chat_record(user, user_ids, conversation, message, response):
+    """Add the turn to the conversation, then hand the record to the write-behind writer"""
+    record = _chat_record(user, user_ids, conversation["_id"], message, response)
+    # Written before responding, so an immediate follow-up message sees this turn
+    with time_stage("turn_record"):
+        try:
+            await arecord_turn(async_mongo_db(), conversation, record)
+        except Exception as e:
+            logger.warning(f"Failed to record turn on conversation {conversation['_id']}: {e}")
+    with time_stage("chat_log_enqueue"):
+        get_chat_log_writer().submit(record)
+
+
+def _serialize_record(record):
+    record["_id"] = str(record["_id"])
+    if record.get("conversation_id") is not None:
+        record["conversation_id"] = str(record["conversation_id"])
+    return record
+
+
+CONVERSATION_NOT_FOUND = {"error": "Conversation not found"}
+
+
+async def _aauthenticate(request):
+    """Authenticate a plain Django request with the same JWT scheme the DRF views use"""
+    try:
+        result = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except (AuthenticationFailed, InvalidToken):
+        return None
+    return result[0] if result else None
+
+
+def _timed_request(view_name):
+    """Record the latency and status code of a (sync or async) view handler in REQUEST_SECONDS"""
+    def decorator(handler):
+        def observe(started, response):
+            REQUEST_SECONDS.labels(view=view_name, status=response.status_code).observe(
+                time.perf_counter() - started
+            )
+
+        if inspect.iscoroutinefunction(handler):
+            @functools.wraps(handler)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                response = await handler(*args, **kwargs)
+                observe(started, response)
+                return response
+            return async_wrapper
+
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            response = handler(*args, **kwargs)
+            observe(started, response)
+            return response
+        return wrapper
+    return decorator
+
+
+def _format_sse(event):
+    return f"event: {event['event']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+
+
+class ChatbotView(View):
+    """Chat endpoint: the complete response once generation finishes.
+
+    An async view for the ASGI server: Gemini calls and MongoDB reads and
+    writes are awaited, so one worker serves many concurrent chats while they
+    wait on the network (a sync view would run every request on the single
+    thread Django keeps for sync code). DRF views are synchronous, so this
+    is a plain Django view that accepts the same JWT and request/response
+    bodies as the DRF views.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Token-authenticated like the DRF views, so exempt from session CSRF checks
+        return csrf_exempt(super().as_view(**initkwargs))
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.chat_service = ChatService()
+        self.chat_service = AsyncChatService()
 
-    def post(self, request, *args, **kwargs):
+    async def _read_request(self, request):
+        """Return (user, message, body), or (error response, None, None)"""
+        user = await _aauthenticate(request)
+        if user is None or not user.is_authenticated:
+            return JsonResponse(
+                {"detail": "Authentication credentials were not provided."},
+                status=status.HTTP_401_UNAUTHORIZED
+            ), None, None
         try:
-            message = request.data.get('message')
-            if not message:
-                return Response(
-                    {"error": "Message is required"},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+            data = json.loads(request.body or b"{}")
+        except ValueError:
+            return JsonResponse({"error": "Invalid JSON body"}, status=status.HTTP_400_BAD_REQUEST), None, None
+        message = data.get('message')
+        if not message:
+            return JsonResponse(
+                {"error": "Message is required"},
+                status=status.HTTP_400_BAD_REQUEST
+            ), None, None
+        return user, message, data
 
-            # Get chat history if provided
-            chat_history = request.data.get('chat_history', [])
+    async def _load_context(self, user, data):
+        """Return (conversation, user ids, context); raises ConversationNotFound"""
+        # Continue the given conversation, or start a new one
+        with time_stage("conversation_lookup"):
+            conversation = await aresolve_conversation(async_mongo_db(), user.id, data.get('conversation_id'))
+        with time_stage("user_lookup"):
+            user_ids = await _aget_mongo_user_ids(user.email)
+        # Recent turns and the rolling summary, fitted to the prompt's token budget
+        with time_stage("context_load"):
+            context = self.chat_service.context_builder.build(
+                await aload_recent_turns(async_mongo_db(), conversation), conversation.get("summary")
+            )
+        return conversation, user_ids, context
 
-            # Fetch Mongo user profile
-            mongo_user = get_mongo_db().users.find_one({"email": request.user.email})
-            user_mongo_id = str(mongo_user["_id"]) if mongo_user else None
-            user_google_id = mongo_user.get("google_id") if mongo_user else None
+    @_timed_request("chat")
+    async def post(self, request, *args, **kwargs):
+        return await self._chat(request)
 
-            # Generate response
-            response = self.chat_service(message, chat_history)
+    async def _chat(self, request):
+        user, message, data = await self._read_request(request)
+        if message is None:
+            return user
 
+        try:
             try:
-                get_mongo_db().chats.insert_one({
-                    "user_id": request.user.id,
-                    "user_email": request.user.email,
-                    "user_mongo_id": user_mongo_id,
-                    "user_google_id": user_google_id,
-                    "message": message,
-                    "chat_history": chat_history,
-                    "response": response.get("response"),
-                    "status": response.get("status"),
-                    "sources": response.get("sources"),
-                    "used_knowledge_base": response.get("used_knowledge_base"),
-                    "created_at": timezone.now(),
-                })
-            except Exception as db_error:
-                logger.warning(f"Failed to store chat record: {db_error}")
-
-            return Response(response, status=status.HTTP_200_OK)
+                conversation, user_ids, context = await self._load_context(user, data)
+            except ConversationNotFound:
+                return JsonResponse(CONVERSATION_NOT_FOUND, status=status.HTTP_404_NOT_FOUND)
+            conversation_id = conversation["_id"]
+            response = await self.chat_service(message, context)
+            await _store_chat_record(user, user_ids, conversation, message, response)
+            schedule_summary_update(conversation, context, self.chat_service.context_builder)
+            return JsonResponse(dict(response, conversation_id=str(conversation_id)), status=status.HTTP_200_OK)
+        except Exception as e:
+            logger.error(f"Error in {type(self).__name__}: {str(e)}")
+            return JsonResponse(
+                {
+                    "error": "An error occurred while processing your request",
+                    "details": str(e)
+                },
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class ChatStreamView(ChatbotView):
+    """Streaming variant of ChatbotView: pushes tokens to the client as Server-Sent Events.
 
+    Emits `token` events with partial text, then a single `done` event carrying
+    the full response, sources, used_knowledge_base and conversation_id (or an
+    `error` event).
+    The chat record is stored once the stream completes. The events come from
+    an async generator, so the ASGI server sends each one as it is produced.
+    """
+
+    # Measures the time until the stream starts; the first_token stage covers Gemini
+    @_timed_request("chat_stream")
+    async def post(self, request, *args, **kwargs):
+        user, message, data = await self._read_request(request)
+        if message is None:
+            return user
+
+        try:
+            conversation, user_ids, context = await self._load_context(user, data)
+        except ConversationNotFound:
+            return JsonResponse(CONVERSATION_NOT_FOUND, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
-            logger.error(f"Error in ChatbotView: {str(e)}")
-            return Response(
+            logger.error(f"Error in ChatStreamView: {str(e)}")
+            return JsonResponse(
                 {
                     "error": "An error occurred while processing your request",
                     "details": str(e)
@@ -66,23 +244,149 @@ class ChatbotView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+        conversation_id = conversation["_id"]
+
+        async def event_stream():
+            final = None
+            async for event in self.chat_service.stream_response(message, context):
+                if event["event"] in ("done", "error"):
+                    final = event["data"]
+                    event = {"event": event["event"], "data": dict(final, conversation_id=str(conversation_id))}
+                yield _format_sse(event)
+            if final is not None:
+                await _store_chat_record(user, user_ids, conversation, message, final)
+                schedule_summary_update(conversation, context, self.chat_service.context_builder)
+
+        response = StreamingHttpResponse(event_stream(), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        # Stop nginx from buffering the stream
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+
+def _encode_cursor(record, user_id):
+    payload = json.dumps([str(user_id), record["created_at"].isoformat(), str(record["_id"])])
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor, user_id):
+    """Return (created_at, _id) from a cursor; raises ValueError if it is malformed or another user's"""
+    try:
+        owner, created_at, record_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        position = datetime.fromisoformat(created_at), ObjectId(record_id)
+    except (TypeError, ValueError, InvalidId) as e:
+        raise ValueError(f"Invalid cursor: {e}") from e
+    if owner != str(user_id):
+        raise ValueError("Invalid cursor: issued to another user")
+    return position
+
 
 class ChatHistoryView(APIView):
+    """Newest-first chat history, one page at a time.
+
+    Pages are keyset-paginated on (created_at, _id): `?cursor=` takes the
+    `next_cursor` of the previous page, so every page is an index range scan
+    no matter how far back it is. A cursor is only accepted from the user it
+    was issued to. `?limit=` sets the page size. List entries
+    carry only the conversation id, message, a response snippet and the
+    timestamp; the full
+    record is served by ChatDetailView.
+    """
     permission_classes = [IsAuthenticated]
+    DEFAULT_PAGE_SIZE = 20
+    MAX_PAGE_SIZE = 100
+    SNIPPET_LENGTH = 200
 
+    @_timed_request("chat_history")
     def get(self, request):
         try:
+            limit = int(request.query_params.get("limit", self.DEFAULT_PAGE_SIZE))
+            if not 1 <= limit <= self.MAX_PAGE_SIZE:
+                raise ValueError(limit)
+        except ValueError:
+            return Response(
+                {"error": f"limit must be an integer between 1 and {self.MAX_PAGE_SIZE}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        query = {"user_id": request.user.id}
+        cursor = request.query_params.get("cursor")
+        if cursor:
+            try:
+                created_at, record_id = _decode_cursor(cursor, request.user.id)
+            except ValueError:
+                return Response({"error": "Invalid cursor"}, status=status.HTTP_400_BAD_REQUEST)
+            query["$or"] = [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "_id": {"$lt": record_id}},
+            ]
+
+        projection = {
+            "conversation_id": 1,
+            "message": 1,
+            "created_at": 1,
+            "response_snippet": {"$substrCP": [{"$ifNull": ["$response", ""]}, 0, self.SNIPPET_LENGTH]},
+        }
+        try:
+            # One extra record tells us whether another page exists
             logs = list(
-                get_mongo_db().chats.find(
-                    {"user_id": request.user.id}
-                ).sort("created_at", -1).limit(20)
+                get_mongo_db().chats.find(query, projection)
+                .sort([("created_at", -1), ("_id", -1)])
+                .limit(limit + 1)
             )
-            for log in logs:
-                log["_id"] = str(log["_id"])
-            return Response({"chats": logs})
         except Exception as e:
             logger.error(f"Failed to fetch chat history: {e}")
             return Response(
                 {"error": "Unable to load chat history"},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
+
+        next_cursor = _encode_cursor(logs[limit - 1], request.user.id) if len(logs) > limit else None
+        logs = logs[:limit]
+        return Response({"chats": [_serialize_record(log) for log in logs], "next_cursor": next_cursor})
+
+
+class ChatDetailView(APIView):
+    """A single chat record belonging to the requesting user"""
+    permission_classes = [IsAuthenticated]
+
+    @_timed_request("chat_detail")
+    def get(self, request, chat_id):
+        try:
+            record_id = ObjectId(chat_id)
+        except InvalidId:
+            return Response({"error": "Chat not found"}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            log = get_mongo_db().chats.find_one({"_id": record_id, "user_id": request.user.id})
+        except Exception as e:
+            logger.error(f"Failed to fetch chat record: {e}")
+            return Response(
+                {"error": "Unable to load chat record"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+        if log is None:
+            return Response({"error": "Chat not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(_serialize_record(log))
+
+
+class HealthView(View):
+    """Liveness/readiness check for the load balancer and Kubernetes.
+
+    Always 200 while the process serves requests: an open Gemini circuit
+    means chats get the fallback response, not that this pod should be taken
+    out of rotation. `status` is "degraded" while any breaker is not closed.
+    """
+
+    def get(self, request, *args, **kwargs):
+        breakers = breaker_states()
+        degraded = any(breaker["state"] != CLOSED for breaker in breakers.values())
+        return JsonResponse({"status": "degraded" if degraded else "ok", "circuit_breakers": breakers})
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint.
+
+    Unauthenticated like the probes, so it should only be reachable inside
+    the cluster (the ingress does not route it).
+    """
+    return HttpResponse(generate_latest(), content_type=CONTENT_TYPE_LATEST)
@@ -22,6 +22,8 @@ const Chatbot = () => {
     }
   ]);
   const [isTyping, setIsTyping] = useState(false);
+  // Assigned by the backend on the first reply; the server keeps the conversation history
+  const [conversationId, setConversationId] = useState<string>();
   const messagesEndRef = useRef<HTMLDivElement>(null);
 
   const suggestions = [
@@ -51,11 +53,28 @@ const Chatbot = () => {
     setMessages(prev => [...prev, userMessage]);
     setIsTyping(true);
 
+    const botMessageId = Date.now() + 1;
     try {
-      // Send message to backend
-      const response = await chatService.sendMessage(messageText, messages);
+      // Stream the reply from the backend, rendering partial text as it arrives
+      const response = await chatService.streamMessage(messageText, conversationId, {
+        onToken: (text) => {
+          setIsTyping(false);
+          setMessages(prev => {
+            const existing = prev.find(m => m.id === botMessageId);
+            if (!existing) {
+              return [...prev, { id: botMessageId, text, isUser: false, timestamp: new Date() }];
+            }
+            return prev.map(m => (m.id === botMessageId ? { ...m, text: m.text + text } : m));
+          });
+        },
+      });
+
+      if (response.conversation_id) {
+        setConversationId(response.conversation_id);
+      }
 
       if (response.status === 'error') {
+        setMessages(prev => prev.filter(m => m.id !== botMessageId));
         throw new Error(response.error || 'Failed to get response');
       }
 
@@ -70,15 +89,15 @@ const Chatbot = () => {
         }
       }
 
-      // Add bot response
+      // Replace the streamed text with the final response
       const botMessage: ChatMessage = {
-        id: Date.now() + 1,
+        id: botMessageId,
         text: responseText,
         isUser: false,
         timestamp: new Date()
       };
 
-      setMessages(prev => [...prev, botMessage]);
+      setMessages(prev => [...prev.filter(m => m.id !== botMessageId), botMessage]);
     } catch (error) {
       console.error('Chat error:', error);
       toast({
@@ -11,14 +11,36 @@ export interface ChatMessage {
 
 export interface ChatResponse {
   response: string;
-  status: 'success' | 'error';
+  // 'fallback': a canned reply served while the model is unavailable
+  status: 'success' | 'fallback' | 'error';
   error?: string;
   sources?: string[] | null;
   used_knowledge_base?: boolean;
+  // Set when the server answered with its crisis resources reply
+  crisis_detected?: boolean;
+  conversation_id?: string;
 }
 
+export interface StreamHandlers {
+  onToken: (text: string) => void;
+}
+
+const parseSseEvent = (block: string): { event: string; data: string } | null => {
+  let event = 'message';
+  const data: string[] = [];
+  for (const line of block.split('\n')) {
+    if (line.startsWith('event:')) {
+      event = line.slice(6).trim();
+    } else if (line.startsWith('data:')) {
+      data.push(line.slice(5).trim());
+    }
+  }
+  return data.length ? { event, data: data.join('\n') } : null;
+};
+
 export const chatService = {
-  async sendMessage(message: string, chatHistory: ChatMessage[] = []): Promise<ChatResponse> {
+  // Omit conversationId to start a new conversation; the response carries the id to send next time.
+  async sendMessage(message: string, conversationId?: string): Promise<ChatResponse> {
     try {
       const token = localStorage.getItem(ACCESS_TOKEN_KEY);
       const response = await fetch(`${API_BASE_URL}/chat/`, {
@@ -29,7 +51,7 @@ export const chatService = {
         },
         body: JSON.stringify({
           message,
-          chat_history: chatHistory,
+          conversation_id: conversationId,
         }),
       });
 
@@ -47,4 +69,63 @@ export const chatService = {
       };
     }
   },
+
+  // Streams the reply over Server-Sent Events, calling onToken with each partial
+  // piece of text; resolves with the final response once the stream completes.
+  async streamMessage(
+    message: string,
+    conversationId: string | undefined,
+    { onToken }: StreamHandlers,
+  ): Promise<ChatResponse> {
+    try {
+      const token = localStorage.getItem(ACCESS_TOKEN_KEY);
+      const response = await fetch(`${API_BASE_URL}/chat/stream/`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          Accept: 'text/event-stream',
+          ...(token ? { Authorization: `Bearer ${token}` } : {}),
+        },
+        body: JSON.stringify({
+          message,
+          conversation_id: conversationId,
+        }),
+      });
+
+      if (!response.ok || !response.body) {
+        throw new Error('Network response was not ok');
+      }
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      for (;;) {
+        const { done, value } = await reader.read();
+        buffer += decoder.decode(value, { stream: !done });
+        let boundary = buffer.indexOf('\n\n');
+        while (boundary !== -1) {
+          const parsed = parseSseEvent(buffer.slice(0, boundary));
+          buffer = buffer.slice(boundary + 2);
+          boundary = buffer.indexOf('\n\n');
+          if (!parsed) continue;
+          const payload = JSON.parse(parsed.data);
+          if (parsed.event === 'token') {
+            onToken(payload.text);
+          } else if (parsed.event === 'done' || parsed.event === 'error') {
+            return payload as ChatResponse;
+          }
+        }
+        if (done) {
+          throw new Error('Stream ended before the response completed');
+        }
+      }
+    } catch (error) {
+      console.error('Error streaming message:', error);
+      return {
+        response: 'Sorry, I encountered an error while processing your message. Please try again later.',
+        status: 'error',
+        error: error instanceof Error ? error.message : 'Unknown error',
+      };
+    }
+  },
 }; 
\ No newline at end of file